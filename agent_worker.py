@@ -0,0 +1,104 @@
+# agent_worker.py
+"""Прогретые воркеры: тяжелые модули импортируются один раз, задачи форкаются от готового процесса."""
+import argparse
+import multiprocessing
+import os
+import sys
+import traceback
+
+# Модули, которые forkserver импортирует один раз при старте
+PRELOAD_MODULES = ["configs.config", "configs.llm", "configs.git_tools", "configs.workspace", "configs.profiling",
+                   "coder", "reviewer"]
+
+
+def run_job(mode, token, repo_name, number, options=None):
+    """Выполняет одну задачу агента в текущем процессе и возвращает код завершения."""
+    options = options or {}
+    # Импорт внутри функции: в прогретом процессе модули уже лежат в sys.modules,
+    # а при холодном запуске здесь и уходит основное время старта
+    import coder
+    import reviewer
+
+    if mode == "noop":
+        # Пустая задача — для бенчмарка и проверки, что воркер жив
+        return 0
+
+    if mode == "coder":
+        return coder.run_coder(issue=number, repo_name=repo_name, token=token)
+    if mode == "fixer":
+        return coder.run_coder(pr=number, fix=True, repo_name=repo_name, token=token)
+    if mode == "reviewer":
+        return reviewer.run_reviewer(int(number), repo_name=repo_name, token=token, full=options.get("full", False))
+
+    print(f"Unknown mode: {mode}")
+    return 2
+
+
+def _job_entry(mode, token, repo_name, number, options):
+    # Точка входа дочернего процесса: код возврата задачи = exitcode процесса
+    sys.stdout.flush()
+    from configs import metrics, profiling, throttle
+    from configs.workspace import exit_on_sigterm
+    exit_on_sigterm()
+    if options.get("installation_id"):
+        os.environ["GITHUB_INSTALLATION_ID"] = str(options["installation_id"])
+    if options.get("agent_login"):
+        os.environ["AGENT_LOGIN"] = options["agent_login"]
+    try:
+        # options["profile"] — ID задачи, если профилирование запрошено (иначе контекст пустой)
+        with profiling.profile_job(options.get("profile"), mode=mode, repo=repo_name, number=number):
+            code = run_job(mode, token, repo_name, number, options)
+    except Exception as e:
+        # Код возврата говорит серверу, можно ли повторить задачу со свежим токеном
+        traceback.print_exc()
+        code = throttle.failure_exit_code(e)
+    finally:
+        # Метрики процесса задачи уходят серверу, иначе они пропадут вместе с процессом
+        metrics.push()
+    sys.stdout.flush()
+    sys.exit(code or 0)
+
+
+class WarmPool:
+    """Запускает задачи форком от прогретого forkserver-процесса."""
+
+    def __init__(self, preload=None):
+        self._ctx = multiprocessing.get_context("forkserver")
+        self._ctx.set_forkserver_preload(preload or PRELOAD_MODULES)
+
+    def warm_up(self):
+        """Поднимает forkserver заранее, чтобы первая задача не платила за импорты."""
+        self.run("noop", None, None, None)
+
+    def start(self, mode, token, repo_name, number, options=None):
+        """Стартует задачу и возвращает процесс (его можно дождаться или прервать)."""
+        process = self._ctx.Process(
+            target=_job_entry,
+            args=(mode, token, repo_name, number, options or {}),
+            name=f"agent-{mode}-{number}",
+        )
+        process.start()
+        return process
+
+    def run(self, mode, token, repo_name, number, options=None):
+        process = self.start(mode, token, repo_name, number, options)
+        process.join()
+        return process.exitcode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a single agent job in the current process")
+    parser.add_argument("mode", choices=["coder", "fixer", "reviewer", "noop"])
+    parser.add_argument("number", nargs="?", help="Issue or PR number")
+    parser.add_argument("--full", action="store_true", help="Reviewer: review the whole PR")
+    parser.add_argument("--profile", metavar="ID", help="Write cProfile/tracemalloc artifacts to PROFILE_DIR/ID")
+    args = parser.parse_args()
+    options = {"full": args.full}
+    from configs import profiling
+    with profiling.profile_job(args.profile, mode=args.mode, number=args.number):
+        code = run_job(args.mode, os.getenv("GH_PAT"), os.getenv("GITHUB_REPOSITORY"), args.number, options)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
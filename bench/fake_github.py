@@ -0,0 +1,430 @@
+# fake_github.py
+"""Фейковый GitHub для бенчмарков: REST API, GraphQL-пакет PR, вебхуки и локальные git remote.
+
+Поддерживается ровно то, чем пользуется агент: токены установок, репозиторий, issues, pull requests,
+файлы PR, compare, комментарии, статусы, Git Data API (refs/commits/trees/blobs) и ETag/304.
+Репозитории — bare-репозитории на диске (GIT_BASE_URL=file://...): post-receive hook и обновление ref
+через API сообщают о пушах, и фейк шлет серверу вебхуки pull_request.synchronize, как настоящий GitHub.
+"""
+import base64
+import hashlib
+import json
+import os
+import queue
+import re
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import requests
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+_HOOK = """#!{python}
+import json, sys, urllib.request
+updates = [line.split() for line in sys.stdin if line.strip()]
+body = json.dumps({{"repo": {repo!r}, "updates": updates}}).encode()
+req = urllib.request.Request({url!r}, data=body, headers={{"Content-Type": "application/json"}})
+urllib.request.urlopen(req, timeout=10).read()
+"""
+
+_STATUS = {"A": "added", "M": "modified", "D": "removed", "R": "renamed", "C": "copied"}
+
+
+def _git(args, cwd, **kwargs):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True, **kwargs).stdout
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakeGitHub:
+    def __init__(self, root=None, webhook_url=None):
+        self.root = root or tempfile.mkdtemp(prefix="fake-github-")
+        self.remotes_dir = os.path.join(self.root, "remotes")
+        os.makedirs(self.remotes_dir, exist_ok=True)
+        self.webhook_url = webhook_url
+        self.webhook_headers = {}   # доп. заголовки каждого вебхука (например, X-Agent-Profile)
+        self.api_url = None
+        self.repos = {}
+        self.requests = 0
+        self.listeners = []     # callback(repo_name, number, body, at) на каждый новый комментарий
+        self._lock = threading.RLock()
+        self._webhooks = queue.Queue()
+        self._server = None
+        self.app = self._make_app()
+
+    # --- состояние ---
+
+    def create_repo(self, full_name, files, installation_id=1, default_branch="main"):
+        """Создает bare-репозиторий с начальным коммитом и post-receive hook."""
+        path = os.path.join(self.remotes_dir, full_name + ".git")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _git(["init", "--bare", "--quiet", "-b", default_branch, path], cwd=self.root)
+
+        with tempfile.TemporaryDirectory() as work:
+            _git(["init", "--quiet", "-b", default_branch, work], cwd=self.root)
+            for rel, content in files.items():
+                full = os.path.join(work, rel)
+                os.makedirs(os.path.dirname(full), exist_ok=True)
+                with open(full, "w") as f:
+                    f.write(content)
+            _git(["add", "."], cwd=work)
+            _git(["-c", "user.name=bench", "-c", "user.email=bench@local", "commit", "--quiet", "-m", "init"], cwd=work)
+            _git(["push", "--quiet", path, f"HEAD:refs/heads/{default_branch}"], cwd=work)
+
+        with self._lock:
+            self.repos[full_name] = {
+                "path": path, "installation_id": installation_id, "default_branch": default_branch,
+                "next_number": 1, "issues": {}, "pulls": {}, "comments": {},
+            }
+        return path
+
+    def install_hooks(self):
+        """Ставит post-receive hook-и (после start(): нужен адрес API)."""
+        for name, repo in self.repos.items():
+            hook = os.path.join(repo["path"], "hooks", "post-receive")
+            with open(hook, "w") as f:
+                f.write(_HOOK.format(python=sys.executable, repo=name, url=f"{self.api_url}/_bench/push"))
+            os.chmod(hook, os.stat(hook).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    def open_issue(self, full_name, title, body):
+        with self._lock:
+            repo = self.repos[full_name]
+            number = repo["next_number"]
+            repo["next_number"] += 1
+            repo["issues"][number] = {"title": title, "body": body, "created_at": time.time()}
+            repo["comments"][number] = []
+        return number
+
+    def open_pull(self, full_name, head, title="Bench PR", body="", base=None, sender_type="User"):
+        repo = self.repos[full_name]
+        with self._lock:
+            number = repo["next_number"]
+            repo["next_number"] += 1
+            repo["pulls"][number] = {"title": title, "body": body, "head": head, "base": base or repo["default_branch"],
+                                     "created_at": time.time()}
+            repo["comments"][number] = []
+        self.send_webhook("pull_request", {"action": "opened", "number": number}, full_name, sender_type)
+        return number
+
+    def _sha(self, repo, ref):
+        return _git(["rev-parse", f"refs/heads/{ref}"], cwd=repo["path"]).strip()
+
+    # --- вебхуки ---
+
+    def send_webhook(self, event, payload, full_name, sender_type="Bot"):
+        if not self.webhook_url:
+            return
+        payload = dict(payload)
+        payload["installation"] = {"id": self.repos[full_name]["installation_id"]}
+        payload["repository"] = {"full_name": full_name}
+        payload["sender"] = {"type": sender_type, "login": "agent[bot]" if sender_type == "Bot" else "bench-user"}
+        self._webhooks.put((event, payload))
+
+    def _webhook_loop(self):
+        session = requests.Session()
+        while True:
+            event, payload = self._webhooks.get()
+            headers = {"X-GitHub-Event": event, "X-GitHub-Delivery": str(uuid.uuid4()), **self.webhook_headers}
+            for _ in range(3):
+                try:
+                    resp = session.post(self.webhook_url, json=payload, headers=headers, timeout=30)
+                    if resp.status_code != 429:
+                        break
+                except requests.RequestException:
+                    pass
+                time.sleep(1)
+
+    # --- diff по локальному remote ---
+
+    def _diff_files(self, repo, base, head):
+        names = _git(["diff", "--name-status", "-M", f"{base}...{head}"], cwd=repo["path"])
+        patch = _git(["diff", "--no-color", "-M", f"{base}...{head}"], cwd=repo["path"])
+        patches = {}
+        for block in re.split(r"^diff --git ", patch, flags=re.MULTILINE)[1:]:
+            match = re.search(r" b/(.+)$", block.splitlines()[0])
+            hunk = block.find("\n@@")
+            if match:
+                patches[match.group(1)] = block[hunk + 1:] if hunk != -1 else None
+        files = []
+        for line in names.splitlines():
+            parts = line.split("\t")
+            filename = parts[-1]
+            files.append({"filename": filename, "status": _STATUS.get(parts[0][0], "modified"),
+                          "patch": patches.get(filename)})
+        return files
+
+    def _branch_updated(self, full_name, ref):
+        branch = ref.replace("refs/heads/", "", 1)
+        for number, pr in list(self.repos[full_name]["pulls"].items()):
+            if pr["head"] == branch:
+                self.send_webhook("pull_request", {"action": "synchronize", "number": number}, full_name)
+
+    def _pull_json(self, full_name, number):
+        repo = self.repos[full_name]
+        pr = repo["pulls"][number]
+        url = f"{self.api_url}/repos/{full_name}/pulls/{number}"
+        return {
+            "number": number, "url": url, "html_url": f"http://fake-github/{full_name}/pull/{number}",
+            "title": pr["title"], "body": pr["body"], "state": "open",
+            "head": {"ref": pr["head"], "sha": self._sha(repo, pr["head"])},
+            "base": {"ref": pr["base"], "sha": self._sha(repo, pr["base"])},
+        }
+
+    # --- HTTP ---
+
+    def _make_app(self):
+        app = Flask("fake_github")
+
+        @app.before_request
+        def count():
+            with self._lock:
+                self.requests += 1
+
+        @app.after_request
+        def etag(resp):
+            # Условные запросы как у GitHub: совпавший If-None-Match -> 304 без тела
+            if request.method == "GET" and resp.status_code == 200 and resp.mimetype == "application/json":
+                tag = '"' + hashlib.sha1(resp.get_data()).hexdigest() + '"'
+                if request.headers.get("If-None-Match") == tag:
+                    return Response(status=304, headers={"ETag": tag})
+                resp.headers["ETag"] = tag
+            resp.headers["X-RateLimit-Remaining"] = "5000"
+            resp.headers["X-RateLimit-Reset"] = str(int(time.time()) + 3600)
+            return resp
+
+        @app.get("/app")
+        def get_app():
+            # Комментарии агента пишутся от имени agent[bot]
+            return jsonify({"id": 1, "slug": "agent"})
+
+        @app.post("/app/installations/<int:installation_id>/access_tokens")
+        def access_token(installation_id):
+            return jsonify({"token": f"ghs_fake_{installation_id}_{uuid.uuid4().hex[:8]}",
+                            "expires_at": _iso(time.time() + 3600)}), 201
+
+        @app.get("/repos/<owner>/<name>")
+        def get_repo(owner, name):
+            full_name = f"{owner}/{name}"
+            repo = self.repos[full_name]
+            return jsonify({"id": abs(hash(full_name)) % 10 ** 8, "name": name, "full_name": full_name,
+                            "url": f"{self.api_url}/repos/{full_name}", "default_branch": repo["default_branch"],
+                            "owner": {"login": owner}, "private": False})
+
+        @app.get("/repos/<owner>/<name>/issues/<int:number>")
+        def get_issue(owner, name, number):
+            full_name = f"{owner}/{name}"
+            issue = self.repos[full_name]["issues"][number]
+            return jsonify({"number": number, "title": issue["title"], "body": issue["body"], "state": "open",
+                            "url": f"{self.api_url}/repos/{full_name}/issues/{number}"})
+
+        @app.route("/repos/<owner>/<name>/issues/<int:number>/comments", methods=["GET", "POST"])
+        def comments(owner, name, number):
+            full_name = f"{owner}/{name}"
+            repo = self.repos[full_name]
+            if request.method == "GET":
+                return jsonify([{"id": i, "body": c["body"], "user": {"login": c["user"]}}
+                                for i, c in enumerate(repo["comments"].get(number, []), 1)])
+
+            body = request.get_json()["body"]
+            now = time.time()
+            with self._lock:
+                items = repo["comments"].setdefault(number, [])
+                items.append({"body": body, "user": "agent[bot]", "created_at": now})
+                comment_id = len(items)
+            for listener in self.listeners:
+                listener(full_name, number, body, now)
+            issue = {"number": number}
+            if number in repo["pulls"]:
+                issue["pull_request"] = {"url": f"{self.api_url}/repos/{full_name}/pulls/{number}"}
+            self.send_webhook("issue_comment", {"action": "created", "issue": issue, "comment": {"body": body}},
+                              full_name)
+            return jsonify({"id": comment_id, "body": body,
+                            "html_url": f"http://fake-github/{full_name}/pull/{number}#comment-{comment_id}"}), 201
+
+        @app.post("/repos/<owner>/<name>/pulls")
+        def create_pull(owner, name):
+            full_name = f"{owner}/{name}"
+            data = request.get_json()
+            repo = self.repos[full_name]
+            if any(pr["head"] == data["head"] for pr in repo["pulls"].values()):
+                return jsonify({"message": "Validation Failed: A pull request already exists"}), 422
+            number = self.open_pull(full_name, data["head"], data.get("title", ""), data.get("body", ""),
+                                    data.get("base"), sender_type="Bot")
+            return jsonify(self._pull_json(full_name, number)), 201
+
+        @app.get("/repos/<owner>/<name>/pulls/<int:number>")
+        def get_pull(owner, name, number):
+            return jsonify(self._pull_json(f"{owner}/{name}", number))
+
+        @app.get("/repos/<owner>/<name>/pulls/<int:number>/files")
+        def pull_files(owner, name, number):
+            full_name = f"{owner}/{name}"
+            pr = self._pull_json(full_name, number)
+            return jsonify(self._diff_files(self.repos[full_name], pr["base"]["sha"], pr["head"]["sha"]))
+
+        @app.get("/repos/<owner>/<name>/compare/<path:spec>")
+        def compare(owner, name, spec):
+            repo = self.repos[f"{owner}/{name}"]
+            base, head = spec.split("...", 1)
+            if base == head:
+                status = "identical"
+            elif subprocess.run(["git", "merge-base", "--is-ancestor", base, head], cwd=repo["path"]).returncode == 0:
+                status = "ahead"
+            else:
+                status = "diverged"
+            files = self._diff_files(repo, base, head)
+            return jsonify({"status": status, "ahead_by": 0, "behind_by": 0, "total_commits": 0,
+                            "url": f"{self.api_url}/repos/{owner}/{name}/compare/{spec}", "files": files,
+                            "commits": []})
+
+        @app.get("/repos/<owner>/<name>/commits/<sha>/statuses")
+        def statuses(owner, name, sha):
+            return jsonify([])
+
+        @app.post("/graphql")
+        def graphql():
+            variables = request.get_json().get("variables", {})
+            full_name = f"{variables['owner']}/{variables['name']}"
+            number = variables["number"]
+            pr = self._pull_json(full_name, number)
+            comments = self.repos[full_name]["comments"].get(number, [])[-100:]
+            return jsonify({"data": {"repository": {"pullRequest": {
+                "headRefName": pr["head"]["ref"], "headRefOid": pr["head"]["sha"],
+                "baseRefName": pr["base"]["ref"], "baseRefOid": pr["base"]["sha"],
+                "comments": {"totalCount": len(self.repos[full_name]["comments"].get(number, [])),
+                             "nodes": [{"body": c["body"], "author": {"login": c["user"]}} for c in comments]},
+                "commits": {"nodes": [{"commit": {"oid": pr["head"]["sha"], "status": None}}]},
+            }}}})
+
+        # --- Git Data API поверх bare-репозитория ---
+
+        @app.get("/repos/<owner>/<name>/git/ref/heads/<path:branch>")
+        def get_ref(owner, name, branch):
+            repo = self.repos[f"{owner}/{name}"]
+            result = subprocess.run(["git", "rev-parse", "--verify", "--quiet", f"refs/heads/{branch}"],
+                                    cwd=repo["path"], capture_output=True, text=True)
+            if result.returncode != 0:
+                return jsonify({"message": "Not Found"}), 404
+            return jsonify({"ref": f"refs/heads/{branch}", "object": {"sha": result.stdout.strip(), "type": "commit"}})
+
+        @app.get("/repos/<owner>/<name>/git/commits/<sha>")
+        def get_commit(owner, name, sha):
+            repo = self.repos[f"{owner}/{name}"]
+            tree = _git(["rev-parse", f"{sha}^{{tree}}"], cwd=repo["path"]).strip()
+            parents = _git(["rev-list", "--parents", "-n", "1", sha], cwd=repo["path"]).split()[1:]
+            return jsonify({"sha": sha, "tree": {"sha": tree}, "parents": [{"sha": p} for p in parents]})
+
+        @app.get("/repos/<owner>/<name>/git/trees/<sha>")
+        def get_tree(owner, name, sha):
+            repo = self.repos[f"{owner}/{name}"]
+            args = ["ls-tree", "-l", "-z"] + (["-r"] if request.args.get("recursive") else []) + [sha]
+            items = []
+            for record in _git(args, cwd=repo["path"]).split("\0"):
+                if not record:
+                    continue
+                meta, _, path = record.partition("\t")
+                mode, obj_type, obj_sha, size = meta.split()
+                item = {"path": path, "mode": mode, "type": obj_type, "sha": obj_sha}
+                if size != "-":
+                    item["size"] = int(size)
+                items.append(item)
+            return jsonify({"sha": sha, "tree": items, "truncated": False})
+
+        @app.get("/repos/<owner>/<name>/git/blobs/<sha>")
+        def get_blob(owner, name, sha):
+            repo = self.repos[f"{owner}/{name}"]
+            data = subprocess.run(["git", "cat-file", "blob", sha], cwd=repo["path"], check=True,
+                                  capture_output=True).stdout
+            return jsonify({"sha": sha, "size": len(data), "encoding": "base64",
+                            "content": base64.b64encode(data).decode()})
+
+        @app.post("/repos/<owner>/<name>/git/trees")
+        def create_tree(owner, name):
+            repo = self.repos[f"{owner}/{name}"]
+            data = request.get_json()
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(os.environ, GIT_INDEX_FILE=os.path.join(tmp, "index"))
+                if data.get("base_tree"):
+                    _git(["read-tree", data["base_tree"]], cwd=repo["path"], env=env)
+                for item in data["tree"]:
+                    sha = item.get("sha") or _git(["hash-object", "-w", "--stdin"], cwd=repo["path"],
+                                                  input=item["content"]).strip()
+                    _git(["update-index", "--add", "--cacheinfo", f"{item['mode']},{sha},{item['path']}"],
+                         cwd=repo["path"], env=env)
+                tree = _git(["write-tree"], cwd=repo["path"], env=env).strip()
+            return jsonify({"sha": tree}), 201
+
+        @app.post("/repos/<owner>/<name>/git/commits")
+        def create_commit(owner, name):
+            repo = self.repos[f"{owner}/{name}"]
+            data = request.get_json()
+            args = ["commit-tree", data["tree"], "-m", data["message"]]
+            for parent in data.get("parents", []):
+                args += ["-p", parent]
+            env = dict(os.environ, GIT_AUTHOR_NAME="agent", GIT_AUTHOR_EMAIL="agent@local",
+                       GIT_COMMITTER_NAME="agent", GIT_COMMITTER_EMAIL="agent@local")
+            sha = _git(args, cwd=repo["path"], env=env).strip()
+            return jsonify({"sha": sha, "tree": {"sha": data["tree"]}}), 201
+
+        @app.post("/repos/<owner>/<name>/git/refs")
+        def create_ref(owner, name):
+            full_name = f"{owner}/{name}"
+            data = request.get_json()
+            result = subprocess.run(["git", "update-ref", data["ref"], data["sha"], ""],
+                                    cwd=self.repos[full_name]["path"], capture_output=True)
+            if result.returncode != 0:
+                return jsonify({"message": "Reference already exists"}), 422
+            self._branch_updated(full_name, data["ref"])
+            return jsonify({"ref": data["ref"], "object": {"sha": data["sha"], "type": "commit"}}), 201
+
+        @app.patch("/repos/<owner>/<name>/git/refs/heads/<path:branch>")
+        def update_ref(owner, name, branch):
+            full_name = f"{owner}/{name}"
+            path = self.repos[full_name]["path"]
+            data = request.get_json()
+            old = _git(["rev-parse", f"refs/heads/{branch}"], cwd=path).strip()
+            fast_forward = subprocess.run(["git", "merge-base", "--is-ancestor", old, data["sha"]], cwd=path).returncode == 0
+            if not fast_forward and not data.get("force"):
+                return jsonify({"message": "Update is not a fast forward"}), 422
+            _git(["update-ref", f"refs/heads/{branch}", data["sha"], old], cwd=path)
+            self._branch_updated(full_name, f"refs/heads/{branch}")
+            return jsonify({"ref": f"refs/heads/{branch}", "object": {"sha": data["sha"], "type": "commit"}})
+
+        @app.post("/_bench/push")
+        def pushed():
+            # post-receive hook: пуш в ветку открытого PR -> pull_request.synchronize
+            data = request.get_json()
+            for _old, _new, ref in data["updates"]:
+                self._branch_updated(data["repo"], ref)
+            return jsonify({"ok": True})
+
+        @app.errorhandler(KeyError)
+        def not_found(e):
+            return jsonify({"message": "Not Found"}), 404
+
+        return app
+
+    def start(self, port=0, host="127.0.0.1"):
+        """Запускает API в фоновом потоке; возвращает URL API (GITHUB_API_URL)."""
+        self._server = make_server(host, port, self.app, threaded=True)
+        self.api_url = f"http://{host}:{self._server.server_port}"
+        threading.Thread(target=self._server.serve_forever, name="fake-github", daemon=True).start()
+        threading.Thread(target=self._webhook_loop, name="fake-github-webhooks", daemon=True).start()
+        self.install_hooks()
+        return self.api_url
+
+    @property
+    def git_base_url(self):
+        return "file://" + self.remotes_dir
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
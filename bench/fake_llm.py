@@ -0,0 +1,123 @@
+# fake_llm.py
+"""Фейковый OpenAI-совместимый LLM для бенчмарков: /v1/chat/completions (обычный и stream).
+
+Задержка, скорость генерации и доля ошибок (HTTP 500) настраиваются, в том числе на ходу; ответы — заготовки в формате агента:
+кодеру — новый файл в <FILE>, ревьюеру — LGTM или (с вероятностью changes_rate) замечание.
+
+Отдельный запуск:
+    python3 bench/fake_llm.py --port 9200 --latency 0.5
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+
+class FakeLLM:
+    def __init__(self, latency=0.2, chunk_delay=0.0, changes_rate=0.0, seed=None, error_rate=0.0):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.changes_rate = changes_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.arrivals = []      # time.monotonic() прихода каждого запроса
+        self._lock = threading.Lock()
+        self._server = None
+        self.app = self._make_app()
+
+    def answer(self, system_prompt, user_content):
+        """Заготовленный ответ по роли из системного промпта."""
+        if "Code Reviewer" in system_prompt:
+            with self._lock:
+                changes = self.random.random() < self.changes_rate
+            if changes:
+                return "1. **bench.py**: rename the helper to follow the project naming style."
+            return "LGTM"
+
+        # Кодер/фиксер: новый файл с именем от содержимого запроса, чтобы у каждой задачи был свой diff
+        digest = hashlib.sha1(user_content.encode("utf-8")).hexdigest()[:10]
+        return (f'<FILE path="bench_generated/feature_{digest}.py">\n'
+                f'def feature_{digest}():\n'
+                f'    """Generated by the fake LLM."""\n'
+                f'    return "{digest}"\n'
+                f'</FILE>\n')
+
+    def _make_app(self):
+        app = Flask("fake_llm")
+
+        @app.post("/v1/chat/completions")
+        def chat_completions():
+            body = request.get_json()
+            messages = body.get("messages", [])
+            system = next((m["content"] for m in messages if m["role"] == "system"), "")
+            user = next((m["content"] for m in messages if m["role"] == "user"), "")
+            with self._lock:
+                self.requests += 1
+                self.arrivals.append(time.monotonic())
+                failed = self.random.random() < self.error_rate
+            time.sleep(self.latency)
+            if failed:
+                return jsonify({"error": {"message": "injected failure", "type": "server_error"}}), 500
+
+            text = self.answer(system, user)
+            model = body.get("model", "fake")
+            usage = {"prompt_tokens": len(system + user) // 4, "completion_tokens": len(text) // 4}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+            if not body.get("stream"):
+                return jsonify({
+                    "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                 "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+            def events():
+                for i in range(0, len(text), 16):
+                    chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model,
+                             "choices": [{"index": 0, "delta": {"content": text[i:i + 16]}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    if self.chunk_delay:
+                        time.sleep(self.chunk_delay)
+                done = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                yield f"data: {json.dumps(done)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return Response(events(), mimetype="text/event-stream")
+
+        return app
+
+    def start(self, port=0, host="127.0.0.1"):
+        """Запускает сервер в фоновом потоке и возвращает base_url."""
+        self._server = make_server(host, port, self.app, threaded=True)
+        threading.Thread(target=self._server.serve_forever, name="fake-llm", daemon=True).start()
+        return f"http://{host}:{self._server.server_port}/v1"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--changes-rate", type=float, default=0.0, help="Share of reviews that request changes")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    args = parser.parse_args()
+    llm = FakeLLM(args.latency, args.chunk_delay, args.changes_rate, error_rate=args.error_rate)
+    print(f"Fake LLM: {llm.start(args.port)}")
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+# load_test.py
+"""Нагрузочный тест всего конвейера: настоящий server.py против локальных фейков GitHub и LLM.
+
+Сервер запускается отдельным процессом со своими временными каталогами (журнал, кэши, workspace),
+репозитории — bare-репозитории на диске (GIT_BASE_URL=file://...). Вебхуки подаются с заданной
+частотой, задача считается завершенной, когда в PR появляется LGTM (или сообщение о лимите итераций).
+
+Сценарии:
+    issue  — issues.opened -> кодер -> PR -> ревьюер (-> фиксер при замечаниях) -> LGTM
+    review — готовая ветка -> pull_request.opened -> ревьюер -> LGTM
+
+С --nodes N поднимаются координатор и N воркеров (AGENT_ROLE=coordinator/worker), вебхуки идут
+координатору; --kill-node T убивает через T секунд узел с наибольшим числом событий, чтобы проверить
+перераспределение задач. --profile включает профилирование каждой задачи (заголовок X-Agent-Profile)
+и проверяет, что артефакты отдаются на /jobs/<id>/profile.
+
+Запуск из корня проекта:
+    python3 bench/load_test.py --scenario issue --jobs 20 --rate 10 --repos 4
+    python3 bench/load_test.py --scenario review --jobs 40 --repos 8 --nodes 3 --kill-node 5
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_github import FakeGitHub, _git  # noqa: E402
+from fake_llm import FakeLLM  # noqa: E402
+
+LIMIT_MESSAGE = "Превышен лимит итераций"
+
+SEED_FILES = {
+    "README.md": "# Bench app\n",
+    "app/__init__.py": "",
+    "app/core.py": "def add(a, b):\n    return a + b\n\n\ndef sub(a, b):\n    return a - b\n",
+    "app/util.py": "import os\n\n\ndef env(name, default=None):\n    return os.getenv(name, default)\n",
+}
+
+
+def _free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _write_private_key(path):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                  serialization.NoEncryption()))
+
+
+class RssSampler:
+    """Пиковый RSS деревьев процессов серверов (сервер + forkserver + процессы задач) по /proc."""
+
+    def __init__(self, pids, interval=0.2):
+        self.pids = list(pids)
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="rss-sampler", daemon=True)
+
+    def _tree(self):
+        children = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # comm может содержать пробелы и скобки — ppid идет после последней ')'
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        pids, stack = [], list(self.pids)
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            stack.extend(children.get(pid, []))
+        return pids
+
+    @staticmethod
+    def _rss(pid):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, sum(self._rss(pid) for pid in self._tree()))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.tmp = tempfile.mkdtemp(prefix="agent-load-")
+        self.port = _free_port()
+        self.llm = FakeLLM(args.llm_latency, args.chunk_delay, args.changes_rate, seed=args.seed)
+        self.github = FakeGitHub(os.path.join(self.tmp, "github"), f"http://127.0.0.1:{self.port}/webhook")
+        self.repos = [f"bench/app{i}" for i in range(args.repos)]
+        self.started = {}       # (repo, ключ задачи) -> время отправки вебхука
+        self.finished = {}      # (repo, ключ задачи) -> (время завершения, исход)
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self.servers = []       # [(имя, процесс, порт, лог)]
+        self.killed = None
+
+    # --- фейки и сервер ---
+
+    def start(self):
+        for name in self.repos:
+            self.github.create_repo(name, SEED_FILES)
+        api_url = self.github.start()
+        llm_url = self.llm.start()
+        self.github.listeners.append(self._on_comment)
+        if self.args.profile:
+            self.github.webhook_headers["X-Agent-Profile"] = "1"
+
+        key_path = os.path.join(self.tmp, "private-key.pem")
+        _write_private_key(key_path)
+        self.base_env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.getenv("PYTHONPATH")])),
+            HOME=self.tmp,
+            GITHUB_API_URL=api_url,
+            GIT_BASE_URL=self.github.git_base_url,
+            LLM_BASE_URL=llm_url,
+            LLM_API_KEY="fake",
+            MODEL_NAME="fake-model",
+            PRIVATE_KEY_PATH=key_path,
+            GITHUB_APP_ID="1",
+            AGENT_DEBOUNCE=str(self.args.debounce),
+            AGENT_WORKERS=str(self.args.workers),
+            AGENT_WORKER_MODE=self.args.worker_mode,
+            LLM_CACHE_ENABLED="0",
+            GIT_AUTHOR_NAME="agent", GIT_AUTHOR_EMAIL="agent@local",
+            GIT_COMMITTER_NAME="agent", GIT_COMMITTER_EMAIL="agent@local",
+        )
+        if not self.args.nodes:
+            self._spawn("server", self.port)
+            return
+
+        # Короткие heartbeat и таймаут: падение узла обнаруживается за секунды
+        cluster = dict(AGENT_HEARTBEAT="1", AGENT_NODE_TIMEOUT="4")
+        coordinator = f"http://127.0.0.1:{self.port}"
+        self._spawn("coordinator", self.port, AGENT_ROLE="coordinator", **cluster)
+        for i in range(self.args.nodes):
+            self._spawn(f"node{i}", _free_port(), AGENT_ROLE="worker", AGENT_COORDINATOR_URL=coordinator,
+                        AGENT_NODE_ID=f"node{i}", **cluster)
+        deadline = time.monotonic() + 30
+        while len(self.queue_stats().get("nodes", {})) < self.args.nodes:
+            if time.monotonic() > deadline:
+                raise RuntimeError("worker nodes did not join the coordinator in 30s")
+            time.sleep(0.2)
+
+    def _spawn(self, name, port, **extra):
+        """Запускает server.py со своими каталогами (журнал, кэши, workspace) — как отдельная машина."""
+        home = os.path.join(self.tmp, name)
+        env = dict(
+            self.base_env,
+            AGENT_PORT=str(port),
+            AGENT_JOURNAL_PATH=os.path.join(home, "jobs.sqlite3"),
+            AGENT_CACHE_DIR=os.path.join(home, "cache"),
+            WORKSPACE_DIR=os.path.join(home, "workspaces"),
+            **extra,
+        )
+        log = open(os.path.join(self.tmp, f"{name}.log"), "w")
+        # Своя группа процессов: узел можно убить вместе с forkserver и задачами
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, "server", "server.py")], cwd=ROOT, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        self.servers.append((name, process, port, log))
+        self._wait_ready(process, port, log)
+
+    def _wait_ready(self, process, port, log, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with {process.returncode}, see {log.name}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/queue", timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"server did not start in {timeout}s, see {log.name}")
+
+    def kill_busiest_node(self):
+        """Убивает (SIGKILL всей группы) воркер с наибольшим числом незавершенных событий."""
+        nodes = self.queue_stats().get("nodes", {})
+        if not nodes:
+            return
+        busiest = max(nodes, key=lambda node: nodes[node]["unfinished"])
+        for name, process, _, _ in self.servers:
+            if name == busiest and process.poll() is None:
+                os.killpg(process.pid, signal.SIGKILL)
+                self.killed = busiest
+                print(f"💥 Killed {busiest} with {nodes[busiest]['unfinished']} unfinished events")
+
+    def stop(self):
+        # Сначала воркеры, координатор последним: узлы успевают сообщить о выходе
+        for _, process, _, log in reversed(self.servers):
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            log.close()
+        self.github.stop()
+        self.llm.stop()
+        if not self.args.keep:
+            shutil.rmtree(self.tmp, ignore_errors=True)
+
+    # --- сценарии ---
+
+    def _job_key(self, repo_name, number):
+        """Ключ задачи по номеру PR: в сценарии issue — номер исходного issue из имени ветки."""
+        pull = self.github.repos[repo_name]["pulls"].get(number)
+        if pull is None:
+            return None
+        if self.args.scenario == "issue":
+            head = pull["head"]
+            return int(head.rsplit("-", 1)[1]) if head.startswith("feature/issue-") else None
+        return number
+
+    def _on_comment(self, repo_name, number, body, at):
+        outcome = "lgtm" if "LGTM" in body else "limit" if LIMIT_MESSAGE in body else None
+        if outcome is None:
+            return
+        key = (repo_name, self._job_key(repo_name, number))
+        with self._lock:
+            if key in self.started and key not in self.finished:
+                self.finished[key] = (at, outcome)
+                if len(self.finished) == len(self.started) == self.args.jobs:
+                    self.done.set()
+
+    def _prepare_branch(self, repo_name, index):
+        """Ветка с небольшим изменением для сценария review (пуш до открытия PR вебхук не шлет)."""
+        branch = f"bench/change-{index}"
+        work = os.path.join(self.tmp, "prepare")
+        shutil.rmtree(work, ignore_errors=True)
+        path = self.github.repos[repo_name]["path"]
+        _git(["clone", "--quiet", path, work], cwd=self.tmp)
+        with open(os.path.join(work, "app", "core.py"), "a") as f:
+            f.write(f"\n\ndef mul_{index}(a, b):\n    return a * b * {index}\n")
+        _git(["checkout", "--quiet", "-b", branch], cwd=work)
+        _git(["-c", "user.name=bench", "-c", "user.email=bench@local", "commit", "--quiet", "-am",
+              f"Add mul_{index}"], cwd=work)
+        _git(["push", "--quiet", "origin", branch], cwd=work)
+        return branch
+
+    def run(self):
+        branches = {}
+        if self.args.scenario == "review":
+            for i in range(self.args.jobs):
+                repo_name = self.repos[i % len(self.repos)]
+                branches[i] = (repo_name, self._prepare_branch(repo_name, i))
+
+        interval = 1.0 / self.args.rate if self.args.rate > 0 else 0
+        start = time.monotonic()
+        if self.args.nodes and self.args.kill_node is not None:
+            threading.Timer(self.args.kill_node, self.kill_busiest_node).start()
+        for i in range(self.args.jobs):
+            # Равномерная подача: i-й вебхук уходит в start + i * interval
+            delay = start + i * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if self.args.scenario == "issue":
+                repo_name = self.repos[i % len(self.repos)]
+                number = self.github.open_issue(repo_name, f"Bench feature {i}",
+                                                f"Add a helper function number {i} to the app package.")
+                with self._lock:
+                    self.started[(repo_name, number)] = time.time()
+                self.github.send_webhook("issues", {"action": "opened", "issue": {"number": number}}, repo_name,
+                                         sender_type="User")
+            else:
+                repo_name, branch = branches[i]
+                # Время старта фиксируем до вебхука: комментарий может прийти раньше, чем вернется open_pull
+                with self._lock:
+                    number = self.github.repos[repo_name]["next_number"]
+                    self.started[(repo_name, number)] = time.time()
+                self.github.open_pull(repo_name, branch, f"Bench change {i}")
+        print(f"📤 Sent {self.args.jobs} webhooks in {time.monotonic() - start:.1f}s")
+
+        if not self.done.wait(self.args.timeout):
+            print(f"⚠️ Timeout: {len(self.finished)}/{self.args.jobs} jobs finished")
+        return time.monotonic() - start
+
+    # --- отчет ---
+
+    def report(self, elapsed, peak_rss):
+        with self._lock:
+            latencies = sorted(self.finished[k][0] - self.started[k] for k in self.finished)
+            outcomes = [outcome for _, outcome in self.finished.values()]
+        print(f"\nScenario: {self.args.scenario}, jobs={self.args.jobs}, rate={self.args.rate}/s, "
+              f"repos={len(self.repos)}, workers={self.args.workers}, mode={self.args.worker_mode}"
+              + (f", nodes={self.args.nodes}" if self.args.nodes else ""))
+        print(f"finished   {len(latencies)}/{self.args.jobs} (lgtm={outcomes.count('lgtm')}, "
+              f"limit={outcomes.count('limit')}) in {elapsed:.1f}s")
+        if latencies:
+            def pct(q):
+                return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+            print(f"throughput {len(latencies) / elapsed * 60:.1f} jobs/min")
+            print(f"latency    p50={statistics.median(latencies):.2f}s  p95={pct(0.95):.2f}s  "
+                  f"p99={pct(0.99):.2f}s  max={latencies[-1]:.2f}s")
+        print(f"peak RSS   {peak_rss / 1024 ** 2:.1f} MiB (server process trees)")
+        if self.args.nodes:
+            print(f"cluster    {self.cluster_counters()}" + (f", killed {self.killed}" if self.killed else ""))
+        print(f"requests   github={self.github.requests}  llm={self.llm.requests}")
+        if self.args.profile:
+            print(f"profiles   {self.profiles()}")
+        if self.args.keep:
+            print(f"artifacts  {self.tmp} (*.log, per-node journals and caches, remotes)")
+
+    def queue_stats(self):
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/queue", timeout=5) as resp:
+            return json.load(resp)
+
+    def profiles(self):
+        """Сколько задач оставили профиль, доступный через /jobs/<id>/profile своего узла."""
+        found, files = 0, set()
+        for name, _, port, _ in self.servers:
+            base = f"http://127.0.0.1:{port}"
+            with urllib.request.urlopen(f"{base}/jobs?limit=500", timeout=5) as resp:
+                jobs = json.load(resp)["jobs"]
+            for job in jobs:
+                try:
+                    with urllib.request.urlopen(f"{base}/jobs/{job['id']}/profile", timeout=5) as resp:
+                        files.update(a["name"] for a in json.load(resp)["artifacts"])
+                    found += 1
+                except urllib.error.HTTPError:
+                    pass
+        return f"{found} jobs, artifacts: {', '.join(sorted(files))}"
+
+    def cluster_counters(self):
+        """Счетчики координатора: события по исходу и перераспределения по причине."""
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/metrics", timeout=5) as resp:
+            lines = resp.read().decode().splitlines()
+        return {line.split()[0].replace("agent_cluster_", ""): float(line.split()[1]) for line in lines
+                if line.startswith(("agent_cluster_events_total", "agent_cluster_reassignments_total"))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=["issue", "review"], default="issue")
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=5, help="Webhooks per second (0 — all at once)")
+    parser.add_argument("--repos", type=int, default=4, help="Jobs are spread across this many repositories")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--worker-mode", choices=["warm", "subprocess"], default="warm")
+    parser.add_argument("--debounce", type=float, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--changes-rate", type=float, default=0.0, help="Share of reviews that request changes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for all jobs to finish")
+    parser.add_argument("--nodes", type=int, default=0, help="Run a coordinator and this many worker nodes")
+    parser.add_argument("--kill-node", type=float, help="With --nodes: kill the busiest node after this many seconds")
+    parser.add_argument("--profile", action="store_true", help="Profile every job (X-Agent-Profile webhook header)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temp directory with logs")
+    args = parser.parse_args()
+    # Лог запросов фейков заглушает отчет
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    test = LoadTest(args)
+    try:
+        test.start()
+        sampler = RssSampler(process.pid for _, process, _, _ in test.servers)
+        sampler.start()
+        elapsed = test.run()
+        sampler.stop()
+        print(f"queue      {test.queue_stats()}")
+        test.report(elapsed, sampler.peak)
+    finally:
+        test.stop()
+
+
+if __name__ == "__main__":
+    main()
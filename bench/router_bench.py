@@ -0,0 +1,160 @@
+# router_bench.py
+"""Сценарий для роутера LLM (configs/llm_router.py) против нескольких фейковых эндпоинтов.
+
+Поднимает два FakeLLM с разной задержкой и проверяет по шагам:
+    ranking  — после разогрева вызовы уходят на более быстрый эндпоинт;
+    shared   — новый роутер (как в следующей задаче-процессе) сразу знает задержки эндпоинтов;
+    failover — эндпоинт, отвечающий 500, пропускается без ошибки для вызывающего,
+               после MAX_CONSECUTIVE_ERRORS подряд выводится из ротации на COOLDOWN и затем возвращается;
+    hedging  — если быстрый эндпоинт вдруг отвечает дольше своего p95, через p95 уходит дубликат
+               на второй эндпоинт, и ответ приходит от него.
+
+Любое нарушение — AssertionError и ненулевой код возврата.
+
+Запуск из корня проекта:
+    python3 bench/router_bench.py
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# До импорта конфига: свои каталоги лимитов, без лимитов и долгих повторов
+os.environ.update(
+    AGENT_CACHE_DIR=tempfile.mkdtemp(prefix="router-bench-"),
+    LLM_RPM="0", LLM_TPM="0", LLM_CACHE_ENABLED="0",
+    RETRY_MAX_ATTEMPTS="2", RETRY_BASE_BACKOFF="0.05",
+)
+
+from langchain_core.messages import HumanMessage, SystemMessage  # noqa: E402
+
+from configs import llm_router  # noqa: E402
+from configs.llm_router import Endpoint, LLMRouter  # noqa: E402
+from fake_llm import FakeLLM  # noqa: E402
+
+MESSAGES = [SystemMessage(content="You are a Code Reviewer."), HumanMessage(content="Review this diff.")]
+
+
+def _call(router):
+    start = time.monotonic()
+    response = router.invoke(MESSAGES, 0.1)
+    assert response.content == "LGTM", response.content
+    return time.monotonic() - start
+
+
+def check_ranking(router, slow, fast, calls):
+    for _ in range(calls):
+        _call(router)
+    first = router.ranked()[0]
+    print(f"ranking    slow={slow.requests} fast={fast.requests} requests, first={first.name}")
+    assert first.name == "fast", f"expected the fast endpoint first, got {first.name}"
+    # Медленный получает только пробный запрос, пока у него нет статистики
+    assert fast.requests >= calls - 1, "calls did not go to the fast endpoint"
+
+
+def check_shared_stats(slow, fast):
+    # Свежие объекты Endpoint, как после форка новой задачи: статистика читается из общего файла
+    router = LLMRouter([Endpoint(slow.url, "fake-model", "fake", name="slow"),
+                        Endpoint(fast.url, "fake-model", "fake", name="fast")], hedge=False)
+    first = router.ranked()[0]
+    print(f"shared     new router: first={first.name}, fast samples={len(first.latencies)}")
+    assert first.name == "fast", "a new router did not load the endpoint stats"
+    assert len(first.latencies) >= llm_router.HEDGE_MIN_SAMPLES, "latency window was not shared"
+
+
+def check_failover(router, slow, fast, cooldown):
+    fast_ep = next(e for e in router.endpoints if e.name == "fast")
+    fast.error_rate = 1.0
+    before = fast.requests
+    for _ in range(llm_router.MAX_CONSECUTIVE_ERRORS):
+        _call(router)
+    assert not fast_ep.healthy(), "endpoint with consecutive errors is still in rotation"
+    assert router.ranked()[0].name == "slow"
+
+    during = fast.requests
+    for _ in range(3):
+        _call(router)
+    print(f"failover   fast errors={during - before}, requests during cooldown={fast.requests - during}")
+    assert fast.requests == during, "a down endpoint received requests during cooldown"
+
+    fast.error_rate = 0.0
+    time.sleep(cooldown + 0.1)
+    assert fast_ep.healthy(), "endpoint did not return after cooldown"
+    _call(router)
+    assert fast.requests == during + 1, "recovered endpoint did not get the next call"
+    print(f"cooldown   fast back after {cooldown:.1f}s")
+
+
+def check_hedging(fast_latency, samples):
+    # Новые серверы (новые адреса): статистика прошлых шагов здесь не участвует
+    slow, fast = FakeLLM(fast_latency * 3, seed=3), FakeLLM(fast_latency, seed=4)
+    slow.url, fast.url = slow.start(), fast.start()
+    try:
+        _check_hedging(slow, fast, fast_latency, samples)
+    finally:
+        slow.stop()
+        fast.stop()
+
+
+def _check_hedging(slow, fast, fast_latency, samples):
+    endpoints = [Endpoint(slow.url, "fake-model", "fake", name="slow"),
+                 Endpoint(fast.url, "fake-model", "fake", name="fast")]
+    # Статистика задержек для p95 набирается без хеджа: случайный джиттер разогрева не должен его вызвать
+    router = LLMRouter(endpoints, hedge=False)
+    for _ in range(samples):
+        _call(router)
+    fast_ep = endpoints[1]
+    assert router.ranked()[0] is fast_ep
+    router.hedge = True
+    p95 = fast_ep.percentile(0.95)
+
+    # Быстрый эндпоинт "залипает": без хеджа вызов ждал бы 10x его обычной задержки
+    fast.latency = fast_latency * 10
+    slow_before = len(slow.arrivals)
+    start = time.monotonic()
+    elapsed = _call(router)
+    hedge_delay = slow.arrivals[slow_before] - start if len(slow.arrivals) > slow_before else None
+    print(f"hedging    p95={p95 * 1000:.0f}ms, hedge sent after {hedge_delay * 1000 if hedge_delay else -1:.0f}ms, "
+          f"answer in {elapsed * 1000:.0f}ms (stuck primary: {fast.latency * 1000:.0f}ms), hedges={router.hedges}")
+    assert router.hedges == 1, "no hedge was sent"
+    assert hedge_delay is not None and hedge_delay >= p95 * 0.9, "hedge was sent before the primary's p95"
+    assert elapsed < fast.latency, "hedged call was not faster than the stuck primary"
+    # Отмененный запрос проигравшего не попадает в окно задержек как успешный
+    assert fast_ep.cancelled == 1, "the losing request was not recorded as cancelled"
+    assert max(fast_ep.latencies) < fast.latency / 2, "the cancelled attempt was recorded as a latency sample"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fast-latency", type=float, default=0.05)
+    parser.add_argument("--slow-latency", type=float, default=0.3)
+    parser.add_argument("--calls", type=int, default=12)
+    parser.add_argument("--cooldown", type=float, default=1.0, help="Endpoint cooldown for the failover step")
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    llm_router.COOLDOWN = args.cooldown
+    slow, fast = FakeLLM(args.slow_latency, seed=1), FakeLLM(args.fast_latency, seed=2)
+    slow.url, fast.url = slow.start(), fast.start()
+    try:
+        # Медленный первым в конфигурации: выбор быстрого — заслуга статистики, а не порядка
+        router = LLMRouter([Endpoint(slow.url, "fake-model", "fake", name="slow"),
+                            Endpoint(fast.url, "fake-model", "fake", name="fast")], hedge=False)
+        check_ranking(router, slow, fast, args.calls)
+        check_shared_stats(slow, fast)
+        check_failover(router, slow, fast, args.cooldown)
+    finally:
+        slow.stop()
+        fast.stop()
+    check_hedging(args.fast_latency, llm_router.HEDGE_MIN_SAMPLES + 5)
+    print("✅ router: ranking, shared stats, failover, cooldown and hedging behave as expected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# startup_bench.py
+"""Сравнивает задержку старта задачи: холодный python3-процесс против форка от прогретого воркера.
+
+Запуск из корня проекта:
+    python3 bench/startup_bench.py --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agent_worker import WarmPool  # noqa: E402
+
+
+def _summary(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:<6} runs={len(samples):<3} "
+          f"min={samples[0] * 1000:8.1f} ms  "
+          f"p50={statistics.median(samples) * 1000:8.1f} ms  "
+          f"p95={p95 * 1000:8.1f} ms")
+
+
+def bench_cold(runs):
+    # Тот же путь, что и у server.py в режиме subprocess: новый интерпретатор + все импорты
+    pythonpath = os.pathsep.join(filter(None, [ROOT, os.getenv("PYTHONPATH")]))
+    env = dict(os.environ, PYTHONPATH=pythonpath)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT, "agent_worker.py"), "noop"], env=env, check=True)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_warm(runs):
+    pool = WarmPool()
+    start = time.perf_counter()
+    pool.warm_up()
+    print(f"forkserver warm-up: {(time.perf_counter() - start) * 1000:.1f} ms (one-time)")
+
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        exit_code = pool.run("noop", None, None, None)
+        samples.append(time.perf_counter() - start)
+        assert exit_code == 0, f"noop job failed with {exit_code}"
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    cold = bench_cold(args.runs)
+    warm = bench_warm(args.runs)
+    _summary("cold", cold)
+    _summary("warm", warm)
+    print(f"speedup (p50): {statistics.median(cold) / statistics.median(warm):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
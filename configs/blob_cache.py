@@ -0,0 +1,224 @@
+# blob_cache.py
+"""Кэш содержимого файлов по git blob SHA: текст, признак бинарности и производные данные."""
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+
+from configs.config import Config
+from configs.git_tools import is_binary_content, is_text_file, should_ignore_dir
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha TEXT PRIMARY KEY,
+    is_text INTEGER NOT NULL,
+    text TEXT,
+    tokens INTEGER,
+    symbols TEXT,
+    terms TEXT,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+"""
+
+
+class TreeEntry:
+    def __init__(self, path, sha, size):
+        self.path = path
+        self.sha = sha
+        self.size = size
+
+
+class BlobEntry:
+    def __init__(self, sha, is_text, text=None, tokens=None, symbols=None, terms=None):
+        self.sha = sha
+        self.is_text = is_text
+        self.text = text
+        self.tokens = tokens
+        self.symbols = symbols
+        self.terms = terms
+
+
+def list_tree(root, ref="HEAD"):
+    """Файлы ревизии через git ls-tree (без чтения рабочей копии)."""
+    out = subprocess.run(
+        ["git", "ls-tree", "-r", "-z", "-l", ref],
+        cwd=root, capture_output=True, check=True
+    ).stdout.decode("utf-8", errors="replace")
+
+    entries = []
+    for record in out.split("\0"):
+        if not record:
+            continue
+        meta, _, path = record.partition("\t")
+        mode, obj_type, sha, size = meta.split()
+        # Сабмодули и симлинки не индексируем
+        if obj_type != "blob" or mode == "120000":
+            continue
+        parts = path.split("/")
+        if any(should_ignore_dir(d) for d in parts[:-1]) or not is_text_file(parts[-1]):
+            continue
+        entries.append(TreeEntry(path, sha, int(size) if size != "-" else 0))
+    return entries
+
+
+def read_blobs(root, shas):
+    """Читает содержимое нескольких blob-ов одним процессом git cat-file --batch."""
+    if not shas:
+        return {}
+    proc = subprocess.run(
+        ["git", "cat-file", "--batch"],
+        cwd=root, input="\n".join(shas).encode() + b"\n", capture_output=True, check=True
+    )
+    data = proc.stdout
+    result = {}
+    pos = 0
+    while pos < len(data):
+        header_end = data.index(b"\n", pos)
+        header = data[pos:header_end].split()
+        pos = header_end + 1
+        if len(header) < 3 or header[1] == b"missing":
+            continue
+        size = int(header[2])
+        result[header[0].decode()] = data[pos:pos + size]
+        pos += size + 1  # содержимое + завершающий \n
+    return result
+
+
+def dirty_paths(root):
+    """Пути, измененные в рабочей копии относительно HEAD (их нельзя брать из кэша)."""
+    out = subprocess.run(
+        ["git", "status", "--porcelain", "-z", "--untracked-files=no"],
+        cwd=root, capture_output=True, check=True
+    ).stdout.decode("utf-8", errors="replace")
+    return {record[3:] for record in out.split("\0") if len(record) > 3}
+
+
+class BlobCache:
+    """Постоянный кэш (SQLite) по blob SHA, общий для итераций фиксера и разных задач."""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(Config.CACHE_DIR, "blobs.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def get_many(self, shas):
+        found = {}
+        shas = list(shas)
+        with self._lock:
+            # SQLite ограничивает число параметров запроса — читаем пачками
+            for i in range(0, len(shas), 500):
+                chunk = shas[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT sha, is_text, text, tokens, symbols, terms FROM blobs "
+                    f"WHERE sha IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for sha, is_text, text, tokens, symbols, terms in rows:
+                    found[sha] = BlobEntry(
+                        sha, bool(is_text), text, tokens,
+                        json.loads(symbols) if symbols else None,
+                        json.loads(terms) if terms else None,
+                    )
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE blobs SET last_used = ? WHERE sha = ?", [(now, sha) for sha in found])
+                self._conn.commit()
+        return found
+
+    def put_many(self, entries):
+        now = time.time()
+        rows = [
+            (e.sha, int(e.is_text), e.text, e.tokens,
+             json.dumps(e.symbols) if e.symbols is not None else None,
+             json.dumps(e.terms) if e.terms is not None else None, now)
+            for e in entries
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def prune(self, max_entries=None):
+        """Удаляет давно не использованные записи сверх лимита."""
+        max_entries = max_entries or Config.BLOB_CACHE_MAX_ENTRIES
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM blobs").fetchone()
+            if count > max_entries:
+                self._conn.execute(
+                    "DELETE FROM blobs WHERE sha IN (SELECT sha FROM blobs ORDER BY last_used LIMIT ?)",
+                    (count - max_entries,)
+                )
+                self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Общий экземпляр кэша процесса (создается лениво): одно соединение на все сборки индекса."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = BlobCache()
+        return _cache
+
+
+def load_tree_files(root, derive, cache=None, max_bytes=None):
+    """Возвращает [(путь, BlobEntry)] для текстовых файлов HEAD, читая из git только новые blob-ы.
+
+    derive(path, text) -> (tokens, symbols, terms) считает производные данные для нового blob-а.
+    """
+    cache = cache or get_cache()
+    entries = [e for e in list_tree(root) if not max_bytes or e.size <= max_bytes]
+    dirty = dirty_paths(root)
+
+    cached = cache.get_many({e.sha for e in entries if e.path not in dirty})
+    missing = sorted({e.sha for e in entries if e.path not in dirty and e.sha not in cached})
+    raw = read_blobs(root, missing)
+
+    new_entries = {}
+    result = []
+    for e in entries:
+        if e.path in dirty:
+            # Измененный файл читаем с диска и в кэш не кладем
+            try:
+                with open(os.path.join(root, e.path), "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            blob = make_blob_entry(e.sha, e.path, data, derive)
+        elif e.sha in cached:
+            blob = cached[e.sha]
+        elif e.sha in new_entries:
+            blob = new_entries[e.sha]
+        elif e.sha in raw:
+            blob = new_entries[e.sha] = make_blob_entry(e.sha, e.path, raw[e.sha], derive)
+        else:
+            continue
+        if blob.is_text and blob.text and blob.text.strip():
+            result.append((e.path, blob))
+
+    if new_entries:
+        cache.put_many(new_entries.values())
+        # Лимит BLOB_CACHE_MAX_ENTRIES: кэш общий для всех репозиториев и без этого только растет
+        cache.prune()
+    print(f"🗃  Blob cache: {len(cached)} hit, {len(new_entries)} new, {len(dirty)} dirty")
+    return result
+
+
+def make_blob_entry(sha, path, data, derive):
+    if is_binary_content(data):
+        return BlobEntry(sha, False)
+    text = data.decode("utf-8")
+    tokens, symbols, terms = derive(path, text)
+    return BlobEntry(sha, True, text, tokens, symbols, terms)
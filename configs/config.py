@@ -1,6 +1,5 @@
 # config.py
 import os
-import sys
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,6 +8,13 @@ class Config:
     # GitHub credentials
     GITHUB_TOKEN = os.getenv("GH_PAT") or os.getenv("GITHUB_TOKEN")
     REPO_NAME = os.getenv("GITHUB_REPOSITORY")
+    GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+    GITHUB_POOL_SIZE = int(os.getenv("GITHUB_POOL_SIZE", "10"))
+    # Кэш ответов по ETag: сколько живет запись без подтверждения и сколько записей всего
+    GITHUB_ETAG_TTL = int(os.getenv("GITHUB_ETAG_TTL", str(7 * 24 * 3600)))
+    GITHUB_ETAG_MAX_ENTRIES = int(os.getenv("GITHUB_ETAG_MAX_ENTRIES", "20000"))
+    # Откуда клонировать и куда пушить (для бенчмарка — file:// с локальными bare-репозиториями)
+    GIT_BASE_URL = os.getenv("GIT_BASE_URL", "https://github.com")
     # Если запускаем локально для тестов, можно раскомментировать и вписать вручную:
     # if not REPO_NAME:
     #     REPO_NAME = "your-username/your-repo"
@@ -19,16 +25,116 @@ class Config:
     # Модель вынесена в конфиг, чтобы легко менять при необходимости
     MODEL_NAME = os.getenv("MODEL_NAME", "llama-3.3-70b-versatile")
     TEMPERATURE = 0.1
+    # Несколько OpenAI-совместимых эндпоинтов (JSON-список {"base_url", "model", "api_key_env"}):
+    # вызов уходит на самый быстрый здоровый; LLM_HEDGE=1 дублирует запрос, если он дольше p95
+    LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", "")
+    LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+    # Быстрая модель для простых задач (небольшие diff в ревью): имя модели или свой список эндпоинтов
+    LLM_SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "")
+    LLM_SMALL_ENDPOINTS = os.getenv("LLM_SMALL_ENDPOINTS", "")
+
+    # Рабочие директории: кэш bare-зеркал и временные worktree для задач
+    WORKSPACE_DIR = os.getenv("WORKSPACE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ai-agent", "workspaces"))
+    WORKSPACE_MAX_MIRRORS = int(os.getenv("WORKSPACE_MAX_MIRRORS", "20"))
+    WORKSPACE_MAX_BYTES = int(os.getenv("WORKSPACE_MAX_BYTES", str(10 * 1024 ** 3)))
+
+    # Локальные кэши (файлы по git blob SHA и т.п.)
+    CACHE_DIR = os.getenv("AGENT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ai-agent", "cache"))
+    BLOB_CACHE_MAX_ENTRIES = int(os.getenv("BLOB_CACHE_MAX_ENTRIES", "200000"))
+
+    # Потоковая генерация: файлы пишутся по мере готовности, плохой ответ прерывается рано
+    LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+    # Формат правок: "edit" — блоки SEARCH/REPLACE для существующих файлов, "full" — файлы целиком
+    EDIT_FORMAT = os.getenv("EDIT_FORMAT", "edit")
+
+    # Кэш ответов LLM: включается для детерминированных (низкая температура) вызовов
+    LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+    LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.2"))
+    LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+    LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(200 * 1024 ** 2)))
+
+    # Контекст для LLM: бюджет в токенах и доля под repo map
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "24000"))
+    CONTEXT_MAP_SHARE = float(os.getenv("CONTEXT_MAP_SHARE", "0.15"))
+
+    # Ревью больших PR: размер пачки diff в токенах и число параллельных запросов
+    REVIEW_CHUNK_TOKENS = int(os.getenv("REVIEW_CHUNK_TOKENS", "12000"))
+    REVIEW_PARALLELISM = int(os.getenv("REVIEW_PARALLELISM", "4"))
+    # Триаж diff перед ревью: тривиальное — LGTM без LLM, небольшое — быстрой модели, крупное и рискованное — основной
+    REVIEW_TRIAGE = os.getenv("REVIEW_TRIAGE", "1") == "1"
+    REVIEW_SMALL_MAX_LINES = int(os.getenv("REVIEW_SMALL_MAX_LINES", "150"))
+    REVIEW_SKIP_PATTERNS = os.getenv(
+        "REVIEW_SKIP_PATTERNS",
+        "*.lock,*-lock.json,*.lockb,go.sum,*.min.js,*.min.css,*.map,*_pb2.py,*_pb2_grpc.py,*.pb.go,*.snap,"
+        "*.svg,dist/*,vendor/*"
+    )
+    REVIEW_RISKY_PATTERNS = os.getenv(
+        "REVIEW_RISKY_PATTERNS",
+        "*auth*,*security*,*crypt*,*secret*,*token*,*permission*,*migration*,*.sql,Dockerfile,*docker-compose*,"
+        ".github/*,requirements*.txt,setup.py,pyproject.toml,package.json,go.mod"
+    )
+
+    # Исправление по ревью: замечания к независимым файлам генерируются параллельно (1 — одним запросом)
+    FIX_PARALLELISM = int(os.getenv("FIX_PARALLELISM", "4"))
+
+    # Пакетный режим coder.py --batch: сколько задач решается одновременно
+    BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+
+    # Новая задача без клона: файлы и коммит через Git Data API ("api") или через worktree ("workspace")
+    COMMIT_MODE = os.getenv("COMMIT_MODE", "workspace")
+    # Больше измененных файлов — пушим из worktree; больше недостающих blob-ов не скачиваем
+    COMMIT_API_MAX_FILES = int(os.getenv("COMMIT_API_MAX_FILES", "10"))
+    COMMIT_API_MAX_FETCH = int(os.getenv("COMMIT_API_MAX_FETCH", "200"))
+
+    # Профилирование задачи по запросу (cProfile + tracemalloc): метка issue/PR, куда писать и сколько хранить
+    PROFILE_LABEL = os.getenv("PROFILE_LABEL", "agent-profile")
+    PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ai-agent", "profiles"))
+    PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+    PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
+    PROFILE_TRACE_FRAMES = int(os.getenv("PROFILE_TRACE_FRAMES", "8"))
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.5"))
+
+    # Локальная проверка перед пушем (ruff/pytest/go test в worktree) и цикл самоисправления
+    VALIDATE_ENABLED = os.getenv("VALIDATE_ENABLED", "0") == "1"
+    VALIDATE_MAX_ITERATIONS = int(os.getenv("VALIDATE_MAX_ITERATIONS", "3"))
+    VALIDATE_BUDGET = float(os.getenv("VALIDATE_BUDGET", "600"))
+    VALIDATE_TIMEOUT = int(os.getenv("VALIDATE_TIMEOUT", "300"))
+    VALIDATE_MEMORY_MB = int(os.getenv("VALIDATE_MEMORY_MB", "2048"))
+    VALIDATE_OUTPUT_CHARS = int(os.getenv("VALIDATE_OUTPUT_CHARS", "6000"))
+    VALIDATE_RUFF_SELECT = os.getenv("VALIDATE_RUFF_SELECT", "E9,F63,F7,F82")
+
+    # Лимиты вызовов (общие для всех задач на машине): запросы/токены LLM в минуту и запросы GitHub
+    LLM_RPM = int(os.getenv("LLM_RPM", "30"))
+    LLM_TPM = int(os.getenv("LLM_TPM", "100000"))
+    GITHUB_RPM = int(os.getenv("GITHUB_RPM", "900"))
+    GITHUB_MIN_REMAINING = int(os.getenv("GITHUB_MIN_REMAINING", "100"))
+    # Повторы при 429/5xx: экспоненциальная задержка с джиттером, не дольше дедлайна
+    RETRY_DEADLINE = float(os.getenv("RETRY_DEADLINE", "300"))
+    RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "6"))
+    RETRY_BASE_BACKOFF = float(os.getenv("RETRY_BASE_BACKOFF", "1"))
+    RETRY_MAX_BACKOFF = float(os.getenv("RETRY_MAX_BACKOFF", "60"))
 
     # Git User (для коммитов в CI)
     GIT_USER = "AI Agent"
     GIT_EMAIL = "agent@ai.com"
 
+    @staticmethod
+    def configure_job(token=None, repo_name=None):
+        """Подставляет токен и репозиторий задачи (для прогретых воркеров)."""
+        if token:
+            Config.GITHUB_TOKEN = token
+            os.environ["GH_PAT"] = token
+        if repo_name:
+            Config.REPO_NAME = repo_name
+            os.environ["GITHUB_REPOSITORY"] = repo_name
+
     @staticmethod
     def validate():
+        """Проверяет обязательные настройки. Возвращает False, если чего-то не хватает."""
         if not Config.API_KEY:
             print("Error: LLM_API_KEY is missing")
-            sys.exit(1)
+            return False
         if not Config.GITHUB_TOKEN:
             print("Error: GITHUB_TOKEN is missing")
-            sys.exit(1)
\ No newline at end of file
+            return False
+        return True
\ No newline at end of file
@@ -0,0 +1,247 @@
+# context.py
+"""Индекс репозитория и сборка контекста для LLM в пределах бюджета токенов."""
+import math
+import os
+import re
+import time
+from collections import Counter
+
+from configs import metrics
+from configs.blob_cache import load_tree_files
+from configs.config import Config
+from configs.git_tools import is_text_file, should_ignore_dir
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # tiktoken приходит вместе с langchain-openai, но без него тоже работаем
+    _ENCODING = None
+
+# Файлы больше этого размера не индексируем по содержимому (минифицированный код, дампы)
+MAX_INDEX_BYTES = 1024 * 1024
+MAX_SYMBOLS_PER_FILE = 40
+
+CONTEXT_SECONDS = metrics.histogram("agent_context_build_seconds", "Repository index + context build time")
+CONTEXT_BYTES = metrics.histogram("agent_context_bytes", "Size of the built context", metrics.BYTES_BUCKETS)
+CONTEXT_TOKENS = metrics.histogram("agent_context_tokens", "Estimated tokens of the built context", metrics.TOKEN_BUCKETS)
+
+_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+_STOPWORDS = {
+    "the", "and", "for", "with", "this", "that", "from", "into", "not", "are", "was", "you",
+    "self", "return", "import", "def", "class", "function", "const", "let", "var", "none", "true", "false",
+}
+
+# Строки-сигнатуры для repo map: определения функций, классов и типов в популярных языках
+_SYMBOL_PATTERNS = [
+    re.compile(r"^\s*(?:async\s+)?def\s+\w+\s*\(.*"),
+    re.compile(r"^\s*class\s+\w+.*"),
+    re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*\w+\s*\(.*"),
+    re.compile(r"^\s*(?:export\s+)?(?:const|let)\s+\w+\s*=\s*(?:async\s*)?\(.*=>.*"),
+    re.compile(r"^\s*(?:export\s+)?(?:interface|type|enum)\s+\w+.*"),
+    re.compile(r"^func\s+.*"),
+    re.compile(r"^type\s+\w+\s+(?:struct|interface).*"),
+    re.compile(r"^\s*(?:pub\s+)?(?:fn|struct|enum|trait|impl)\s+.*"),
+    re.compile(r"^\s*(?:public|private|protected|internal)\s+[\w<>\[\], ]+\s+\w+\s*\(.*"),
+]
+
+
+def estimate_tokens(text):
+    """Количество токенов в тексте (tiktoken или оценка ~4 символа на токен)."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def tokenize(text):
+    """Разбивает текст на термы: snake_case и camelCase дробятся на части."""
+    terms = []
+    for word in _WORD_RE.findall(text):
+        parts = [p for chunk in word.split("_") for p in _CAMEL_RE.findall(chunk)]
+        for term in [word] + (parts if len(parts) > 1 else []):
+            term = term.lower()
+            if len(term) > 1 and term not in _STOPWORDS:
+                terms.append(term)
+    return terms
+
+
+def extract_symbols(text):
+    """Сигнатуры функций/классов файла для repo map."""
+    symbols = []
+    for line in text.splitlines():
+        if len(line) > 200:
+            continue
+        for pattern in _SYMBOL_PATTERNS:
+            if pattern.match(line):
+                symbols.append(line.strip().rstrip("{:").strip())
+                break
+        if len(symbols) >= MAX_SYMBOLS_PER_FILE:
+            break
+    return symbols
+
+
+def iter_project_files(root):
+    """Относительные пути текстовых файлов проекта (без служебных каталогов и бинарных расширений)."""
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not should_ignore_dir(d))
+        for file in sorted(files):
+            if is_text_file(file):
+                yield os.path.relpath(os.path.join(dirpath, file), root)
+
+
+def derive_file_data(path, text):
+    """Производные данные файла, которые кэшируются вместе с blob-ом: (токены, сигнатуры, термы)."""
+    return estimate_tokens(text), extract_symbols(text), dict(Counter(tokenize(text)))
+
+
+def _read_text(full_path):
+    """Текст файла для индекса или None (слишком большой, бинарный, недоступный)."""
+    try:
+        if os.path.getsize(full_path) > MAX_INDEX_BYTES:
+            return None
+        with open(full_path, "r", encoding="utf-8") as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+    return text if text.strip() else None
+
+
+class IndexedFile:
+    def __init__(self, path, text, symbols=None, tokens=None, terms=None):
+        self.path = path
+        self.text = text
+        self.symbols = symbols if symbols is not None else extract_symbols(text)
+        self.tokens = tokens if tokens is not None else estimate_tokens(text)
+        self.terms = Counter(terms) if terms is not None else Counter(tokenize(text))
+        self.path_terms = set(tokenize(path.replace("/", " ").replace(".", " ")))
+        self.symbol_terms = set(tokenize(" ".join(self.symbols)))
+        self.length = sum(self.terms.values()) or 1
+
+
+class RepoIndex:
+    """Лексический индекс по путям, символам и содержимому файлов (BM25)."""
+
+    def __init__(self, files):
+        self.files = files
+        self.avg_length = sum(f.length for f in files) / len(files) if files else 1
+        self.doc_freq = Counter()
+        for f in files:
+            self.doc_freq.update(f.terms.keys())
+
+    @classmethod
+    def build(cls, root, cache=None):
+        """Индексирует репозиторий: для git — через кэш blob-ов, иначе обходом диска."""
+        if os.path.exists(os.path.join(root, ".git")):
+            try:
+                return cls.build_from_git(root, cache)
+            except Exception as e:
+                print(f"⚠️ Blob cache unavailable, scanning files: {e}")
+
+        files = []
+        for rel_path in iter_project_files(root):
+            text = _read_text(os.path.join(root, rel_path))
+            if text:
+                files.append(IndexedFile(rel_path, text))
+        return cls(files)
+
+    @classmethod
+    def build_from_git(cls, root, cache=None):
+        # Между итерациями фиксера меняются 2-3 blob-а: остальные берем из кэша
+        entries = load_tree_files(root, derive_file_data, cache=cache, max_bytes=MAX_INDEX_BYTES)
+        return cls([
+            IndexedFile(path, blob.text, symbols=blob.symbols, tokens=blob.tokens, terms=blob.terms)
+            for path, blob in entries
+        ])
+
+    def with_paths(self, root, paths):
+        """Индекс с добавленными файлами с диска: build_from_git видит только отслеживаемые,
+        а только что созданные моделью файлы еще не в git."""
+        known = {f.path for f in self.files}
+        extra = []
+        for rel_path in dict.fromkeys(paths):
+            if rel_path in known or not is_text_file(rel_path):
+                continue
+            text = _read_text(os.path.join(root, rel_path))
+            if text:
+                extra.append(IndexedFile(rel_path, text))
+        return RepoIndex(self.files + extra) if extra else self
+
+    def _idf(self, term):
+        n = len(self.files)
+        df = self.doc_freq.get(term, 0)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def rank(self, query):
+        """Файлы, отсортированные по релевантности запросу (issue или замечаниям ревью)."""
+        query_terms = Counter(tokenize(query))
+        query_lower = query.lower()
+        k1, b = 1.2, 0.75
+        scored = []
+
+        for f in self.files:
+            score = 0.0
+            for term in query_terms:
+                idf = self._idf(term)
+                tf = f.terms.get(term, 0)
+                if tf:
+                    score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * f.length / self.avg_length))
+                # Совпадения в пути и сигнатурах весят больше, чем в теле файла
+                if term in f.path_terms:
+                    score += 2.0 * idf
+                if term in f.symbol_terms:
+                    score += 1.5 * idf
+            # Файл упомянут в запросе явно — почти наверняка нужен
+            if f.path.lower() in query_lower or os.path.basename(f.path).lower() in query_lower:
+                score += 50.0
+            scored.append((score, f))
+
+        scored.sort(key=lambda item: (-item[0], item[1].tokens))
+        return [f for _, f in scored]
+
+
+def format_file(path, text):
+    return f"\n<FILE path=\"{path}\">\n{text}\n</FILE>\n"
+
+
+def build_context(root, query, budget_tokens=None, index=None):
+    """Собирает контекст: самые релевантные файлы целиком + repo map для остальных."""
+    start = time.monotonic()
+    budget = budget_tokens or Config.CONTEXT_TOKEN_BUDGET
+    index = index or RepoIndex.build(root)
+    map_budget = int(budget * Config.CONTEXT_MAP_SHARE)
+    files_budget = budget - map_budget
+
+    included, left_out = [], []
+    used = 0
+    for f in index.rank(query):
+        # Файл целиком или никак: обрезанный код только сбивает модель
+        cost = f.tokens + 12
+        if used + cost <= files_budget:
+            included.append(format_file(f.path, f.text))
+            used += cost
+        else:
+            left_out.append(f)
+
+    # Неиспользованный остаток бюджета файлов отдаем карте репозитория
+    map_budget += files_budget - used
+    map_lines, map_used = [], 0
+    for f in left_out:
+        line = (f"{f.path}: " + "; ".join(f.symbols)) if f.symbols else f.path
+        cost = estimate_tokens(line) + 1
+        if cost > map_budget:
+            continue
+        map_lines.append(line)
+        map_budget -= cost
+        map_used += cost
+
+    parts = list(included)
+    if map_lines:
+        parts.append("\n<REPO_MAP>\n" + "\n".join(map_lines) + "\n</REPO_MAP>\n")
+
+    print(f"📚 Контекст: {len(included)} файлов целиком, {len(map_lines)} в repo map (~{used} токенов)")
+    context = "".join(parts)
+    CONTEXT_SECONDS.observe(time.monotonic() - start)
+    CONTEXT_BYTES.observe(len(context.encode("utf-8")))
+    CONTEXT_TOKENS.observe(used + map_used)
+    return context
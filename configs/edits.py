@@ -0,0 +1,289 @@
+# edits.py
+"""Разбор ответа LLM с файлами (целиком или потоково), применение правок SEARCH/REPLACE
+и атомарная запись в рабочую копию."""
+import difflib
+import os
+import re
+import tempfile
+
+# Эти файлы агент никогда не перезаписывает
+PROTECTED_PATHS = {"coder.py", "reviewer.py", "configs/llm.py"}
+
+# <FILE> — файл целиком, <EDIT> — блоки SEARCH/REPLACE к существующему файлу
+_FILE_BLOCK_RE = re.compile(r'<(FILE|EDIT) path="([^"\n]+)">\n(.*?)\n</\1>', re.DOTALL)
+_FILE_HEADER_RE = re.compile(r'<(FILE|EDIT) path="([^"\n]+)">$')
+_HUNK_RE = re.compile(r"^<<<<<<< SEARCH\n(.*?)^=======\n(.*?)^>>>>>>> REPLACE$", re.DOTALL | re.MULTILINE)
+
+# Порог похожести для нечеткого поиска якоря и минимальный отрыв от второго кандидата
+FUZZY_THRESHOLD = 0.9
+FUZZY_MARGIN = 0.05
+
+# Ограничения, по которым поток признается "ушедшим с формата"
+MAX_PROSE_CHARS = 4000
+MAX_HEADER_CHARS = 400
+MAX_FILE_CHARS = 500_000
+
+
+class StreamFormatError(Exception):
+    """Ответ LLM не соответствует формату <FILE path=...> — генерацию стоит прервать."""
+
+
+def parse_files(text):
+    files = []
+    for match in _FILE_BLOCK_RE.finditer(text):
+        files.append({"path": match.group(2), "content": match.group(3), "kind": match.group(1).lower()})
+    return files
+
+
+class FileStreamParser:
+    """Конечный автомат для потока ответа: отдает каждый <FILE>/<EDIT> сразу после закрывающего тега."""
+
+    def __init__(self):
+        self._buf = ""
+        self._path = None   # путь открытого блока или None, если мы вне блока
+        self._tag = None    # FILE или EDIT
+        self._scan = 0      # до какой позиции буфер уже просмотрен внутри блока
+        self._prose = 0
+        self.files_done = 0
+
+    def feed(self, chunk):
+        """Добавляет кусок ответа и возвращает список завершенных файлов."""
+        self._buf += chunk
+        done = []
+        while True:
+            if self._path is None:
+                if not self._open_block():
+                    break
+            else:
+                file = self._close_block()
+                if file is None:
+                    break
+                done.append(file)
+        return done
+
+    def close(self):
+        """Проверяет, что поток не оборвался посреди файла."""
+        if self._path is not None:
+            raise StreamFormatError(f"Response truncated inside {self._path}")
+
+    def _open_block(self):
+        starts = [i for i in (self._buf.find("<FILE"), self._buf.find("<EDIT")) if i != -1]
+        start = min(starts) if starts else -1
+        if start == -1:
+            # Хвост может оказаться началом тега — оставляем его в буфере
+            keep = min(len(self._buf), 4)
+            self._count_prose(len(self._buf) - keep)
+            self._buf = self._buf[len(self._buf) - keep:]
+            return False
+
+        self._count_prose(start)
+        header_end = self._buf.find("\n", start)
+        if header_end == -1:
+            if len(self._buf) - start > MAX_HEADER_CHARS:
+                raise StreamFormatError("Malformed <FILE> header")
+            self._buf = self._buf[start:]
+            return False
+
+        header = self._buf[start:header_end]
+        match = _FILE_HEADER_RE.match(header)
+        if not match:
+            raise StreamFormatError(f"Malformed <FILE> header: {header[:100]!r}")
+
+        self._tag, self._path = match.group(1), match.group(2)
+        self._buf = self._buf[header_end + 1:]
+        self._scan = 0
+        self._prose = 0
+        return True
+
+    def _close_block(self):
+        close_tag = f"</{self._tag}>"
+        if self._buf.startswith(close_tag):
+            # Пустой файл
+            content = ""
+            rest = self._buf[len(close_tag):]
+        else:
+            end = self._buf.find("\n" + close_tag, self._scan)
+            if end == -1:
+                nested = max(self._buf.find("\n<FILE path=", self._scan), self._buf.find("\n<EDIT path=", self._scan))
+                if nested != -1:
+                    raise StreamFormatError(f"Unclosed <{self._tag}> block for {self._path}")
+                if len(self._buf) > MAX_FILE_CHARS:
+                    raise StreamFormatError(f"File {self._path} exceeds {MAX_FILE_CHARS} chars")
+                # Следующий поиск начинаем почти с конца: тег может прийти по частям
+                self._scan = max(0, len(self._buf) - len(close_tag) - 1)
+                return None
+            content = self._buf[:end]
+            rest = self._buf[end + len(close_tag) + 1:]
+
+        file = {"path": self._path, "content": content, "kind": self._tag.lower()}
+        self._buf = rest
+        self._path = None
+        self.files_done += 1
+        return file
+
+    def _count_prose(self, n):
+        self._prose += n
+        if self._prose > MAX_PROSE_CHARS:
+            raise StreamFormatError("Too much text outside <FILE> blocks")
+
+
+class EditError(Exception):
+    """Блок SEARCH/REPLACE не удалось применить однозначно."""
+
+
+def parse_hunks(content):
+    """Блоки SEARCH/REPLACE из тела <EDIT>: список пар (search, replace)."""
+    return [(m.group(1), m.group(2)) for m in _HUNK_RE.finditer(content)]
+
+
+def _indent(line):
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _reindent(lines, found, expected):
+    """Сдвигает замену на разницу отступов найденного и указанного в SEARCH фрагмента."""
+    if found == expected:
+        return lines
+    if found.startswith(expected):
+        extra = found[len(expected):]
+        return [extra + line if line.strip() else line for line in lines]
+    if expected.startswith(found):
+        cut = len(expected) - len(found)
+        return [line[cut:] if line[:cut].strip() == "" else line.lstrip() for line in lines]
+    return lines
+
+
+def _find_lines(lines, search, normalize):
+    n = len(search)
+    target = [normalize(line) for line in search]
+    return [i for i in range(len(lines) - n + 1) if [normalize(line) for line in lines[i:i + n]] == target]
+
+
+def _uniform_shift(lines, search):
+    """Отличаются ли отступы найденного фрагмента от SEARCH на один и тот же сдвиг."""
+    shifts = {(_indent(a), _indent(b)) for a, b in zip(lines, search) if b.strip()}
+    deltas = set()
+    for found, expected in shifts:
+        if found.startswith(expected):
+            deltas.add(("+", found[len(expected):]))
+        elif expected.startswith(found):
+            deltas.add(("-", expected[len(found):]))
+        else:
+            return False
+    return len(deltas) <= 1
+
+
+def _find_fuzzy(lines, search):
+    """Лучшее окно той же длины по похожести; None, если совпадение слабое или неоднозначное."""
+    n = len(search)
+    target = "\n".join(line.strip() for line in search)
+    scores = []
+    for i in range(len(lines) - n + 1):
+        matcher = difflib.SequenceMatcher(None, "\n".join(line.strip() for line in lines[i:i + n]), target, autojunk=False)
+        if matcher.real_quick_ratio() < FUZZY_THRESHOLD or matcher.quick_ratio() < FUZZY_THRESHOLD:
+            continue
+        scores.append((matcher.ratio(), i))
+    scores.sort(reverse=True)
+    if not scores or scores[0][0] < FUZZY_THRESHOLD:
+        best = scores[0][0] if scores else 0.0
+        raise EditError(f"SEARCH block not found (best similarity {best:.2f})")
+    if len(scores) > 1 and scores[0][0] - scores[1][0] < FUZZY_MARGIN:
+        raise EditError("SEARCH block is ambiguous: several similar places")
+    return scores[0][1], f"fuzzy {scores[0][0]:.2f}"
+
+
+def apply_hunk(text, search, replace):
+    """Применяет один блок. Возвращает (новый текст, способ совпадения) или бросает EditError.
+
+    Порядок: точное совпадение, совпадение строк без хвостовых пробелов, без учета отступов,
+    затем нечеткое. Найденное больше одного раза не применяется.
+    """
+    if not search.strip():
+        # Пустой SEARCH — дописать в конец (или создать файл)
+        if text and not text.endswith("\n"):
+            text += "\n"
+        return text + replace, "append"
+
+    count = text.count(search)
+    if count == 1:
+        return text.replace(search, replace, 1), "exact"
+    if count > 1:
+        raise EditError(f"SEARCH block is ambiguous: {count} exact matches")
+
+    lines = text.splitlines(keepends=True)
+    search_lines = search.splitlines()
+    # Пустые строки по краям SEARCH модель часто добавляет или теряет
+    while search_lines and not search_lines[0].strip():
+        search_lines.pop(0)
+    while search_lines and not search_lines[-1].strip():
+        search_lines.pop()
+    replace_lines = replace.splitlines()
+
+    for normalize, how in ((str.rstrip, "whitespace"), (str.strip, "indent")):
+        found = _find_lines(lines, search_lines, normalize)
+        if how == "indent":
+            found = [i for i in found if _uniform_shift(lines[i:i + len(search_lines)], search_lines)]
+        if len(found) > 1:
+            raise EditError(f"SEARCH block is ambiguous: {len(found)} matches ignoring {how}")
+        if found:
+            start = found[0]
+            break
+    else:
+        start, how = _find_fuzzy(lines, search_lines)
+        if not _uniform_shift(lines[start:start + len(search_lines)], search_lines):
+            # Отступы в SEARCH другого стиля — сдвинуть замену корректно не получится
+            raise EditError("SEARCH block matches only with a different indentation style")
+
+    end = start + len(search_lines)
+    new_lines = _reindent(replace_lines, _indent(lines[start]), _indent(search_lines[0]))
+    tail = "\n" if lines[end - 1].endswith("\n") else ""
+    replacement = "\n".join(new_lines) + tail if new_lines else ""
+    return "".join(lines[:start]) + replacement + "".join(lines[end:]), how
+
+
+def apply_edits(text, hunks):
+    """Применяет блоки по очереди. Возвращает (текст, отчет [{hunk, ok, how|error}])."""
+    report = []
+    for i, (search, replace) in enumerate(hunks, 1):
+        try:
+            text, how = apply_hunk(text, search, replace)
+            report.append({"hunk": i, "ok": True, "how": how})
+        except EditError as e:
+            report.append({"hunk": i, "ok": False, "error": str(e)})
+    return text, report
+
+
+def resolve_path(work_dir, path):
+    """Абсолютный путь внутри рабочей копии или None, если путь запрещен."""
+    root = os.path.realpath(work_dir)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if not full_path.startswith(root + os.sep):
+        return None
+    # Сверяем уже нормализованный путь: "./coder.py" и "configs/../coder.py" — тот же файл
+    if os.path.relpath(full_path, root).replace(os.sep, "/") in PROTECTED_PATHS:
+        return None
+    return full_path
+
+
+def write_file_atomic(work_dir, path, content):
+    """Пишет файл через временный файл и os.replace: читатель не увидит половину файла."""
+    full_path = resolve_path(work_dir, path)
+    if full_path is None:
+        raise PermissionError(f"Path is protected or outside the repository: {path}")
+
+    directory = os.path.dirname(full_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".agent-", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        if os.path.exists(full_path):
+            os.chmod(tmp_path, os.stat(full_path).st_mode & 0o777)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return full_path
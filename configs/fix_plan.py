@@ -0,0 +1,151 @@
+# fix_plan.py
+"""План исправления по ревью: пункты замечаний -> файлы -> независимые группы для параллельных запросов.
+
+Файлы, упомянутые в одном пункте, попадают в одну группу. Каждой группе нужен только ее код
+и прямые зависимости (локальные импорты). Пункты без однозначного файла собираются в общую группу
+с обычным контекстом по всему репозиторию.
+"""
+import os
+import re
+
+from configs.context import RepoIndex, build_context
+
+# "1. ...", "2) ...", "**3.** ..." в начале строки (вложенные списки с большим отступом не делим)
+_ITEM_RE = re.compile(r"^ {0,3}(?:\*\*)?\d+[.)]", re.MULTILINE)
+_FOOTER_RE = re.compile(r"^(?:⚠️ \*\*Review Status:\*\*.*|<!-- ai-reviewer:.*-->)\s*$", re.MULTILINE)
+
+_PY_IMPORT_RE = re.compile(r"^\s*(?:from\s+(\.*[\w.]*)\s+import\s+\(?([\w, ]+)|import\s+([\w.]+))", re.MULTILINE)
+_JS_IMPORT_RE = re.compile(r"""(?:\bfrom\s+|\brequire\(\s*|^\s*import\s+)['"](\.{1,2}/[^'"]+)['"]""", re.MULTILINE)
+_JS_EXTS = ("", ".ts", ".tsx", ".js", ".jsx", ".mjs", "/index.ts", "/index.js")
+
+MAX_DEPENDENCIES = 6
+
+
+class FixTask:
+    def __init__(self, targets, findings, context):
+        self.targets = targets      # файлы, которые группа должна исправить (пусто — общая группа)
+        self.findings = findings    # текст пунктов ревью этой группы
+        self.context = context
+
+    @property
+    def name(self):
+        return ", ".join(self.targets) if self.targets else "general"
+
+
+def split_findings(feedback):
+    """Пункты нумерованного списка замечаний вместе с продолжением (без служебного хвоста комментария)."""
+    feedback = _FOOTER_RE.sub("", feedback)
+    starts = [m.start() for m in _ITEM_RE.finditer(feedback)]
+    ends = starts[1:] + [len(feedback)]
+    return [feedback[s:e].strip() for s, e in zip(starts, ends)]
+
+
+def _mentions(lower, name):
+    # Подстрока должна быть целым путем: "a.py" не совпадает с "data.py"
+    return name in lower and re.search(rf"(?<![\w/.-]){re.escape(name)}\b", lower) is not None
+
+
+def mentioned_files(text, paths):
+    """Файлы, упомянутые в тексте: полный путь или однозначное имя файла."""
+    lower = text.lower()
+    found = {p for p in paths if _mentions(lower, p.lower())}
+    by_name = {}
+    for p in paths:
+        by_name.setdefault(os.path.basename(p).lower(), []).append(p)
+    for name, candidates in by_name.items():
+        if len(candidates) == 1 and candidates[0] not in found and _mentions(lower, name):
+            found.add(candidates[0])
+    return found
+
+
+def _group(findings, paths):
+    """Union-find по файлам: пункты, затрагивающие общий файл, попадают в одну группу."""
+    parent = {}
+
+    def find(p):
+        while parent.setdefault(p, p) != p:
+            p = parent[p]
+        return p
+
+    mapped, general = [], []
+    for item in findings:
+        files = sorted(mentioned_files(item, paths))
+        if not files:
+            general.append(item)
+            continue
+        for f in files[1:]:
+            parent[find(f)] = find(files[0])
+        mapped.append((item, files))
+
+    groups = {}
+    for item, files in mapped:
+        root = find(files[0])
+        targets, items = groups.setdefault(root, (set(), []))
+        targets.update(files)
+        items.append(item)
+    return [(sorted(t), items) for t, items in groups.values()], general
+
+
+def _resolve_python(module, base_dir, known):
+    base = module.replace(".", "/")
+    if base_dir:
+        base = f"{base_dir}/{base}"
+    for candidate in (f"{base}.py", f"{base}/__init__.py"):
+        if candidate in known:
+            return candidate
+    return None
+
+
+def direct_dependencies(path, text, known):
+    """Локальные файлы, которые импортирует path (Python и относительные импорты JS/TS)."""
+    deps = []
+    directory = os.path.dirname(path)
+    if path.endswith(".py"):
+        for from_module, names, module in _PY_IMPORT_RE.findall(text):
+            if module:
+                deps.append(_resolve_python(module, None, known))
+                continue
+            dots = len(from_module) - len(from_module.lstrip("."))
+            name = from_module[dots:]
+            base_dir = None
+            if dots:
+                base_dir = directory
+                for _ in range(dots - 1):
+                    base_dir = os.path.dirname(base_dir)
+            if name:
+                deps.append(_resolve_python(name, base_dir, known))
+            # from pkg import module — модулем может оказаться и импортируемое имя
+            for imported in names.split(","):
+                imported = imported.split()[0] if imported.split() else ""
+                if imported:
+                    deps.append(_resolve_python(f"{name}.{imported}" if name else imported, base_dir, known))
+    elif path.endswith((".js", ".jsx", ".ts", ".tsx", ".mjs")):
+        for spec in _JS_IMPORT_RE.findall(text):
+            base = os.path.normpath(os.path.join(directory, spec))
+            dep = next((base + ext for ext in _JS_EXTS if base + ext in known), None)
+            if dep:
+                deps.append(dep)
+    return [d for d in dict.fromkeys(deps) if d and d != path][:MAX_DEPENDENCIES]
+
+
+def plan_fixes(root, feedback, index=None):
+    """Группы для параллельного исправления или None, если делить нечего (меньше двух групп)."""
+    index = index or RepoIndex.build(root)
+    files = {f.path: f for f in index.files}
+    groups, general = _group(split_findings(feedback), list(files))
+    if len(groups) + bool(general) < 2 or not groups:
+        return None
+
+    tasks = []
+    for targets, items in groups:
+        findings = "\n".join(items)
+        focused = dict.fromkeys(targets)
+        for target in targets:
+            focused.update(dict.fromkeys(direct_dependencies(target, files[target].text, files)))
+        # Только сама группа и то, что она импортирует: индекс из нескольких файлов
+        sub_index = RepoIndex([files[p] for p in focused])
+        tasks.append(FixTask(targets, findings, build_context(root, f"{findings}\n{' '.join(targets)}", index=sub_index)))
+    if general:
+        findings = "\n".join(general)
+        tasks.append(FixTask([], findings, build_context(root, findings, index=index)))
+    return tasks
@@ -0,0 +1,344 @@
+# github_client.py
+"""Общий клиент GitHub на задачу/воркер: пул соединений, условные запросы (ETag) и GraphQL-пакеты."""
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+import requests
+from requests.adapters import HTTPAdapter
+from github import Auth, Github
+
+from configs import metrics, throttle
+from configs.config import Config
+
+_ETAG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS etags (
+    url TEXT PRIMARY KEY,
+    etag TEXT NOT NULL,
+    body TEXT NOT NULL,
+    link TEXT,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS etags_stored_at ON etags (stored_at);
+"""
+
+# Комментарии, статусы и метаданные PR одним запросом вместо трех-четырех REST-вызовов
+PR_BUNDLE_QUERY = """
+query($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      headRefName
+      headRefOid
+      baseRefName
+      baseRefOid
+      comments(last: 100) {
+        totalCount
+        nodes { body author { login } }
+      }
+      commits(last: 1) {
+        nodes { commit { oid status { state contexts { state description context } } } }
+      }
+    }
+  }
+}
+"""
+
+
+GITHUB_REQUESTS = metrics.counter("agent_github_requests_total", "GitHub REST/GraphQL requests by status")
+
+
+class EtagCache:
+    """Локальное хранилище ответов по ETag: повторный GET отдает 304 и не тратит лимит.
+
+    Запись живет GITHUB_ETAG_TTL секунд с последнего подтверждения (200 или 304), всего записей —
+    не больше GITHUB_ETAG_MAX_ENTRIES: лишние и устаревшие удаляются при открытии кэша.
+    """
+
+    def __init__(self, path=None, ttl=None, max_entries=None):
+        self.path = path or os.path.join(Config.CACHE_DIR, "github_etags.sqlite3")
+        self.ttl = ttl or Config.GITHUB_ETAG_TTL
+        self.max_entries = max_entries or Config.GITHUB_ETAG_MAX_ENTRIES
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_ETAG_SCHEMA)
+        self._conn.commit()
+        self.prune()
+
+    def get(self, url):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT etag, body, link FROM etags WHERE url = ? AND stored_at >= ?", (url, time.time() - self.ttl)
+            ).fetchone()
+
+    def touch(self, url):
+        """Ответ подтвержден 304 — продлеваем жизнь записи."""
+        with self._lock:
+            self._conn.execute("UPDATE etags SET stored_at = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+
+    def prune(self):
+        """Удаляет устаревшие записи и самые старые сверх лимита."""
+        with self._lock:
+            self._conn.execute("DELETE FROM etags WHERE stored_at < ?", (time.time() - self.ttl,))
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM etags").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM etags WHERE url IN (SELECT url FROM etags ORDER BY stored_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def put(self, url, etag, body, link):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO etags (url, etag, body, link, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (url, etag, body, link, time.time())
+            )
+            self._conn.commit()
+
+
+class GitHubClient:
+    def __init__(self, token, repo_name):
+        self.token = token
+        self.repo_name = repo_name
+        self.api_url = Config.GITHUB_API_URL.rstrip("/")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=Config.GITHUB_POOL_SIZE, pool_maxsize=Config.GITHUB_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/vnd.github+json",
+        })
+        self.etags = EtagCache()
+        self.conditional_hits = 0
+        self._github = None
+        self._repo = None
+        self._bundles = {}
+        self._login = None
+        self._lock = threading.Lock()
+        self.bucket = throttle.github_bucket()
+
+    # --- PyGithub (для операций, которых нет в быстрых путях ниже) ---
+
+    @property
+    def github(self):
+        if self._github is None:
+            # retry=None: повторы делает только throttle.call, иначе повторы PyGithub умножаются на наши
+            self._github = Github(auth=Auth.Token(self.token), base_url=self.api_url, pool_size=Config.GITHUB_POOL_SIZE,
+                                  retry=None)
+        return self._github
+
+    def repo(self):
+        """Объект репозитория PyGithub — запрашивается один раз за задачу."""
+        with self._lock:
+            if self._repo is None:
+                self._repo = self.call(lambda: self.github.get_repo(self.repo_name), "get_repo")
+            return self._repo
+
+    def call(self, fn, name="github"):
+        """Выполняет вызов PyGithub через общий лимит установки с повторами."""
+        return throttle.call(fn, [(self.bucket, 1)], name=name)
+
+    # --- REST с условными запросами ---
+
+    def _url(self, path):
+        return path if path.startswith("http") else f"{self.api_url}{path}"
+
+    def _request(self, method, url, **kwargs):
+        """HTTP-запрос через token bucket установки; 429/5xx и сетевые ошибки повторяются."""
+        def send():
+            resp = self.session.request(method, url, timeout=60, **kwargs)
+            throttle.observe_github_headers(resp.headers, self.bucket)
+            GITHUB_REQUESTS.inc(method=method, status=resp.status_code)
+            if resp.status_code != 304:
+                resp.raise_for_status()
+            return resp
+        return throttle.call(send, [(self.bucket, 1)], name=f"GitHub {method}")
+
+    def get(self, path, params=None):
+        """GET с If-None-Match: при 304 тело берется из локального кэша."""
+        url = requests.Request("GET", self._url(path), params=params).prepare().url
+        cached = self.etags.get(url)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+
+        resp = self._request("GET", url, headers=headers)
+        if resp.status_code == 304 and cached:
+            self.conditional_hits += 1
+            self.etags.touch(url)
+            return json.loads(cached[1]), cached[2]
+
+        link = resp.headers.get("Link")
+        if resp.headers.get("ETag"):
+            self.etags.put(url, resp.headers["ETag"], resp.text, link)
+        return resp.json(), link
+
+    def get_paginated(self, path, params=None):
+        params = dict(params or {}, per_page=100)
+        items, url = [], path
+        while url:
+            page, link = self.get(url, params)
+            items.extend(page)
+            url, params = _next_link(link), None
+        return items
+
+    def post(self, path, payload):
+        return self._request("POST", self._url(path), json=payload).json()
+
+    def graphql(self, query, variables):
+        data = self._request("POST", f"{self.api_url}/graphql", json={"query": query, "variables": variables}).json()
+        if data.get("errors"):
+            raise RuntimeError(f"GraphQL error: {data['errors']}")
+        return data["data"]
+
+    # --- Высокоуровневые операции над PR ---
+
+    def pr_files(self, number):
+        """Файлы PR (filename, status, patch) — страницы запрашиваются условно."""
+        files = self.get_paginated(f"/repos/{self.repo_name}/pulls/{number}/files")
+        return [SimpleNamespace(filename=f["filename"], status=f["status"], patch=f.get("patch")) for f in files]
+
+    def pr_bundle(self, number, refresh=False):
+        """Метаданные PR + последние комментарии + статус CI одним GraphQL-запросом (кэш на задачу)."""
+        number = int(number)
+        if not refresh and number in self._bundles:
+            return self._bundles[number]
+
+        owner, name = self.repo_name.split("/", 1)
+        try:
+            pr = self.graphql(PR_BUNDLE_QUERY, {"owner": owner, "name": name, "number": number})["repository"]["pullRequest"]
+            commits = pr["commits"]["nodes"]
+            status = commits[0]["commit"]["status"] if commits else None
+            bundle = {
+                "head_ref": pr["headRefName"],
+                "head_sha": pr["headRefOid"],
+                "base_ref": pr["baseRefName"],
+                "base_sha": pr["baseRefOid"],
+                "comments": [c["body"] or "" for c in pr["comments"]["nodes"]],
+                "comment_authors": [(c["author"] or {}).get("login") or "" for c in pr["comments"]["nodes"]],
+                "comments_total": pr["comments"]["totalCount"],
+                "ci_statuses": (status or {}).get("contexts") or [],
+            }
+        except Exception as e:
+            # GraphQL недоступен — собираем то же самое через REST
+            print(f"⚠️ GraphQL bundle failed, using REST: {e}")
+            bundle = self._pr_bundle_rest(number)
+
+        self._bundles[number] = bundle
+        return bundle
+
+    def _pr_bundle_rest(self, number):
+        pr, _ = self.get(f"/repos/{self.repo_name}/pulls/{number}")
+        comments = self.get_paginated(f"/repos/{self.repo_name}/issues/{number}/comments")
+        statuses, _ = self.get(f"/repos/{self.repo_name}/commits/{pr['head']['sha']}/statuses")
+        return {
+            "head_ref": pr["head"]["ref"],
+            "head_sha": pr["head"]["sha"],
+            "base_ref": pr["base"]["ref"],
+            "base_sha": pr["base"]["sha"],
+            "comments": [c["body"] or "" for c in comments],
+            "comment_authors": [(c.get("user") or {}).get("login") or "" for c in comments],
+            "comments_total": len(comments),
+            "ci_statuses": [{"state": s["state"].upper(), "description": s.get("description"), "context": s.get("context")}
+                            for s in statuses],
+        }
+
+    def own_login(self):
+        """Логин, от имени которого агент пишет комментарии: AGENT_LOGIN (сервер подставляет логин
+        приложения) или владелец токена (PAT). None — определить не удалось."""
+        if self._login is None:
+            login = os.getenv("AGENT_LOGIN")
+            if not login:
+                try:
+                    login = self.get("/user")[0]["login"]
+                except requests.HTTPError as e:
+                    # Токен установки не имеет доступа к /user
+                    print(f"⚠️ Не удалось определить логин агента: {e}")
+                    login = ""
+            self._login = login
+        return self._login or None
+
+    # --- Git Data API (коммит без локального клона) ---
+
+    def get_branch_sha(self, branch):
+        """SHA головы ветки или None, если ветки нет."""
+        try:
+            ref, _ = self.get(f"/repos/{self.repo_name}/git/ref/heads/{branch}")
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+        return ref["object"]["sha"]
+
+    def get_tree(self, commit_sha):
+        """(SHA дерева, рекурсивный список файлов, обрезан ли список) для коммита."""
+        commit, _ = self.get(f"/repos/{self.repo_name}/git/commits/{commit_sha}")
+        tree, _ = self.get(f"/repos/{self.repo_name}/git/trees/{commit['tree']['sha']}", {"recursive": "1"})
+        return commit["tree"]["sha"], tree["tree"], tree.get("truncated", False)
+
+    def get_blob(self, sha):
+        # Blob неизменяем и попадает в кэш blob-ов — в ETag-кэш его не кладем
+        blob = self._request("GET", self._url(f"/repos/{self.repo_name}/git/blobs/{sha}")).json()
+        if blob.get("encoding") == "base64":
+            return base64.b64decode(blob["content"])
+        return blob["content"].encode("utf-8")
+
+    def create_commit(self, base_tree, parent_sha, files, message):
+        """Одно дерево с новыми файлами поверх base_tree и коммит на нем. files: {путь: (mode, текст)}."""
+        tree = self.post(f"/repos/{self.repo_name}/git/trees", {
+            "base_tree": base_tree,
+            "tree": [{"path": path, "mode": mode, "type": "blob", "content": text}
+                     for path, (mode, text) in sorted(files.items())],
+        })
+        commit = self.post(f"/repos/{self.repo_name}/git/commits", {
+            "message": message, "tree": tree["sha"], "parents": [parent_sha],
+        })
+        return commit["sha"]
+
+    def update_branch(self, branch, sha, create=False):
+        """Создает ветку или двигает ее вперед (без force: гонку с чужим пушем GitHub отклонит)."""
+        if create:
+            self.post(f"/repos/{self.repo_name}/git/refs", {"ref": f"refs/heads/{branch}", "sha": sha})
+        else:
+            self._request("PATCH", self._url(f"/repos/{self.repo_name}/git/refs/heads/{branch}"),
+                          json={"sha": sha, "force": False})
+
+    def create_issue_comment(self, number, body):
+        comment = self.post(f"/repos/{self.repo_name}/issues/{number}/comments", {"body": body})
+        # Список комментариев изменился — пакет PR нужно перечитать
+        self._bundles.pop(int(number), None)
+        return comment["html_url"]
+
+
+def _next_link(link):
+    if not link:
+        return None
+    for part in link.split(","):
+        url, _, rel = part.partition(";")
+        if 'rel="next"' in rel:
+            return url.strip().strip("<>")
+    return None
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(token=None, repo_name=None):
+    """Общий клиент на (токен установки, репозиторий) на все время жизни задачи/воркера."""
+    token = token or os.getenv("GH_PAT") or Config.GITHUB_TOKEN or os.getenv("GITHUB_TOKEN")
+    repo_name = repo_name or os.getenv("GITHUB_REPOSITORY") or Config.REPO_NAME
+    if not token or not repo_name:
+        raise ValueError("Не настроены GITHUB_TOKEN или REPO_NAME")
+
+    with _clients_lock:
+        client = _clients.get((token, repo_name))
+        if client is None:
+            client = _clients[(token, repo_name)] = GitHubClient(token, repo_name)
+        return client
@@ -1,7 +1,32 @@
 # llm.py
-from langchain_openai import ChatOpenAI
+import itertools
+import time
 from langchain_core.messages import HumanMessage, SystemMessage
 from configs.config import Config
+from configs.llm_cache import get_cache, make_key
+from configs.llm_router import LLM_SECONDS, charge_output, get_router
+
+# Формат правок блоками SEARCH/REPLACE: модель печатает только изменяемые места, а не файлы целиком
+EDIT_FORMAT_RULES = """
+IMPORTANT: To change an EXISTING file, return only the changed places as SEARCH/REPLACE blocks:
+<EDIT path="path/to/file.ext">
+<<<<<<< SEARCH
+exact lines copied from the current file
+=======
+new lines
+>>>>>>> REPLACE
+</EDIT>
+To create a NEW file, return its full content:
+<FILE path="path/to/new_file.ext">
+code content here
+</FILE>
+IMPORTANT RULES:
+1. SEARCH must copy the existing lines exactly, including indentation, and must match ONE place in the file.
+   Include a few surrounding lines if the changed line is not unique.
+2. Use several small blocks for several changes; keep blocks in the order they appear in the file.
+3. An empty SEARCH section appends the REPLACE lines to the end of the file.
+4. DO NOT use placeholders like "// ... existing code ..." inside SEARCH or REPLACE.
+"""
 
 # Промпты вынесены отдельно
 PROMPTS = {
@@ -12,6 +37,9 @@ Your task is to solve the User's Issue based on the provided project context.
 2. ADAPT your coding style, naming conventions, and syntax to match the existing project.
 3. IMPLEMENT the solution AND write a basic unit test file (e.g., test_solution.py) to verify it.
 
+The most relevant project files are provided in full. Other files are listed in <REPO_MAP> with their signatures only;
+do not rewrite a file you have not seen in full.
+
 IMPORTANT: Return the full content of the created or modified files wrapped in XML-like tags:
 <FILE path="path/to/file.ext">
 code content here
@@ -26,6 +54,7 @@ IMPORTANT RULES:
     "coder_fix": """You are a Code Fixer Agent.
 Your goal is to fix errors reported by the Reviewer or Linter.
 Analyze the provided code and the error report.
+Files in <REPO_MAP> are shown by signatures only — do not rewrite them unless you must.
 Return the FULLY CORRECTED file content in <FILE path="..."> tags.
 Maintain the original language and style of the file.
 IMPORTANT RULES:
@@ -34,6 +63,24 @@ IMPORTANT RULES:
 3. If the file is long, you MUST still write every single line.
 4. Your output will be written directly to a file, so incomplete code will break the system.""",
 
+    "coder_new_edit": """You are an expert Senior Software Engineer capable of writing code in any programming language.
+Your task is to solve the User's Issue based on the provided project context.
+
+1. ANALYZE the project structure and existing file extensions to determine the technology stack (e.g., Python, JavaScript, Go, C++).
+2. ADAPT your coding style, naming conventions, and syntax to match the existing project.
+3. IMPLEMENT the solution AND write a basic unit test file (e.g., test_solution.py) to verify it.
+
+The most relevant project files are provided in full. Other files are listed in <REPO_MAP> with their signatures only;
+do not edit a file you have not seen in full.
+""" + EDIT_FORMAT_RULES,
+
+    "coder_fix_edit": """You are a Code Fixer Agent.
+Your goal is to fix errors reported by the Reviewer or Linter.
+Analyze the provided code and the error report.
+Files in <REPO_MAP> are shown by signatures only — do not edit them unless you must.
+Maintain the original language and style of the file.
+""" + EDIT_FORMAT_RULES,
+
     "reviewer": """You are a strict Code Reviewer & QA Engineer.
 Analyze the Pull Request changes for logic errors, security vulnerabilities, and code style violations.
 Do not assume a specific language; adapt your review based on the file extension (.py, .js, .go, etc.).
@@ -41,26 +88,100 @@ Do not assume a specific language; adapt your review based on the file extension
 Output format:
 - If the code is good and meets requirements: Write ONLY "LGTM" (Looks Good To Me).
 - If there are issues: Provide a numbered list of critical issues and suggestions using markdown.
+""",
+
+    "review_merge": """You are the lead Code Reviewer merging partial reviews of one large Pull Request.
+Each partial review covered a different part of the diff.
+
+1. Merge all findings into ONE numbered markdown list, ordered by severity.
+2. Remove duplicates and findings that contradict each other; keep file names in every item.
+3. Do not invent new issues.
+
+Output format:
+- If none of the findings is a real problem: Write ONLY "LGTM" (Looks Good To Me).
+- Otherwise: Output only the merged numbered list.
 """
 }
 
 def get_llm(temp=None):
-    """Возвращает настроенный инстанс LLM"""
-    return ChatOpenAI(
-        model=Config.MODEL_NAME,
-        openai_api_key=Config.API_KEY,
-        base_url=Config.BASE_URL,
-        temperature=temp if temp is not None else Config.TEMPERATURE
-    )
-
-def invoke_llm(system_prompt: str, user_content: str):
-    llm = get_llm()
+    """Возвращает клиент LLM самого быстрого здорового эндпоинта (клиенты долгоживущие)"""
+    endpoint = get_router().ranked()[0]
+    return endpoint.client(temp if temp is not None else Config.TEMPERATURE)
+
+def invoke_llm(system_prompt: str, user_content: str, use_cache: bool = True, temp=None, tier=None):
+    """Вызывает LLM. Повторный одинаковый запрос с низкой температурой берется из локального кэша.
+
+    tier="small" — быстрая модель (LLM_SMALL_MODEL), если она настроена.
+    """
+    temperature = temp if temp is not None else Config.TEMPERATURE
+    cacheable = use_cache and Config.LLM_CACHE_ENABLED and temperature <= Config.LLM_CACHE_MAX_TEMPERATURE
+    router = get_router(tier)
+
+    if cacheable:
+        cache = get_cache()
+        key = make_key(router.cache_model, temperature, system_prompt, user_content)
+        cached = cache.get(key)
+        if cached is not None:
+            print("⚡ LLM cache hit")
+            return cached
+
     messages = [
         SystemMessage(content=system_prompt),
         HumanMessage(content=user_content)
     ]
     try:
-        return llm.invoke(messages).content
+        result = router.invoke(messages, temperature).content
     except Exception as e:
         print(f"LLM Error: {e}")
-        raise e
\ No newline at end of file
+        raise e
+
+    if cacheable and result:
+        cache.put(key, result)
+    return result
+
+def stream_llm(system_prompt: str, user_content: str, use_cache: bool = True, temp=None):
+    """Потоковый вызов LLM: отдает текст по кускам по мере генерации.
+
+    Если потребитель прервал итерацию (close()), HTTP-поток закрывается и генерация останавливается.
+    """
+    temperature = temp if temp is not None else Config.TEMPERATURE
+    cacheable = use_cache and Config.LLM_CACHE_ENABLED and temperature <= Config.LLM_CACHE_MAX_TEMPERATURE
+    router = get_router()
+
+    if cacheable:
+        cache = get_cache()
+        key = make_key(router.cache_model, temperature, system_prompt, user_content)
+        cached = cache.get(key)
+        if cached is not None:
+            print("⚡ LLM cache hit")
+            yield cached
+            return
+
+    messages = [
+        SystemMessage(content=system_prompt),
+        HumanMessage(content=user_content)
+    ]
+    parts, stream, buckets = [], None, None
+    start = time.monotonic()
+    try:
+        endpoint, buckets, stream, first = router.stream(messages, temperature)
+        if first is not None:
+            for chunk in itertools.chain([first], stream):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+    except GeneratorExit:
+        # Генерацию прервали — закрываем HTTP-поток, неполный ответ в кэш не кладем
+        if stream is not None:
+            stream.close()
+        raise
+    except Exception as e:
+        print(f"LLM Error: {e}")
+        raise e
+    finally:
+        if buckets is not None:
+            charge_output(buckets, "".join(parts))
+            LLM_SECONDS.observe(time.monotonic() - start, endpoint=endpoint.name, kind="stream")
+
+    if cacheable and parts:
+        cache.put(key, "".join(parts))
@@ -0,0 +1,127 @@
+# llm_cache.py
+"""Локальный кэш ответов LLM (SQLite) с TTL и LRU-вытеснением по размеру."""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from configs import metrics
+from configs.config import Config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Счетчики текущего процесса (постоянные — в таблице stats)
+hits = 0
+misses = 0
+CACHE_LOOKUPS = metrics.counter("agent_llm_cache_total", "LLM response cache lookups")
+
+
+def make_key(model, temperature, system_prompt, user_content):
+    payload = json.dumps([model, temperature, system_prompt, user_content], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path=None, ttl=None, max_bytes=None):
+        self.path = path or os.path.join(Config.CACHE_DIR, "llm.sqlite3")
+        self.ttl = ttl if ttl is not None else Config.LLM_CACHE_TTL
+        self.max_bytes = max_bytes if max_bytes is not None else Config.LLM_CACHE_MAX_BYTES
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def _count(self, name):
+        self._conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def get(self, key):
+        global hits, misses
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                self._count("hits")
+                self._conn.commit()
+                hits += 1
+                CACHE_LOOKUPS.inc(result="hit")
+                return row[0]
+            if row:
+                # Истек TTL
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._count("misses")
+            self._conn.commit()
+            misses += 1
+            CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+    def put(self, key, response):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+        # Удаляем самые давно использованные записи, пока не уложимся в лимит
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if total - freed <= self.max_bytes:
+                break
+            victims.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def stats(self):
+        with self._lock:
+            persisted = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": persisted.get("hits", 0),
+            "misses": persisted.get("misses", 0),
+            "process_hits": hits,
+            "process_misses": misses,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Общий экземпляр кэша процесса (создается лениво)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
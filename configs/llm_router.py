@@ -0,0 +1,373 @@
+# llm_router.py
+"""Маршрутизация вызовов LLM между несколькими OpenAI-совместимыми эндпоинтами.
+
+Для каждого эндпоинта живет свой клиент и скользящее окно задержек/ошибок. Вызов уходит на самый
+быстрый здоровый эндпоинт; при включенном хеджировании, если ответ не пришел за p95, запускается
+дубликат на следующем эндпоинте, и проигравший запрос отменяется.
+
+Окно статистики лежит в файле под блокировкой fcntl (как bucket-ы throttle): задачи-процессы короткие,
+и каждая начинает с задержками, накопленными предыдущими, а не с пустой статистикой.
+"""
+import asyncio
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+
+from langchain_openai import ChatOpenAI
+
+from configs import metrics, throttle
+from configs.config import Config
+from configs.context import estimate_tokens
+
+# Сколько последних вызовов учитывается в статистике эндпоинта
+WINDOW = 50
+# Хеджируем только когда p95 посчитан хотя бы по стольким вызовам
+HEDGE_MIN_SAMPLES = 10
+# После стольких ошибок подряд эндпоинт выводится из ротации на COOLDOWN секунд
+MAX_CONSECUTIVE_ERRORS = 3
+COOLDOWN = 30
+STATS_DIR = os.path.join(Config.CACHE_DIR, "llm_endpoints")
+
+LLM_SECONDS = metrics.histogram("agent_llm_seconds", "LLM call latency")
+LLM_PROMPT_TOKENS = metrics.histogram("agent_llm_prompt_tokens", "Prompt tokens per LLM call", metrics.TOKEN_BUCKETS)
+LLM_COMPLETION_TOKENS = metrics.histogram("agent_llm_completion_tokens", "Completion tokens per LLM call",
+                                          metrics.TOKEN_BUCKETS)
+LLM_ERRORS = metrics.counter("agent_llm_errors_total", "Failed LLM calls")
+LLM_HEDGES = metrics.counter("agent_llm_hedges_total", "Hedged duplicate LLM requests")
+LLM_CANCELLED = metrics.counter("agent_llm_cancelled_total", "LLM requests cancelled after losing a hedge")
+
+
+class Endpoint:
+    def __init__(self, base_url, model, api_key, name=None):
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key
+        self.name = name or f"{model}@{base_url}"
+        self.latencies = []
+        self.outcomes = []
+        self.consecutive_errors = 0
+        self.down_until = 0
+        self.cancelled = 0
+        # Статистика общая для всех процессов: ключ — модель и адрес, а не имя из конфигурации
+        self.path = os.path.join(STATS_DIR, re.sub(r"[^A-Za-z0-9._-]", "_", f"{model}@{base_url}")[:200] + ".json")
+        self._mtime = None
+        self._shared = True
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def client(self, temperature):
+        """Долгоживущий клиент на эндпоинт и температуру: соединения переиспользуются между вызовами."""
+        with self._lock:
+            if temperature not in self._clients:
+                self._clients[temperature] = ChatOpenAI(
+                    model=self.model,
+                    openai_api_key=self.api_key,
+                    base_url=self.base_url,
+                    temperature=temperature,
+                    # Повторы делает throttle с общими лимитами, а не клиент в каждом процессе
+                    max_retries=0
+                )
+            return self._clients[temperature]
+
+    def _update(self, fn=None):
+        """Читает общее состояние эндпоинта (fn — еще и меняет его) под блокировкой и обновляет локальную копию."""
+        try:
+            os.makedirs(STATS_DIR, exist_ok=True)
+            with open(self.path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX if fn else fcntl.LOCK_SH)
+                try:
+                    f.seek(0)
+                    raw = f.read()
+                    try:
+                        state = json.loads(raw) if raw else {}
+                    except ValueError:
+                        state = {}
+                    if fn:
+                        fn(state)
+                        f.seek(0)
+                        f.truncate()
+                        f.write(json.dumps(state))
+                        f.flush()
+                    mtime = os.fstat(f.fileno()).st_mtime_ns
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        except OSError as e:
+            # Без общего файла роутер работает на статистике своего процесса
+            if self._shared:
+                print(f"⚠️ LLM endpoint stats unavailable ({e})")
+                self._shared = False
+            state, mtime = self._snapshot(), None
+            if fn:
+                fn(state)
+        with self._lock:
+            self.latencies = state.get("latencies", [])[-WINDOW:]
+            self.outcomes = state.get("outcomes", [])[-WINDOW:]
+            self.consecutive_errors = state.get("consecutive_errors", 0)
+            self.down_until = state.get("down_until", 0)
+            self._mtime = mtime
+
+    def _snapshot(self):
+        with self._lock:
+            return {"latencies": list(self.latencies), "outcomes": list(self.outcomes),
+                    "consecutive_errors": self.consecutive_errors, "down_until": self.down_until}
+
+    def refresh(self):
+        """Подхватывает статистику, записанную другими процессами (файл перечитывается, только если изменился)."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime is None or mtime != self._mtime:
+            self._update()
+
+    def record(self, latency=None, error=False):
+        if error:
+            LLM_ERRORS.inc(endpoint=self.name)
+        elif latency is not None:
+            LLM_SECONDS.observe(latency, endpoint=self.name, kind="invoke")
+
+        def apply(state):
+            outcomes = state.setdefault("outcomes", [])
+            outcomes.append(error)
+            del outcomes[:-WINDOW]
+            if error:
+                state["consecutive_errors"] = state.get("consecutive_errors", 0) + 1
+                if state["consecutive_errors"] >= MAX_CONSECUTIVE_ERRORS:
+                    state["down_until"] = time.time() + COOLDOWN
+            else:
+                state["consecutive_errors"] = 0
+                if latency is not None:
+                    latencies = state.setdefault("latencies", [])
+                    latencies.append(latency)
+                    del latencies[:-WINDOW]
+        self._update(apply)
+
+    def record_cancelled(self):
+        """Запрос отменен, потому что хедж ответил раньше: его время — не задержка эндпоинта."""
+        LLM_CANCELLED.inc(endpoint=self.name)
+        with self._lock:
+            self.cancelled += 1
+
+    def percentile(self, q):
+        with self._lock:
+            values = sorted(self.latencies)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def error_rate(self):
+        with self._lock:
+            return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def healthy(self):
+        # После COOLDOWN эндпоинт снова получает запрос; новая ошибка сразу выводит его обратно
+        return time.time() >= self.down_until
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "error_rate": round(self.error_rate(), 3),
+            "calls": len(self.outcomes),
+            "cancelled": self.cancelled,
+            "healthy": self.healthy(),
+        }
+
+
+def load_endpoints(tier=None):
+    """Эндпоинты из LLM_ENDPOINTS (JSON-список) или один эндпоинт из BASE_URL/MODEL_NAME.
+
+    tier="small" — быстрая дешевая модель: LLM_SMALL_ENDPOINTS или LLM_SMALL_MODEL на основном BASE_URL.
+    """
+    spec, model = Config.LLM_ENDPOINTS, Config.MODEL_NAME
+    if tier == "small":
+        spec, model = Config.LLM_SMALL_ENDPOINTS, Config.LLM_SMALL_MODEL or Config.MODEL_NAME
+    if not spec:
+        return [Endpoint(Config.BASE_URL, model, Config.API_KEY)]
+    endpoints = []
+    for item in json.loads(spec):
+        # Ключ можно передать явно или именем переменной окружения, чтобы не класть секрет в JSON
+        api_key = item.get("api_key") or os.getenv(item.get("api_key_env", "")) or Config.API_KEY
+        endpoints.append(Endpoint(item["base_url"], item.get("model", model), api_key, item.get("name")))
+    return endpoints
+
+
+def has_tier(tier):
+    """Настроена ли отдельная модель для уровня (иначе вызовы уровня идут на основную)."""
+    if tier == "small":
+        return bool(Config.LLM_SMALL_MODEL or Config.LLM_SMALL_ENDPOINTS)
+    return tier in (None, "large")
+
+
+class LLMRouter:
+    def __init__(self, endpoints=None, hedge=None):
+        self.endpoints = endpoints or load_endpoints()
+        self.hedge = Config.LLM_HEDGE if hedge is None else hedge
+        self.hedges = 0
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    @property
+    def cache_model(self):
+        """Имя "модели" для ключа кэша: ответ зависит от набора моделей, а не от выбранного эндпоинта."""
+        return "+".join(sorted({e.model for e in self.endpoints}))
+
+    def ranked(self):
+        """Эндпоинты от самого быстрого здорового; если здоровых нет — все по порядку конфигурации."""
+        for endpoint in self.endpoints:
+            endpoint.refresh()
+        healthy = [e for e in self.endpoints if e.healthy()]
+        if not healthy:
+            return list(self.endpoints)
+        # Часто ошибающиеся — в конец; эндпоинт без статистики пробуем первым, чтобы узнать его задержку
+        return sorted(healthy, key=lambda e: (e.error_rate() >= 0.5, e.percentile(0.5) or 0.0))
+
+    # --- Синхронные вызовы с переключением на следующий эндпоинт ---
+
+    def invoke(self, messages, temperature):
+        """Возвращает сообщение ответа (AIMessage)."""
+        order = self.ranked()
+        if self.hedge and len(order) > 1 and len(order[0].latencies) >= HEDGE_MIN_SAMPLES:
+            return self._run(self._hedged(messages, temperature, order))
+
+        prompt_tokens = _prompt_tokens(messages)
+        for i, endpoint in enumerate(order):
+            last = i == len(order) - 1
+            buckets = throttle.llm_buckets(endpoint.base_url, prompt_tokens)
+            start = time.monotonic()
+            try:
+                # Пока есть запасные эндпоинты, не ждем повторов на медленном/сломанном
+                response = throttle.call(
+                    lambda: endpoint.client(temperature).invoke(messages), buckets,
+                    max_attempts=None if last else 1, name=f"LLM {endpoint.name}"
+                )
+            except Exception as e:
+                endpoint.record(error=True)
+                if last:
+                    raise
+                print(f"⚠️ LLM endpoint {endpoint.name} failed ({e}), switching")
+                continue
+            endpoint.record(time.monotonic() - start)
+            charge_output(buckets, response.content, getattr(response, "usage_metadata", None))
+            return response
+
+    def stream(self, messages, temperature):
+        """Потоковый вызов: (эндпоинт, bucket-ы, итератор кусков, первый кусок). Хеджирование для потока не применяется."""
+        order = self.ranked()
+        prompt_tokens = _prompt_tokens(messages)
+        for i, endpoint in enumerate(order):
+            last = i == len(order) - 1
+            buckets = throttle.llm_buckets(endpoint.base_url, prompt_tokens)
+
+            def open_stream():
+                # Запрос уходит на первом next(): до первого куска ошибку можно безопасно повторить
+                stream = endpoint.client(temperature).stream(messages)
+                return stream, next(stream, None)
+
+            try:
+                stream, first = throttle.call(open_stream, buckets, max_attempts=None if last else 1,
+                                              name=f"LLM stream {endpoint.name}")
+            except Exception as e:
+                endpoint.record(error=True)
+                if last:
+                    raise
+                print(f"⚠️ LLM endpoint {endpoint.name} failed ({e}), switching")
+                continue
+            # Время до первого куска несравнимо с полным ответом — в окно задержек не пишем
+            endpoint.record()
+            return endpoint, buckets, stream, first
+
+    # --- Хеджированные вызовы (asyncio, запросы отменяются) ---
+
+    def _run(self, coro):
+        # Асинхронные клиенты привязаны к циклу событий, поэтому цикл один на процесс и живет в своем потоке
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="llm-router", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _attempt(self, endpoint, messages, temperature):
+        buckets = throttle.llm_buckets(endpoint.base_url, _prompt_tokens(messages))
+        deadline = time.time() + Config.RETRY_DEADLINE
+        await asyncio.get_running_loop().run_in_executor(None, throttle.acquire, buckets, deadline)
+        start = time.monotonic()
+        try:
+            response = await endpoint.client(temperature).ainvoke(messages)
+        except asyncio.CancelledError:
+            # Проигравший запрос — не ошибка; его неполное время в окно задержек не пишем, иначе
+            # медленный эндпоинт выглядел бы быстрее
+            endpoint.record_cancelled()
+            raise
+        except Exception:
+            endpoint.record(error=True)
+            raise
+        endpoint.record(time.monotonic() - start)
+        charge_output(buckets, response.content, getattr(response, "usage_metadata", None))
+        return response
+
+    async def _hedged(self, messages, temperature, order):
+        primary, backups = order[0], order[1:]
+        tasks = {asyncio.create_task(self._attempt(primary, messages, temperature))}
+        done, _ = await asyncio.wait(tasks, timeout=primary.percentile(0.95))
+
+        errors = []
+        try:
+            while True:
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(task.exception())
+                # Первичный запрос медленнее своего p95 или упал — подключаем следующий эндпоинт
+                if backups:
+                    backup = backups.pop(0)
+                    if not done:
+                        self.hedges += 1
+                        LLM_HEDGES.inc()
+                        print(f"🏁 Хедж: {primary.name} дольше p95, дублируем на {backup.name}")
+                    tasks.add(asyncio.create_task(self._attempt(backup, messages, temperature)))
+                if not tasks:
+                    raise errors[-1]
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Отменяем проигравший запрос: HTTP-соединение закрывается, токены не тратятся
+            for task in tasks:
+                task.cancel()
+
+    def stats(self):
+        return {"hedges": self.hedges, "endpoints": [e.stats() for e in self.endpoints]}
+
+
+def _prompt_tokens(messages):
+    return estimate_tokens("".join(m.content for m in messages))
+
+
+def charge_output(buckets, text, usage=None):
+    """Докладывает в TPM-лимит токены ответа (до вызова учтены только токены промпта)."""
+    usage = usage or {}
+    tokens = usage.get("output_tokens") or estimate_tokens(text)
+    buckets[1][0].consume(tokens)
+    LLM_PROMPT_TOKENS.observe(usage.get("input_tokens") or buckets[1][1])
+    LLM_COMPLETION_TOKENS.observe(tokens)
+
+
+_routers = {}
+_router_lock = threading.Lock()
+
+
+def get_router(tier=None):
+    """Общий роутер процесса на уровень модели (создается лениво — уже после форка воркера).
+
+    Ненастроенный уровень обслуживает основной роутер.
+    """
+    tier = tier if tier and tier != "large" and has_tier(tier) else None
+    with _router_lock:
+        if tier not in _routers:
+            _routers[tier] = LLMRouter(load_endpoints(tier))
+        return _routers[tier]
@@ -0,0 +1,186 @@
+# metrics.py
+"""Минимальный реестр метрик в формате Prometheus (счетчики и гистограммы с метками).
+
+Процессы задач копят метрики у себя и в конце отправляют их серверу (push), а сервер
+суммирует их в своем реестре и отдает на /metrics.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+import urllib.request
+
+# Секунды: от быстрых запросов к API до долгой генерации кода
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (100, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 ** 2, 5 * 1024 ** 2, 20 * 1024 ** 2)
+
+_lock = threading.Lock()
+_registry = {}
+
+
+def _key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self.values.items())]
+
+    def dump(self):
+        return [[list(map(list, key)), value] for key, value in self.values.items()]
+
+    def load(self, data):
+        for key, value in data:
+            key = tuple(map(tuple, key))
+            self.values[key] = self.values.get(key, 0) + value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # key -> [счетчики по корзинам (не накопительные) + корзина +Inf, сумма, количество]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _key(labels)
+        with _lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def render(self):
+        lines = []
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def dump(self):
+        return [[list(map(list, key)), state] for key, state in self.values.items()]
+
+    def load(self, data):
+        for key, (counts, total, count) in data:
+            key = tuple(map(tuple, key))
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0] = [a + b for a, b in zip(state[0], counts)]
+            state[1] += total
+            state[2] += count
+
+
+def counter(name, help):
+    """Регистрирует счетчик (или возвращает уже зарегистрированный)."""
+    with _lock:
+        if name not in _registry:
+            _registry[name] = Counter(name, help)
+        return _registry[name]
+
+
+def histogram(name, help, buckets=DEFAULT_BUCKETS):
+    with _lock:
+        if name not in _registry:
+            _registry[name] = Histogram(name, help, buckets)
+        return _registry[name]
+
+
+def render():
+    """Текст в формате экспозиции Prometheus."""
+    lines = []
+    with _lock:
+        for name in sorted(_registry):
+            metric = _registry[name]
+            if not metric.values:
+                continue
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def snapshot(reset=False):
+    """Значения всех метрик для отправки серверу; reset=True обнуляет их (чтобы не отправить дважды)."""
+    with _lock:
+        data = {}
+        for name, metric in _registry.items():
+            if not metric.values:
+                continue
+            data[name] = {"type": metric.type, "help": metric.help, "values": metric.dump()}
+            if metric.type == "histogram":
+                data[name]["buckets"] = list(metric.buckets)
+            if reset:
+                metric.values = {}
+        return data
+
+
+def merge(data):
+    """Добавляет присланные процессом задачи значения к реестру сервера."""
+    for name, item in data.items():
+        if item["type"] == "histogram":
+            metric = histogram(name, item["help"], item["buckets"])
+        else:
+            metric = counter(name, item["help"])
+        with _lock:
+            metric.load(item["values"])
+
+
+def push(url=None):
+    """Отправляет накопленные метрики серверу (AGENT_METRICS_URL). Ошибка отправки задачу не роняет."""
+    url = url or os.getenv("AGENT_METRICS_URL")
+    if not url:
+        return False
+    data = snapshot(reset=True)
+    if not data:
+        return True
+    request = urllib.request.Request(url, data=json.dumps(data).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=5):
+            return True
+    except Exception as e:
+        print(f"⚠️ Metrics push failed: {e}")
+        # Возвращаем значения, чтобы не потерять их при следующей попытке
+        merge(data)
+        return False
@@ -0,0 +1,200 @@
+# profiling.py
+"""Профилирование отдельной задачи по запросу: cProfile (CPU) и tracemalloc (память).
+
+Включается флагом задачи (метка PROFILE_LABEL на issue/PR, заголовок X-Agent-Profile вебхука,
+--profile в CLI). Артефакты пишутся в PROFILE_DIR/<job_id>/ и отдаются сервером на
+/jobs/<job_id>/profile. Без флага profile_job ничего не делает: ни хуков, ни трассировки.
+"""
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import resource
+import shutil
+import threading
+import time
+import tracemalloc
+
+from configs.config import Config
+
+_JOB_ID_RE = re.compile(r"^[\w.-]{1,64}$")
+# Служебные кадры, которые только мешают в топе аллокаций
+_MEMORY_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def valid_job_id(job_id):
+    return bool(job_id) and _JOB_ID_RE.match(str(job_id)) is not None and str(job_id).strip(".") != ""
+
+
+def profile_dir(job_id):
+    if not valid_job_id(job_id):
+        raise ValueError(f"Invalid job id for profiling: {job_id!r}")
+    return os.path.join(Config.PROFILE_DIR, str(job_id))
+
+
+class _ThreadProfiles:
+    """cProfile видит только свой поток: рабочим потокам задачи (параллельные запросы к LLM)
+    включаем по отдельному профайлеру при старте, а в конце сливаем статистику."""
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def hook(self, frame, event, arg):
+        # Первое событие нового потока: дальше его профилирует собственный cProfile
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+
+class _PeakSampler(threading.Thread):
+    """Снимок tracemalloc на пике: к концу задачи временные списки и строки уже освобождены,
+    а RSS растет именно из-за них. Новый снимок берется, когда трассируемая память выросла на 10%."""
+
+    def __init__(self, interval):
+        super().__init__(name="profile-peak-sampler", daemon=True)
+        self.interval = interval
+        self.snapshot = None
+        self.size = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            current, _ = tracemalloc.get_traced_memory()
+            if current > self.size * 1.1:
+                self.snapshot = tracemalloc.take_snapshot()
+                self.size = current
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def _top_lines(snapshot, top):
+    snapshot = snapshot.filter_traces(_MEMORY_FILTERS)
+    lines = [str(stat) for stat in snapshot.statistics("lineno")[:top]]
+    lines += ["", f"--- top {min(top, 10)} by traceback ---"]
+    for stat in snapshot.statistics("traceback")[:min(top, 10)]:
+        lines.append(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks")
+        lines += [f"    {line}" for line in stat.traceback.format()]
+    return lines
+
+
+def _write_cpu(out, main, threads, top):
+    stats = pstats.Stats(main)
+    for profile in threads:
+        # Потоки к этому моменту завершены (пулы задачи закрываются через with)
+        profile.disable()
+        stats.add(profile)
+    stats.dump_stats(os.path.join(out, "cpu.prof"))
+
+    text = io.StringIO()
+    stats.stream = text
+    for key in ("cumulative", "tottime"):
+        text.write(f"=== top {top} by {key} ===\n")
+        stats.sort_stats(key).print_stats(top)
+    with open(os.path.join(out, "cpu.txt"), "w") as f:
+        f.write(text.getvalue())
+
+
+def _write_memory(out, top, sampler):
+    current, peak = tracemalloc.get_traced_memory()
+    sampler.stop()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    snapshot.dump(os.path.join(out, "memory.snapshot"))
+
+    lines = [f"traced: current {current / 1024 ** 2:.1f} MiB, peak {peak / 1024 ** 2:.1f} MiB", ""]
+    if sampler.snapshot is not None:
+        sampler.snapshot.dump(os.path.join(out, "memory-peak.snapshot"))
+        lines += [f"=== top {top} allocations near peak ({sampler.size / 1024 ** 2:.1f} MiB) ==="]
+        lines += _top_lines(sampler.snapshot, top) + [""]
+    lines += [f"=== top {top} allocations at job end ==="]
+    lines += _top_lines(snapshot, top)
+    with open(os.path.join(out, "memory.txt"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return peak
+
+
+def prune(keep=None):
+    """Оставляет артефакты только последних keep задач."""
+    keep = Config.PROFILE_KEEP if keep is None else keep
+    try:
+        entries = [e for e in os.scandir(Config.PROFILE_DIR) if e.is_dir()]
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def profile_job(job_id, **meta):
+    """Профилирует тело with, если задан job_id; иначе — пустой контекст."""
+    if not job_id:
+        yield None
+        return
+    out = profile_dir(job_id)
+    os.makedirs(out, exist_ok=True)
+    print(f"🔬 Профилирование задачи {job_id}: {out}")
+
+    threads = _ThreadProfiles()
+    tracemalloc.start(Config.PROFILE_TRACE_FRAMES)
+    # Сэмплер стартует до хука потоков: его самого профилировать не нужно
+    sampler = _PeakSampler(Config.PROFILE_SAMPLE_INTERVAL)
+    sampler.start()
+    threading.setprofile(threads.hook)
+    main = cProfile.Profile()
+    wall, usage = time.monotonic(), resource.getrusage(resource.RUSAGE_SELF)
+    main.enable()
+    try:
+        yield out
+    finally:
+        main.disable()
+        threading.setprofile(None)
+        # Артефакты не должны ронять саму задачу. Снимок памяти — до разбора статистики CPU,
+        # иначе в топ аллокаций попадает сам pstats
+        try:
+            peak = _write_memory(out, Config.PROFILE_TOP, sampler)
+            _write_cpu(out, main, threads.profiles, Config.PROFILE_TOP)
+            end = resource.getrusage(resource.RUSAGE_SELF)
+            meta.update(
+                job_id=job_id,
+                pid=os.getpid(),
+                wall_seconds=round(time.monotonic() - wall, 3),
+                cpu_seconds=round(end.ru_utime + end.ru_stime - usage.ru_utime - usage.ru_stime, 3),
+                max_rss_mb=round(end.ru_maxrss / 1024, 1),
+                traced_peak_mb=round(peak / 1024 ** 2, 1),
+                threads=len(threads.profiles),
+                finished_at=time.time(),
+            )
+            with open(os.path.join(out, "meta.json"), "w") as f:
+                json.dump(meta, f, indent=2)
+            print(f"🔬 Профиль записан: {out}")
+        except Exception as e:
+            print(f"⚠️ Не удалось записать профиль {job_id}: {e}")
+        finally:
+            sampler.stop()
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+        prune()
+
+
+def list_artifacts(job_id):
+    """[{"name", "size"}] артефактов задачи или None, если профиля нет."""
+    if not valid_job_id(job_id):
+        return None
+    try:
+        entries = sorted(os.scandir(profile_dir(job_id)), key=lambda e: e.name)
+    except FileNotFoundError:
+        return None
+    return [{"name": e.name, "size": e.stat().st_size} for e in entries if e.is_file()]
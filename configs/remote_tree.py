@@ -0,0 +1,112 @@
+# remote_tree.py
+"""Работа с веткой без клона: дерево и нужные файлы через Git Data API, коммит — там же.
+
+Содержимое файлов берется из общего кэша blob-ов, из API скачиваются только недостающие blob-ы
+(не больше COMMIT_API_MAX_FETCH, самые подходящие к задаче по пути). Коммит собирается одним деревом
+поверх исходного и одним коммитом, ветка двигается без force.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from configs.blob_cache import TreeEntry, get_cache, make_blob_entry
+from configs.config import Config
+from configs.context import MAX_INDEX_BYTES, IndexedFile, RepoIndex, derive_file_data, tokenize
+from configs.edits import resolve_path, write_file_atomic
+from configs.git_tools import is_text_file, should_ignore_dir
+
+
+class RemoteTreeError(Exception):
+    """Этот путь не подходит для задачи — нужен обычный worktree."""
+
+
+def _path_terms(path):
+    return set(tokenize(path.replace("/", " ").replace(".", " ")))
+
+
+class RemoteTree:
+    def __init__(self, client, commit_sha):
+        self.client = client
+        self.commit_sha = commit_sha
+        self.tree_sha, items, truncated = client.get_tree(commit_sha)
+        if truncated:
+            # GitHub обрезает рекурсивный список на очень больших деревьях
+            raise RemoteTreeError("tree listing is truncated")
+
+        self.modes = {}     # путь -> mode для всех файлов дерева
+        self.entries = []   # текстовые файлы, пригодные для контекста
+        self.texts = {}     # путь -> исходный текст загруженных файлов
+        for item in items:
+            if item["type"] != "blob" or item["mode"] == "120000":
+                continue
+            path = item["path"]
+            self.modes[path] = item["mode"]
+            parts = path.split("/")
+            if any(should_ignore_dir(d) for d in parts[:-1]) or not is_text_file(parts[-1]):
+                continue
+            if item.get("size", 0) > MAX_INDEX_BYTES:
+                continue
+            self.entries.append(TreeEntry(path, item["sha"], item.get("size", 0)))
+
+    def _fetch(self, shas):
+        with ThreadPoolExecutor(max_workers=Config.GITHUB_POOL_SIZE) as pool:
+            return dict(zip(shas, pool.map(self.client.get_blob, shas)))
+
+    def load(self, query, cache=None):
+        """Индекс по файлам ветки: закэшированные blob-ы + скачанные самые подходящие к query."""
+        cache = cache or get_cache()
+        cached = cache.get_many({e.sha for e in self.entries})
+        missing = {}
+        for e in self.entries:
+            if e.sha not in cached:
+                missing.setdefault(e.sha, e)
+
+        skipped = 0
+        if len(missing) > Config.COMMIT_API_MAX_FETCH:
+            # Все не скачать — берем файлы, чьи пути ближе всего к задаче, мелкие вперед
+            terms = set(tokenize(query))
+            ranked = sorted(missing.values(), key=lambda e: (-len(terms & _path_terms(e.path)), e.size))
+            skipped = len(ranked) - Config.COMMIT_API_MAX_FETCH
+            missing = {e.sha: e for e in ranked[:Config.COMMIT_API_MAX_FETCH]}
+
+        raw = self._fetch(sorted(missing))
+        new_entries = {sha: make_blob_entry(sha, missing[sha].path, data, derive_file_data)
+                       for sha, data in raw.items()}
+        if new_entries:
+            cache.put_many(new_entries.values())
+            cache.prune()
+
+        files = []
+        for e in self.entries:
+            blob = cached.get(e.sha) or new_entries.get(e.sha)
+            if blob is None or not blob.is_text or not blob.text or not blob.text.strip():
+                continue
+            self.texts[e.path] = blob.text
+            files.append(IndexedFile(e.path, blob.text, symbols=blob.symbols, tokens=blob.tokens, terms=blob.terms))
+        print(f"🌐 Git Data API: {len(self.entries)} файлов, из кэша {len(cached)}, скачано {len(new_entries)}, "
+              f"не загружено {skipped}")
+        return RepoIndex(files)
+
+    def materialize(self, root):
+        """Пишет загруженные файлы в root: правки SEARCH/REPLACE применяются к ним как к worktree."""
+        for path, text in self.texts.items():
+            if resolve_path(root, path) is not None:
+                write_file_atomic(root, path, text)
+
+    def changed_files(self, root, paths):
+        """{путь: (mode, текст)} для реально измененных файлов из paths."""
+        files = {}
+        for path in paths:
+            if path in self.modes and path not in self.texts:
+                # Файл есть в ветке, но модель его не видела — перезаписать его вслепую нельзя
+                raise RemoteTreeError(f"{path} exists but was not loaded")
+            with open(resolve_path(root, path), "r", encoding="utf-8") as f:
+                text = f.read()
+            if self.texts.get(path) != text:
+                files[path] = (self.modes.get(path, "100644"), text)
+        return files
+
+    def commit(self, files, message, branch, create):
+        """Коммит поверх commit_sha и перенос на него ветки. Возвращает SHA коммита."""
+        sha = self.client.create_commit(self.tree_sha, self.commit_sha, files, message)
+        self.client.update_branch(branch, sha, create=create)
+        return sha
+
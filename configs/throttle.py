@@ -0,0 +1,261 @@
+# throttle.py
+"""Общий троттлинг вызовов LLM и GitHub: token bucket-ы, Retry-After и повторы с джиттером.
+
+Состояние bucket-ов лежит в файлах под блокировкой fcntl, поэтому лимиты общие для всех
+процессов-задач на машине, а не для каждого процесса по отдельности.
+"""
+import fcntl
+import json
+import os
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+from configs import metrics
+from configs.config import Config
+
+THROTTLE_DIR = os.path.join(Config.CACHE_DIR, "throttle")
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError", "ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout"}
+
+# Счетчик повторов текущего процесса (для логов и метрик)
+retries = 0
+# GitHub отверг токен установки (401): задача завершается этим кодом, сервер сбрасывает
+# закэшированный токен и повторяет задачу один раз со свежим
+AUTH_FAILED_EXIT_CODE = 77
+# Задача уже оставила след на GitHub (комментарий, пуш, PR) — повторять ее целиком нельзя
+side_effects = False
+RETRIES = metrics.counter("agent_retries_total", "Retried LLM/GitHub calls")
+THROTTLE_WAIT = metrics.histogram("agent_throttle_wait_seconds", "Time spent waiting for rate-limit tokens")
+
+
+class ThrottleTimeout(Exception):
+    """Не удалось выполнить вызов до дедлайна из-за лимитов."""
+
+
+class TokenBucket:
+    """Token bucket с пополнением rate_per_minute в минуту; 0 — без ограничения."""
+
+    def __init__(self, key, rate_per_minute):
+        self.key = key
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.path = os.path.join(THROTTLE_DIR, re.sub(r"[^A-Za-z0-9._-]", "_", key) + ".json")
+
+    def _update(self, fn):
+        os.makedirs(THROTTLE_DIR, exist_ok=True)
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                try:
+                    state = json.loads(raw) if raw else {}
+                except ValueError:
+                    # Поврежденное состояние (например, после падения посреди записи) — начинаем с полного bucket
+                    state = {}
+                now = time.time()
+                tokens = state.get("tokens", self.capacity)
+                last = state.get("ts", now)
+                state["tokens"] = min(self.capacity, tokens + (now - last) * self.rate)
+                state["ts"] = now
+                state.setdefault("blocked_until", 0)
+                result = fn(state, now)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                # Записать до снятия блокировки: иначе буфер допишется уже под чужой блокировкой
+                f.flush()
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def try_acquire(self, amount):
+        """Забирает amount токенов. Возвращает 0 при успехе или сколько секунд подождать."""
+        def take(state, now):
+            if state["blocked_until"] > now:
+                return state["blocked_until"] - now
+            if not self.capacity:
+                return 0
+            # Запрос больше емкости пропускаем, когда bucket полон — иначе он не пройдет никогда
+            need = min(amount, self.capacity)
+            if state["tokens"] >= need:
+                state["tokens"] -= amount
+                return 0
+            return (need - state["tokens"]) / self.rate
+        return self._update(take)
+
+    def consume(self, amount):
+        """Списывает токены задним числом (например, фактические токены ответа LLM); баланс может уйти в минус."""
+        if self.capacity and amount:
+            self._update(lambda state, now: state.update(tokens=state["tokens"] - amount))
+
+    def block_until(self, until):
+        """Останавливает все вызовы через этот bucket до момента until (Retry-After, reset)."""
+        def block(state, now):
+            state["blocked_until"] = max(state["blocked_until"], until)
+        self._update(block)
+
+
+def acquire(buckets, deadline):
+    """Ждет, пока во всех bucket-ах [(bucket, amount)] найдутся токены."""
+    start = time.monotonic()
+    for bucket, amount in buckets:
+        while True:
+            wait = bucket.try_acquire(amount)
+            if not wait:
+                break
+            if time.time() + wait > deadline:
+                raise ThrottleTimeout(f"Rate limit for {bucket.key}: would wait {wait:.0f}s past the deadline")
+            time.sleep(min(wait, 5.0))
+    waited = time.monotonic() - start
+    if waited > 0.01:
+        THROTTLE_WAIT.observe(waited)
+
+
+def _error_status(e):
+    for attr in ("status_code", "status"):
+        value = getattr(e, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(e, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def _error_headers(e):
+    headers = getattr(e, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(e, "response", None), "headers", None)
+    return headers or {}
+
+
+def retry_after_seconds(headers):
+    """Сколько ждать по заголовкам Retry-After / X-RateLimit-Reset (None — заголовков нет)."""
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except Exception:
+                pass
+    remaining = headers.get("X-RateLimit-Remaining") or headers.get("x-ratelimit-remaining")
+    reset = headers.get("X-RateLimit-Reset") or headers.get("x-ratelimit-reset")
+    if remaining == "0" and reset:
+        try:
+            return max(0.0, float(reset) - time.time())
+        except ValueError:
+            pass
+    return None
+
+
+def mark_side_effect():
+    """Отмечает видимое на GitHub действие задачи: после него задача не перезапускается."""
+    global side_effects
+    side_effects = True
+
+
+def is_github_auth_error(e):
+    """401 или "Bad credentials" от GitHub (PyGithub или requests), а не от LLM."""
+    if type(e).__module__.split(".")[0] not in ("github", "requests"):
+        return False
+    return _error_status(e) == 401 or "Bad credentials" in str(e)
+
+
+def failure_exit_code(e):
+    """Код завершения задачи, остановленной исключением e.
+
+    AUTH_FAILED_EXIT_CODE — только если задачу остановил отклоненный токен GitHub и она еще ничего
+    не опубликовала; иначе 1. Ошибки, которые задача перехватила и пережила, сюда не попадают.
+    """
+    if is_github_auth_error(e) and not side_effects:
+        return AUTH_FAILED_EXIT_CODE
+    return 1
+
+
+def _is_retryable(e, status, headers):
+    if type(e).__name__ in RETRYABLE_ERRORS:
+        return True
+    if status in RETRYABLE_STATUSES:
+        return True
+    # GitHub отвечает 403 и на исчерпанный первичный, и на вторичный лимит
+    if status == 403:
+        text = str(e).lower()
+        return "rate limit" in text or headers.get("X-RateLimit-Remaining") == "0"
+    return False
+
+
+def call(fn, buckets, deadline=None, max_attempts=None, name="call"):
+    """Выполняет fn() с учетом лимитов и повторяет при 429/5xx/сетевых ошибках до дедлайна."""
+    global retries
+    deadline = time.time() + (deadline or Config.RETRY_DEADLINE)
+    max_attempts = max_attempts or Config.RETRY_MAX_ATTEMPTS
+
+    for attempt in range(max_attempts):
+        acquire(buckets, deadline)
+        try:
+            return fn()
+        except Exception as e:
+            status, headers = _error_status(e), _error_headers(e)
+            if attempt == max_attempts - 1 or not _is_retryable(e, status, headers):
+                raise
+
+            wait = retry_after_seconds(headers)
+            if wait is not None:
+                # Сервер сказал, сколько ждать: блокируем bucket для всех процессов
+                for bucket, _ in buckets:
+                    bucket.block_until(time.time() + wait)
+            else:
+                # Экспоненциальная задержка с полным джиттером
+                wait = random.uniform(0, min(Config.RETRY_MAX_BACKOFF, Config.RETRY_BASE_BACKOFF * 2 ** attempt))
+
+            if time.time() + wait > deadline:
+                raise
+            retries += 1
+            RETRIES.inc(target="llm" if name.startswith("LLM") else "github", status=status or type(e).__name__)
+            print(f"⏳ {name}: {status or type(e).__name__}, повтор {attempt + 1}/{max_attempts - 1} через {wait:.1f}s")
+            time.sleep(wait)
+
+
+_buckets = {}
+
+
+def bucket(key, rate_per_minute):
+    if key not in _buckets:
+        _buckets[key] = TokenBucket(key, rate_per_minute)
+    return _buckets[key]
+
+
+def llm_buckets(base_url, prompt_tokens):
+    """Bucket-ы запросов и токенов в минуту для провайдера LLM."""
+    provider = re.sub(r"^https?://", "", base_url or "default").split("/")[0]
+    return [
+        (bucket(f"llm-rpm-{provider}", Config.LLM_RPM), 1),
+        (bucket(f"llm-tpm-{provider}", Config.LLM_TPM), prompt_tokens),
+    ]
+
+
+def github_bucket(installation=None):
+    """Bucket запросов к GitHub для установки (или владельца репозитория)."""
+    installation = installation or os.getenv("GITHUB_INSTALLATION_ID") or (os.getenv("GITHUB_REPOSITORY") or "default").split("/")[0]
+    return bucket(f"github-{installation}", Config.GITHUB_RPM)
+
+
+def observe_github_headers(headers, gh_bucket):
+    """Проактивно притормаживает, когда X-RateLimit-Remaining подходит к нулю."""
+    remaining = headers.get("X-RateLimit-Remaining")
+    reset = headers.get("X-RateLimit-Reset")
+    if remaining is None or reset is None:
+        return
+    try:
+        remaining, reset = int(remaining), float(reset)
+    except ValueError:
+        return
+    if remaining == 0:
+        gh_bucket.block_until(reset)
+    elif remaining < Config.GITHUB_MIN_REMAINING:
+        # Оставшиеся запросы растягиваем до момента сброса лимита
+        gh_bucket.block_until(time.time() + max(0.0, reset - time.time()) / remaining)
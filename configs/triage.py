@@ -0,0 +1,157 @@
+# triage.py
+"""Триаж diff перед ревью: что можно одобрить без LLM, что отдать быстрой модели, что — основной.
+
+Файл тривиален, если он удален, бинарный, сгенерирован/lock-файл (REVIEW_SKIP_PATTERNS) или каждый
+блок его правок меняет только пустые строки, комментарии и пробелы по краям строк (строки сравниваются
+попарно по позиции — перенесенный или переставленный код уходит модели). Из остальных маленький diff без рискованных путей (REVIEW_RISKY_PATTERNS)
+идет на уровень "small".
+"""
+import fnmatch
+import io
+import os
+import tokenize
+
+from configs import metrics
+from configs.config import Config
+
+REVIEW_TIERS = metrics.counter("agent_review_tiers_total", "Reviews by triage tier")
+TRIVIAL_FILES = metrics.counter("agent_review_trivial_files_total", "Diff files skipped by triage by reason")
+
+_HASH_COMMENT = {".py", ".sh", ".rb", ".yml", ".yaml", ".toml", ".cfg", ".ini", ".r", ".pl"}
+_SLASH_COMMENT = {".js", ".jsx", ".ts", ".tsx", ".go", ".java", ".kt", ".c", ".h", ".cc", ".cpp", ".hpp",
+                  ".cs", ".rs", ".swift", ".scala", ".php"}
+# Отступ здесь — часть смысла: сравниваем строки с сохранением ведущих пробелов
+_INDENT_SENSITIVE = {".py", ".yml", ".yaml", ".mk"}
+
+
+def _patterns(value):
+    return [p.strip() for p in value.split(",") if p.strip()]
+
+
+def _matches(path, patterns):
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(path, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def _code_part(line, ext):
+    """Строка без хвостового комментария (для Python — по токенам, чтобы не резать строки с "#")."""
+    if ext == ".py":
+        try:
+            for token in tokenize.generate_tokens(io.StringIO(line.strip() + "\n").readline):
+                if token.type == tokenize.COMMENT:
+                    return line[:len(line) - len(line.lstrip()) + token.start[1]].rstrip()
+        except (tokenize.TokenError, SyntaxError, IndentationError):
+            pass
+    return line.rstrip()
+
+
+def _significant(lines, ext):
+    """Строки без пустых и без строк-комментариев."""
+    marker = "#" if ext in _HASH_COMMENT else "//" if ext in _SLASH_COMMENT else None
+    return [line for line in lines
+            if line.strip() and not (marker and line.strip().startswith(marker))]
+
+
+def _same_line(before, after, ext):
+    before, after = _code_part(before, ext), _code_part(after, ext)
+    # Отступ здесь — часть смысла, в остальных языках сравниваем без пробелов по краям
+    return before == after if ext in _INDENT_SENSITIVE else before.strip() == after.strip()
+
+
+def is_cosmetic(removed, added, ext):
+    """Правка одного блока не меняет код: пустые строки, комментарии, пробелы по краям строк.
+
+    Строки сравниваются попарно по позиции: перенос или перестановка кода косметикой не считается.
+    """
+    if not removed and not added:
+        return False
+    before, after = _significant(removed, ext), _significant(added, ext)
+    return len(before) == len(after) and all(_same_line(b, a, ext) for b, a in zip(before, after))
+
+
+def change_blocks(patch):
+    """[(удаленные, добавленные)] по блокам правок unified diff: блок — подряд идущие -/+ строки
+    между строками контекста и заголовками hunk-ов."""
+    blocks, removed, added = [], [], []
+    for line in patch.splitlines():
+        if line.startswith("-") and not line.startswith("---"):
+            removed.append(line[1:])
+        elif line.startswith("+") and not line.startswith("+++"):
+            added.append(line[1:])
+        elif line.startswith("\\"):
+            # "\ No newline at end of file" блок не разрывает
+            continue
+        elif removed or added:
+            blocks.append((removed, added))
+            removed, added = [], []
+    if removed or added:
+        blocks.append((removed, added))
+    return blocks
+
+
+def patch_lines(patch):
+    """(удаленные, добавленные) строки unified diff без служебных строк."""
+    removed, added = [], []
+    for block_removed, block_added in change_blocks(patch):
+        removed += block_removed
+        added += block_added
+    return removed, added
+
+
+def classify(entry, skip_patterns):
+    """Причина, по которой файл не нуждается в ревью, или None."""
+    if entry["status"] == "removed":
+        return "removed"
+    if entry["patch"] is None and entry["text"].endswith("Status: BINARY CHANGED"):
+        return "binary"
+    if _matches(entry["filename"], skip_patterns):
+        return "generated"
+    if entry["patch"]:
+        ext = os.path.splitext(entry["filename"])[1].lower()
+        blocks = change_blocks(entry["patch"])
+        if blocks and all(is_cosmetic(removed, added, ext) for removed, added in blocks):
+            return "cosmetic"
+    return None
+
+
+class Triage:
+    def __init__(self, tier, entries, trivial, changed_lines, reason):
+        self.tier = tier            # "skip" | "small" | "large"
+        self.entries = entries      # что отправить модели (тривиальные файлы убраны)
+        self.trivial = trivial      # [(filename, причина)]
+        self.changed_lines = changed_lines
+        self.reason = reason
+
+    def summary(self):
+        return "\n".join(f"- `{name}`: {reason}" for name, reason in self.trivial)
+
+
+def triage(entries):
+    """Решает, как ревьюить diff (entries из git_tools.diff_entries)."""
+    skip_patterns = _patterns(Config.REVIEW_SKIP_PATTERNS)
+    risky_patterns = _patterns(Config.REVIEW_RISKY_PATTERNS)
+
+    review, trivial = [], []
+    for entry in entries:
+        reason = classify(entry, skip_patterns)
+        if reason:
+            trivial.append((entry["filename"], reason))
+            TRIVIAL_FILES.inc(reason=reason)
+        else:
+            review.append(entry)
+
+    changed = sum(len(l) for e in review if e["patch"] for l in patch_lines(e["patch"]))
+    risky = [e["filename"] for e in review if _matches(e["filename"], risky_patterns)]
+
+    if not review:
+        result = Triage("skip", [], trivial, 0, "all changes are trivial")
+    elif risky:
+        result = Triage("large", review, trivial, changed, f"risky paths: {', '.join(risky[:5])}")
+    elif changed > Config.REVIEW_SMALL_MAX_LINES:
+        result = Triage("large", review, trivial, changed, f"{changed} changed lines")
+    else:
+        result = Triage("small", review, trivial, changed, f"{changed} changed lines")
+
+    REVIEW_TIERS.inc(tier=result.tier)
+    print(f"🚦 Триаж: {result.tier} ({result.reason}); к ревью {len(review)} файлов, тривиальных {len(trivial)}")
+    return result
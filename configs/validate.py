@@ -0,0 +1,167 @@
+# validate.py
+"""Локальная проверка изменений в worktree перед пушем: линтер и тесты проекта.
+
+Набор проверок повторяет CI (.github/workflows/cicd.yml): ruff, pytest, go test — если они применимы
+к проекту и установлены. Каждая проверка идет в отдельной группе процессов с таймаутом и лимитами
+памяти/CPU, без секретов агента в окружении. Ошибкой считается только то, чего не было до изменений.
+"""
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from configs import metrics
+from configs.config import Config
+from configs.workspace import create_worktree, remove_worktree
+
+VALIDATION_SECONDS = metrics.histogram("agent_validation_seconds", "Local check run time")
+VALIDATIONS = metrics.counter("agent_validations_total", "Local check runs by outcome")
+
+# Секреты агента не передаются в код проекта: точные имена и суффиксы (не подстроки — "PAT" есть в "PATH")
+_SECRET_NAMES = {"GH_PAT", "PRIVATE_KEY_PATH", "TOKEN", "KEY", "SECRET", "PASSWORD"}
+_SECRET_SUFFIXES = ("_TOKEN", "_KEY", "_SECRET", "_PASSWORD", "_PAT", "_CREDENTIALS")
+# Нужны инструментам проекта, даже если имя похоже на секрет
+_KEEP_VARS = {"PATH"}
+_SKIP_DIRS = {".git", "node_modules", "venv", ".venv", "__pycache__"}
+
+
+class Check:
+    def __init__(self, name, cmd):
+        self.name = name
+        self.cmd = cmd
+
+
+def _module_available(module):
+    return subprocess.run([sys.executable, "-c", f"import {module}"], capture_output=True).returncode == 0
+
+
+def _has_python_tests(work_dir):
+    for root, dirs, files in os.walk(work_dir):
+        dirs[:] = [d for d in dirs if d not in _SKIP_DIRS]
+        if any(f.endswith(".py") and (f.startswith("test_") or f.endswith("_test.py")) for f in files):
+            return True
+    return False
+
+
+def detect_checks(work_dir, changed):
+    """Проверки, применимые к проекту. changed — измененные пути (линтер смотрит только их)."""
+    checks = []
+    py_changed = [p for p in changed if p.endswith(".py") and os.path.exists(os.path.join(work_dir, p))]
+    if py_changed:
+        # Только синтаксис и pyflakes: стиль проверяет ревьюер, а чужие замечания не наша ошибка
+        ruff = shutil.which("ruff")
+        if ruff:
+            # Абсолютный путь: PATH окружения проверки может отличаться от PATH агента
+            checks.append(Check("ruff", [ruff, "check", "--no-cache", "--select", Config.VALIDATE_RUFF_SELECT,
+                                         *py_changed]))
+        else:
+            checks.append(Check("compile", [sys.executable, "-m", "py_compile", *py_changed]))
+
+    if _has_python_tests(work_dir) and _module_available("pytest"):
+        checks.append(Check("pytest", [sys.executable, "-m", "pytest", "-x", "-q", "--tb=short",
+                                       "-p", "no:cacheprovider"]))
+
+    go = shutil.which("go")
+    if os.path.exists(os.path.join(work_dir, "go.mod")) and go:
+        checks.append(Check("go test", [go, "test", "./..."]))
+    return checks
+
+
+def _is_secret(name):
+    name = name.upper()
+    if name in _KEEP_VARS:
+        return False
+    return name in _SECRET_NAMES or name.endswith(_SECRET_SUFFIXES)
+
+
+def _sandbox_env(work_dir):
+    env = {k: v for k, v in os.environ.items() if not _is_secret(k)}
+    env["PYTHONPATH"] = work_dir
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def _limits():
+    # Выполняется в дочернем процессе до exec: своя группа процессов (чтобы убить всех потомков) и лимиты
+    os.setsid()
+    memory = Config.VALIDATE_MEMORY_MB * 1024 ** 2
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_CPU, (Config.VALIDATE_TIMEOUT, Config.VALIDATE_TIMEOUT + 5))
+
+
+def _tail(text, limit):
+    return text if len(text) <= limit else "...\n" + text[-limit:]
+
+
+def run_check(check, work_dir, timeout=None):
+    """Запускает проверку. Возвращает (ok, вывод); вывод обрезан до VALIDATE_OUTPUT_CHARS с конца."""
+    timeout = timeout or Config.VALIDATE_TIMEOUT
+    start = time.monotonic()
+    try:
+        process = subprocess.Popen(check.cmd, cwd=work_dir, env=_sandbox_env(work_dir), stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace",
+                                   preexec_fn=_limits)
+    except OSError as e:
+        # Инструмент не запустился (нет бинарника, лимиты) — проверка не пройдена, но задача продолжается
+        VALIDATIONS.inc(check=check.name, result="error")
+        print(f"❌ {check.name}: не удалось запустить ({e})")
+        return False, f"{check.name} failed to start: {e}"
+    try:
+        output, _ = process.communicate(timeout=timeout)
+        ok = process.returncode == 0
+        # pytest: 5 — тесты не найдены, это не ошибка изменений
+        if check.name == "pytest" and process.returncode == 5:
+            ok = True
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        output, _ = process.communicate()
+        output += f"\n{check.name} timed out after {timeout}s"
+        ok = False
+    elapsed = time.monotonic() - start
+    VALIDATION_SECONDS.observe(elapsed, check=check.name)
+    VALIDATIONS.inc(check=check.name, result="pass" if ok else "fail")
+    print(f"{'✅' if ok else '❌'} {check.name}: {elapsed:.1f}s")
+    return ok, _tail(output.strip(), Config.VALIDATE_OUTPUT_CHARS)
+
+
+def _failed_before(check, repo_name, base_sha, baseline):
+    """Падала ли проверка и до изменений: прогон на base_sha во временном worktree. Результат кэшируется в baseline."""
+    if check.name in baseline:
+        return baseline[check.name]
+    if check.name in ("ruff", "compile"):
+        # Линтер смотрит только измененные файлы — сравнивать с исходным состоянием не нужно
+        baseline[check.name] = False
+        return False
+    # Worktree зеркала под его блокировкой (как у задач) и на явном коммите: HEAD рабочей копии
+    # к этому моменту мог уже уйти вперед. Не git stash: refs/stash общий для всех worktree зеркала
+    base_dir = create_worktree(repo_name, base_sha)
+    try:
+        ok, _ = run_check(check, base_dir)
+    finally:
+        remove_worktree(repo_name, base_dir)
+    baseline[check.name] = not ok
+    if not ok:
+        print(f"ℹ️ {check.name} падает и без изменений — не учитываем")
+    return not ok
+
+
+def validate(work_dir, changed, repo_name, base_sha, baseline=None):
+    """Прогоняет проверки. Возвращает список (имя, вывод) для проверок, сломанных изменениями.
+
+    base_sha — коммит до изменений: на нем проверяется, не падала ли проверка и раньше.
+    """
+    baseline = {} if baseline is None else baseline
+    failures = []
+    for check in detect_checks(work_dir, changed):
+        ok, output = run_check(check, work_dir)
+        if not ok and not _failed_before(check, repo_name, base_sha, baseline):
+            failures.append((check.name, output))
+    return failures
+
+
+def format_failures(failures):
+    return "\n\n".join(f"$ {name}\n{output}" for name, output in failures)
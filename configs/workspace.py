@@ -0,0 +1,201 @@
+# workspace.py
+"""Кэш bare-зеркал репозиториев и отдельные git worktree для каждой задачи."""
+import contextlib
+import fcntl
+import glob
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from configs import metrics
+from configs.config import Config
+
+MIRRORS_DIR = os.path.join(Config.WORKSPACE_DIR, "mirrors")
+WORKTREES_DIR = os.path.join(Config.WORKSPACE_DIR, "worktrees")
+
+GIT_SYNC_SECONDS = metrics.histogram("agent_git_sync_seconds", "Mirror clone/fetch time")
+WORKTREE_SECONDS = metrics.histogram("agent_worktree_seconds", "Worktree creation time")
+
+
+def get_auth_url(repo_name, token):
+    """URL репозитория с токеном установки для fetch/push."""
+    base = Config.GIT_BASE_URL.rstrip("/")
+    scheme, sep, host = base.partition("://")
+    if token and scheme in ("https", "http"):
+        return f"{scheme}://x-access-token:{token}@{host}/{repo_name}.git"
+    # file:// или локальный путь (бенчмарк с локальным remote) — токен не нужен
+    return f"{base}/{repo_name}.git"
+
+
+def _slug(repo_name):
+    return re.sub(r"[^A-Za-z0-9._-]", "__", repo_name)
+
+
+def mirror_path(repo_name):
+    return os.path.join(MIRRORS_DIR, _slug(repo_name) + ".git")
+
+
+def _git(args, cwd=None, capture=False):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=capture, text=True)
+
+
+@contextlib.contextmanager
+def _mirror_lock(mirror, blocking=True):
+    """Межпроцессная блокировка зеркала (fetch и worktree add/remove)."""
+    os.makedirs(MIRRORS_DIR, exist_ok=True)
+    with open(mirror + ".lock", "w") as lock_file:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        fcntl.flock(lock_file, flags)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _touch(mirror):
+    # mtime файла last-used — метка для LRU-вытеснения
+    with open(os.path.join(mirror, "last-used"), "w") as f:
+        f.write(str(time.time()))
+
+
+def _last_used(mirror):
+    try:
+        return os.path.getmtime(os.path.join(mirror, "last-used"))
+    except OSError:
+        return 0
+
+
+def sync_mirror(repo_name, token):
+    """Создает bare-зеркало при первом обращении, дальше — инкрементальный fetch."""
+    mirror = mirror_path(repo_name)
+    url = get_auth_url(repo_name, token)
+
+    start = time.monotonic()
+    with _mirror_lock(mirror):
+        op = "fetch"
+        if not os.path.exists(os.path.join(mirror, "HEAD")):
+            op = "clone"
+            print(f"📥 Creating mirror for {repo_name}...")
+            shutil.rmtree(mirror, ignore_errors=True)
+            _git(["init", "--bare", "--quiet", mirror])
+            _git(["remote", "add", "origin", url], cwd=mirror)
+            _git(["fetch", "--quiet", "origin"], cwd=mirror)
+            # refs/remotes/origin/HEAD -> ветка по умолчанию
+            _git(["remote", "set-head", "origin", "--auto"], cwd=mirror)
+        else:
+            print(f"🔄 Fetching updates for {repo_name}...")
+            _git(["remote", "set-url", "origin", url], cwd=mirror)
+            _git(["fetch", "--quiet", "--prune", "origin"], cwd=mirror)
+        _touch(mirror)
+
+    GIT_SYNC_SECONDS.observe(time.monotonic() - start, op=op)
+    return mirror
+
+
+def create_worktree(repo_name, ref="refs/remotes/origin/HEAD"):
+    """Создает отдельный worktree (detached HEAD) во временной директории."""
+    mirror = mirror_path(repo_name)
+    os.makedirs(WORKTREES_DIR, exist_ok=True)
+    # PID в имени: если процесс задачи убьют, сервер найдет и уберет его worktree
+    path = tempfile.mkdtemp(prefix=f"{_slug(repo_name)}-{os.getpid()}-", dir=WORKTREES_DIR)
+
+    with WORKTREE_SECONDS.time(), _mirror_lock(mirror):
+        _git(["worktree", "add", "--quiet", "--detach", path, ref], cwd=mirror)
+    return path
+
+
+def remove_worktree(repo_name, path):
+    mirror = mirror_path(repo_name)
+    try:
+        with _mirror_lock(mirror):
+            _git(["worktree", "remove", "--force", path], cwd=mirror)
+    except Exception as e:
+        print(f"⚠️ Worktree remove warning: {e}")
+        shutil.rmtree(path, ignore_errors=True)
+        with _mirror_lock(mirror):
+            subprocess.run(["git", "worktree", "prune"], cwd=mirror, check=False)
+
+
+def remove_stale_worktrees(repo_name, pid):
+    """Убирает worktree процесса задачи, который был убит и не успел прибраться сам."""
+    for path in glob.glob(os.path.join(WORKTREES_DIR, f"{_slug(repo_name)}-{pid}-*")):
+        print(f"🧹 Removing stale worktree {path}")
+        remove_worktree(repo_name, path)
+
+
+def exit_on_sigterm():
+    """SIGTERM превращается в SystemExit, чтобы при отмене задачи отработали finally и worktree удалился."""
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+
+def _mirror_size(mirror):
+    """Размер объектов зеркала в байтах (git count-objects быстрее обхода диска)."""
+    try:
+        out = _git(["count-objects", "-v"], cwd=mirror, capture=True).stdout
+    except Exception:
+        return 0
+    size_kib = 0
+    for line in out.splitlines():
+        key, _, value = line.partition(":")
+        if key in ("size", "size-pack"):
+            size_kib += int(value.strip() or 0)
+    return size_kib * 1024
+
+
+def _has_worktrees(mirror):
+    subprocess.run(["git", "worktree", "prune"], cwd=mirror, check=False)
+    worktrees = os.path.join(mirror, "worktrees")
+    return os.path.isdir(worktrees) and bool(os.listdir(worktrees))
+
+
+def evict_mirrors(keep=None):
+    """Удаляет давно не использованные зеркала сверх лимитов по количеству и размеру."""
+    if not os.path.isdir(MIRRORS_DIR):
+        return
+
+    mirrors = [os.path.join(MIRRORS_DIR, d) for d in os.listdir(MIRRORS_DIR) if d.endswith(".git")]
+    mirrors.sort(key=_last_used)
+    sizes = {m: _mirror_size(m) for m in mirrors}
+    total = sum(sizes.values())
+    count = len(mirrors)
+
+    for mirror in mirrors:
+        if count <= Config.WORKSPACE_MAX_MIRRORS and total <= Config.WORKSPACE_MAX_BYTES:
+            break
+        if keep and mirror == mirror_path(keep):
+            continue
+        try:
+            with _mirror_lock(mirror, blocking=False):
+                # Зеркало с активными worktree не трогаем
+                if _has_worktrees(mirror):
+                    continue
+                shutil.rmtree(mirror, ignore_errors=True)
+        except BlockingIOError:
+            continue
+        # Файл блокировки не удаляем: ждущий процесс держит flock на его inode, а новый
+        # создал бы другой файл, и блокировка перестала бы быть общей
+        print(f"🧹 Evicted mirror {os.path.basename(mirror)} ({sizes[mirror] // 1024 ** 2} MiB)")
+        total -= sizes[mirror]
+        count -= 1
+
+
+@contextlib.contextmanager
+def job_workspace(repo_name, token):
+    """Рабочая копия для одной задачи: обновляет зеркало, выдает worktree и убирает его после."""
+    sync_mirror(repo_name, token)
+    path = create_worktree(repo_name)
+    print(f"📂 Worktree for {repo_name}: {path}")
+    try:
+        yield path
+    finally:
+        print("🧹 Cleaning up workspace...")
+        remove_worktree(repo_name, path)
+        try:
+            evict_mirrors(keep=repo_name)
+        except Exception as e:
+            print(f"⚠️ Mirror eviction warning: {e}")
@@ -1,61 +1,228 @@
 import argparse
+import re
 import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from configs import metrics, profiling, throttle
 from configs.config import Config
+from configs.context import estimate_tokens
 from configs.llm import invoke_llm, PROMPTS
-from configs.git_tools import get_pr_diff, post_pr_comment, get_ci_status
+from configs.triage import triage
+from configs.git_tools import (
+    get_pr_info, get_pr_diff_entries, post_pr_comment, get_ci_status,
+    get_last_reviewed, get_compare_entries, review_marker
+)
 
-def run_reviewer():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--pr", type=int, required=True, help="PR number to review")
-    args = parser.parse_args()
+_HUNK_RE = re.compile(r"^@@", re.MULTILINE)
 
-    Config.validate()
-    print(f"🕵️  Запуск AI Reviewer для PR #{args.pr}")
+REVIEWS = metrics.counter("agent_reviews_total", "Review outcomes")
 
-    try:
-        diff_content = get_pr_diff(args.pr)
-        ci_status = get_ci_status(args.pr)
-    except Exception as e:
-        print(f"❌ Ошибка при получении данных PR: {e}")
-        sys.exit(1)
+def is_lgtm_review(text):
+    return "LGTM" in text or "Looks Good To Me" in text
+
+def split_patch(filename, patch, budget):
+    """Режет diff одного большого файла по hunk-ам на части не больше budget токенов."""
+    starts = [m.start() for m in _HUNK_RE.finditer(patch)] or [0]
+    hunks = [patch[a:b] for a, b in zip(starts, starts[1:] + [len(patch)])]
+
+    parts, current = [], ""
+    for hunk in hunks:
+        if current and estimate_tokens(current + hunk) > budget:
+            parts.append(current)
+            current = ""
+        current += hunk
+    if current:
+        parts.append(current)
+
+    total = len(parts)
+    return [f"File: {filename} (part {i}/{total})\nDiff:\n{part}" for i, part in enumerate(parts, 1)]
 
-    print(f"📄 Анализ {len(diff_content)} символов...")
+def chunk_diff(entries, budget):
+    """Группирует diff по файлам в пачки под бюджет токенов (большие файлы — по hunk-ам)."""
+    pieces = []
+    for entry in entries:
+        if entry["patch"] and estimate_tokens(entry["text"]) > budget:
+            pieces.extend(split_patch(entry["filename"], entry["patch"], budget))
+        else:
+            pieces.append(entry["text"])
 
-    user_content = f"""
+    chunks, current, used = [], [], 0
+    for piece in pieces:
+        cost = estimate_tokens(piece)
+        if current and used + cost > budget:
+            chunks.append("\n\n".join(current))
+            current, used = [], 0
+        current.append(piece)
+        used += cost
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def build_review_prompt(ci_status, diff_content, note=""):
+    return f"""
     CONTEXT:
     {ci_status}
+    {note}
 
     CHANGES TO REVIEW:
     {diff_content}
     """
 
+def review_chunked(chunks, ci_status, note="", tier=None):
+    """Map-reduce ревью: пачки параллельно, затем дешевое объединение замечаний."""
+    total = len(chunks)
+    print(f"🧩 Большой PR: {total} частей, параллельно до {Config.REVIEW_PARALLELISM}")
+
+    def review_part(args):
+        i, chunk = args
+        part_note = f"NOTE: This is part {i}/{total} of a large Pull Request. Review only these changes."
+        return invoke_llm(PROMPTS["reviewer"], build_review_prompt(ci_status, chunk, f"{note}\n{part_note}".strip()),
+                          tier=tier)
+
+    with ThreadPoolExecutor(max_workers=max(1, Config.REVIEW_PARALLELISM)) as pool:
+        results = list(pool.map(review_part, enumerate(chunks, 1)))
+
+    findings = [r for r in results if not is_lgtm_review(r)]
+    if not findings:
+        # Все части чистые — объединять нечего
+        return "LGTM"
+
+    merged_input = "\n\n".join(f"PARTIAL REVIEW {i}:\n{r}" for i, r in enumerate(findings, 1))
+    return invoke_llm(PROMPTS["review_merge"], merged_input, tier=tier)
+
+def select_changes(pr_number, full=False):
+    """Что ревьюить: весь PR или только коммиты после последнего проверенного head.
+
+    Возвращает (entries, note, head_sha, base_sha); entries=None — новых изменений нет.
+    """
+    info = get_pr_info(pr_number)
+    head_sha, base_sha = info["head_sha"], info["base_sha"]
+
+    last = None if full else get_last_reviewed(pr_number)
+    if last:
+        last_head, last_base = last
+        if last_head == head_sha:
+            return None, "", head_sha, base_sha
+        if last_base == base_sha:
+            status, delta = get_compare_entries(last_head, head_sha)
+            # "ahead" — обычные дополнительные коммиты; после force-push или rebase ревьюим заново
+            if status == "ahead" and delta:
+                print(f"♻️  Инкрементальное ревью: {last_head[:7]}..{head_sha[:7]} ({len(delta)} файлов)")
+                note = (f"NOTE: Commits up to {last_head[:7]} were already reviewed. "
+                        f"Review ONLY the new changes below; earlier changes of the same files are given as context.")
+                return delta, note, head_sha, base_sha
+
+    return get_pr_diff_entries(pr_number), "", head_sha, base_sha
+
+def with_context(delta, pr_number, budget):
+    """Добавляет к инкрементальному diff уже проверенный diff тех же файлов (в пределах бюджета)."""
+    touched = {e["filename"] for e in delta}
+    context, used = [], 0
+    for entry in get_pr_diff_entries(pr_number):
+        if entry["filename"] in touched and entry["patch"]:
+            cost = estimate_tokens(entry["text"])
+            if used + cost > budget:
+                continue
+            context.append(entry["text"])
+            used += cost
+    if not context:
+        return ""
+    return "ALREADY REVIEWED (context only):\n" + "\n\n".join(context)
+
+def run_reviewer(pr_number, repo_name=None, token=None, full=False, fail_on_changes=False):
+    """Проводит ревью PR и возвращает код завершения: 0 — ревью опубликовано, 1 — ошибка.
+
+    fail_on_changes=True (CI) — 1 и при опубликованном ревью с замечаниями, чтобы шаг workflow упал.
+    По умолчанию после первого ревью проверяются только новые коммиты; full=True — весь PR заново.
+    """
+    Config.configure_job(token, repo_name)
+    if not Config.validate():
+        return 1
+    print(f"🕵️  Запуск AI Reviewer для PR #{pr_number}")
+
     try:
-        review_result = invoke_llm(PROMPTS["reviewer"], user_content)
+        entries, note, head_sha, base_sha = select_changes(pr_number, full)
+        if entries is None:
+            print(f"⏭  Head {head_sha[:7]} уже проверен — ревью не требуется")
+            REVIEWS.inc(result="skipped")
+            return 0
+        ci_status = get_ci_status(pr_number)
+        if note:
+            note += "\n" + with_context(entries, pr_number, Config.REVIEW_CHUNK_TOKENS // 2)
     except Exception as e:
-        print(f"❌ Ошибка LLM: {e}")
-        sys.exit(1)
+        print(f"❌ Ошибка при получении данных PR: {e}")
+        REVIEWS.inc(result="error")
+        return throttle.failure_exit_code(e)
+
+    # Триаж: тривиальные файлы не отправляем, маленький diff — быстрой модели
+    tier = None
+    triaged = triage(entries) if Config.REVIEW_TRIAGE else None
+    if triaged:
+        entries, tier = triaged.entries, triaged.tier
+        if triaged.trivial and entries:
+            note = (f"{note}\nNOTE: {len(triaged.trivial)} files with only removed, binary, generated or "
+                    f"formatting changes were checked automatically and are not shown.").strip()
+
+    if tier == "skip":
+        # Ни одного содержательного изменения — одобряем без вызова LLM
+        review_result = "LGTM\n\nИзменения проверены автоматически, содержательных правок нет:\n" + triaged.summary()
+    else:
+        diff_content = "\n\n".join(e["text"] for e in entries)
+        print(f"📄 Анализ {len(diff_content)} символов...")
+
+        try:
+            chunks = chunk_diff(entries, Config.REVIEW_CHUNK_TOKENS)
+            if len(chunks) > 1:
+                review_result = review_chunked(chunks, ci_status, note, tier)
+            else:
+                review_result = invoke_llm(PROMPTS["reviewer"], build_review_prompt(ci_status, diff_content, note),
+                                           tier=tier)
+        except Exception as e:
+            print(f"❌ Ошибка LLM: {e}")
+            REVIEWS.inc(result="error")
+            return 1
 
     print("🤖 Ревью сгенерировано. Публикация...")
 
     # ЛОГИКА ОПРЕДЕЛЕНИЯ СТАТУСА
     # Если LLM написала "LGTM" или "Looks Good To Me" -> успех
-    is_lgtm = "LGTM" in review_result or "Looks Good To Me" in review_result
-    
+    is_lgtm = is_lgtm_review(review_result)
+
     # Добавляем системный маркер в конец комментария, чтобы Fixer понял сигнал
     if is_lgtm:
         final_comment = review_result + "\n\n✅ **LGTM** - No further changes required."
         exit_code = 0
     else:
         final_comment = review_result + "\n\n⚠️ **Review Status:** Changes requested."
-        exit_code = 1
+        # Для сервера ревью с замечаниями — успешно выполненная задача
+        exit_code = 1 if fail_on_changes else 0
+    final_comment += "\n\n" + review_marker(head_sha, base_sha)
 
     try:
-        url = post_pr_comment(args.pr, final_comment)
+        url = post_pr_comment(pr_number, final_comment)
         print(f"✅ Комментарий опубликован: {url}")
-        sys.exit(exit_code)
+        REVIEWS.inc(result="lgtm" if is_lgtm else "changes")
+        return exit_code
     except Exception as e:
         print(f"❌ Не удалось опубликовать комментарий: {e}")
-        sys.exit(1)
+        return throttle.failure_exit_code(e)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pr", type=int, required=True, help="PR number to review")
+    parser.add_argument("--full", action="store_true", help="Review the whole PR, not only new commits")
+    parser.add_argument("--exit-zero", action="store_true",
+                        help="Exit 0 once the review is posted, even if changes are requested (server jobs)")
+    parser.add_argument("--profile", metavar="ID", help="Write cProfile/tracemalloc artifacts to PROFILE_DIR/ID")
+    args = parser.parse_args()
+    with profiling.profile_job(args.profile, mode="reviewer", number=args.pr):
+        try:
+            code = run_reviewer(args.pr, full=args.full, fail_on_changes=not args.exit_zero)
+        except Exception as e:
+            traceback.print_exc()
+            code = throttle.failure_exit_code(e)
+    metrics.push()
+    sys.exit(code)
 
 if __name__ == "__main__":
-    run_reviewer()
\ No newline at end of file
+    main()
@@ -1,32 +1,155 @@
 # auth.py
 import os
+import threading
 import time
+from datetime import datetime, timezone
+
 import jwt
 import requests
 
-def get_installation_token(installation_id):
-    # 1. Читаем приватный ключ (который мы скачаем из настроек GitHub App)
-    private_key_path = os.getenv("PRIVATE_KEY_PATH", "private-key.pem")
-    with open(private_key_path, 'r') as f:
-        private_key = f.read()
-
-    # 2. Генерируем JWT (JSON Web Token)
-    payload = {
-        "iat": int(time.time()),
-        "exp": int(time.time()) + 600,
-        "iss": os.getenv("GITHUB_APP_ID")
-    }
-    encoded_jwt = jwt.encode(payload, private_key, algorithm="RS256")
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+
+# За сколько секунд до expires_at токен считается "старым" и обновляется в фоне
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "600"))
+# Ближе этого порога токен уже не отдаем — обновляем синхронно
+TOKEN_MIN_TTL = int(os.getenv("TOKEN_MIN_TTL", "60"))
+# JWT живет 10 минут (максимум GitHub), переиспользуем его ~9 минут
+JWT_TTL = 600
+JWT_REUSE = 540
+
+_private_key = None
+_jwt_cache = {"token": None, "exp": 0}
+_jwt_lock = threading.Lock()
+_app_login = None
+
+# installation_id -> {"token": str, "expires_at": float}
+_token_cache = {}
+# installation_id -> Lock (одна блокировка на установку)
+_locks = {}
+_locks_guard = threading.Lock()
+_refreshing = set()
+
+
+def load_private_key():
+    """Читает приватный ключ один раз и держит его в памяти."""
+    global _private_key
+    if _private_key is None:
+        private_key_path = os.getenv("PRIVATE_KEY_PATH", "private-key.pem")
+        with open(private_key_path, 'r') as f:
+            _private_key = f.read()
+    return _private_key
+
+
+def get_app_jwt():
+    """Возвращает JWT приложения, подписывая новый только когда старый почти истек."""
+    with _jwt_lock:
+        now = int(time.time())
+        if _jwt_cache["token"] and now < _jwt_cache["exp"] - (JWT_TTL - JWT_REUSE):
+            return _jwt_cache["token"]
+
+        # iat сдвигаем на 60 сек назад на случай расхождения часов с GitHub
+        payload = {
+            "iat": now - 60,
+            "exp": now + JWT_TTL - 60,
+            "iss": os.getenv("GITHUB_APP_ID")
+        }
+        _jwt_cache["token"] = jwt.encode(payload, load_private_key(), algorithm="RS256")
+        _jwt_cache["exp"] = now + JWT_TTL - 60
+        return _jwt_cache["token"]
+
+
+def get_app_login():
+    """Логин бота приложения (<slug>[bot]) — автор комментариев агента. Запрашивается один раз."""
+    global _app_login
+    if _app_login is None:
+        headers = {"Authorization": f"Bearer {get_app_jwt()}", "Accept": "application/vnd.github.v3+json"}
+        resp = requests.get(f"{GITHUB_API_URL}/app", headers=headers, timeout=30)
+        resp.raise_for_status()
+        _app_login = f"{resp.json()['slug']}[bot]"
+    return _app_login
+
+
+def _parse_expires_at(value):
+    # GitHub отдает время в формате 2016-07-11T22:14:10Z
+    try:
+        dt = datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    except (TypeError, ValueError):
+        # Токены установки живут час — берем с запасом
+        return time.time() + 3000
 
-    # 3. Обмениваем JWT на токен доступа к конкретной установке (репозиторию)
+
+def _get_lock(installation_id):
+    with _locks_guard:
+        lock = _locks.get(installation_id)
+        if lock is None:
+            lock = _locks[installation_id] = threading.Lock()
+        return lock
+
+
+def _fetch_installation_token(installation_id):
+    """Обменивает JWT на токен доступа к конкретной установке (репозиторию)."""
     headers = {
-        "Authorization": f"Bearer {encoded_jwt}",
+        "Authorization": f"Bearer {get_app_jwt()}",
         "Accept": "application/vnd.github.v3+json"
     }
-    url = f"https://api.github.com/app/installations/{installation_id}/access_tokens"
-    resp = requests.post(url, headers=headers)
-    
+    url = f"{GITHUB_API_URL}/app/installations/{installation_id}/access_tokens"
+    resp = requests.post(url, headers=headers, timeout=30)
+
     if resp.status_code != 201:
         raise Exception(f"Auth failed: {resp.text}")
-        
-    return resp.json()["token"]
\ No newline at end of file
+
+    data = resp.json()
+    entry = {"token": data["token"], "expires_at": _parse_expires_at(data.get("expires_at"))}
+    _token_cache[installation_id] = entry
+    return entry
+
+
+def _background_refresh(installation_id):
+    lock = _get_lock(installation_id)
+    try:
+        with lock:
+            entry = _token_cache.get(installation_id)
+            # Другой поток мог уже обновить токен, пока мы ждали блокировку
+            if entry and entry["expires_at"] - time.time() > TOKEN_REFRESH_MARGIN:
+                return
+            _fetch_installation_token(installation_id)
+    except Exception as e:
+        print(f"⚠️ Background token refresh failed for {installation_id}: {e}")
+    finally:
+        with _locks_guard:
+            _refreshing.discard(installation_id)
+
+
+def _schedule_refresh(installation_id):
+    with _locks_guard:
+        if installation_id in _refreshing:
+            return
+        _refreshing.add(installation_id)
+    threading.Thread(target=_background_refresh, args=(installation_id,), daemon=True).start()
+
+
+def get_installation_token(installation_id):
+    """Возвращает токен установки из кэша, обновляя его перед истечением."""
+    entry = _token_cache.get(installation_id)
+    if entry:
+        ttl = entry["expires_at"] - time.time()
+        if ttl > TOKEN_REFRESH_MARGIN:
+            return entry["token"]
+        if ttl > TOKEN_MIN_TTL:
+            # Токен еще рабочий: отдаем его сразу, а новый получаем в фоне
+            _schedule_refresh(installation_id)
+            return entry["token"]
+
+    # Токена нет или он вот-вот истечет: обновляем синхронно.
+    # Конкурентные вебхуки одной установки ждут одно и то же обновление.
+    with _get_lock(installation_id):
+        entry = _token_cache.get(installation_id)
+        if entry and entry["expires_at"] - time.time() > TOKEN_MIN_TTL:
+            return entry["token"]
+        return _fetch_installation_token(installation_id)["token"]
+
+
+def invalidate_installation_token(installation_id):
+    """Сбрасывает токен из кэша (например, после 401 от GitHub)."""
+    _token_cache.pop(installation_id, None)
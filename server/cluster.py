@@ -0,0 +1,447 @@
+# cluster.py
+"""Несколько узлов агента: координатор принимает вебхуки и раздает события воркерам.
+
+Все события репозитория идут на один узел (consistent hashing по имени репозитория): там остаются
+прогретыми его зеркало, кэш файлов и токен установки. Координатор хранит события в SQLite — это
+локальная замена брокера. Воркеры забирают свои события long-poll-ом и шлют heartbeat со списком
+того, что у них в очереди и выполняется.
+
+- узел без heartbeat дольше node_timeout считается упавшим: его незавершенные события переходят
+  к новому владельцу по кольцу;
+- при входе или выходе узла переезжают только еще не начатые события, начатые доделываются на месте;
+- событие, которое узел больше не держит (например, перезапустился), через пару heartbeat-ов
+  отдается заново. Доставка — at least once.
+"""
+import bisect
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+
+from configs import metrics
+from scheduler import QueueFull
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    installation_id INTEGER NOT NULL,
+    repo_name TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    options TEXT NOT NULL,
+    node TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    delivered_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS events_state ON events (state, node, created_at);
+"""
+
+UNFINISHED_STATES = ("assigned", "delivered", "running")
+
+CLUSTER_EVENTS = metrics.counter("agent_cluster_events_total", "Cluster events by outcome")
+CLUSTER_REASSIGNMENTS = metrics.counter("agent_cluster_reassignments_total", "Events moved to another node by reason")
+CLUSTER_MEMBERSHIP = metrics.counter("agent_cluster_membership_total", "Node joins, leaves and failures")
+
+
+class NoNodes(Exception):
+    """Нет живых воркеров — событие некуда отдать (вебхук отклоняется с 503)."""
+
+
+class HashRing:
+    """Consistent hashing с виртуальными узлами: при входе/выходе узла переезжает ~1/N репозиториев."""
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self.nodes = set()
+        self._hashes = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest()[:8], "big")
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            h = self._hash(f"{node}#{i}")
+            pos = bisect.bisect(self._hashes, h)
+            self._hashes.insert(pos, h)
+            self._owners.insert(pos, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        points = [(h, owner) for h, owner in zip(self._hashes, self._owners) if owner != node]
+        self._hashes = [h for h, _ in points]
+        self._owners = [owner for _, owner in points]
+
+    def node_for(self, key):
+        if not self._hashes:
+            return None
+        pos = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._owners[pos]
+
+
+class ClusterBroker:
+    """Координатор: очередь событий по узлам, членство по heartbeat и перераспределение."""
+
+    def __init__(self, path, heartbeat=5, node_timeout=20, max_attempts=3):
+        self.interval = heartbeat
+        self.node_timeout = node_timeout
+        self.max_attempts = max_attempts
+        self.started_at = time.time()
+        self.nodes = {}     # node_id -> {"last_seen", "joined_at", "free", "held", "running"}
+        self.ring = HashRing()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._cond = threading.Condition()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def start(self):
+        threading.Thread(target=self._monitor_loop, name="cluster-monitor", daemon=True).start()
+
+    # --- API для server.py ---
+
+    def submit(self, mode, installation_id, repo_name, number, options=None):
+        """Ставит событие владельцу репозитория. Возвращает (id события, узел)."""
+        with self._cond:
+            node = self.ring.node_for(repo_name)
+            if node is None:
+                raise NoNodes("No live worker nodes")
+            event_id = uuid.uuid4().hex[:12]
+            self._conn.execute(
+                "INSERT INTO events (id, mode, installation_id, repo_name, number, options, node, state, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 'assigned', ?)",
+                (event_id, mode, installation_id, repo_name, int(number), json.dumps(options or {}), node, time.time())
+            )
+            self._conn.commit()
+            self._cond.notify_all()
+        CLUSTER_EVENTS.inc(outcome="submitted")
+        return event_id, node
+
+    def heartbeat(self, node, held=(), running=(), done=(), free=0):
+        """Обновляет состояние узла. Возвращает события, которые узел должен отменить у себя."""
+        now = time.time()
+        held = set(held)
+        with self._cond:
+            joined = node not in self.nodes
+            info = self.nodes.setdefault(node, {"joined_at": now})
+            info.update(last_seen=now, free=free, held=len(held), running=len(running))
+            self._complete(node, done)
+            if running:
+                self._conn.execute(
+                    f"UPDATE events SET state = 'running' WHERE node = ? AND state = 'delivered' "
+                    f"AND id IN ({','.join('?' * len(running))})", [node, *running]
+                )
+            if joined:
+                print(f"🟢 Узел {node} в кластере")
+                CLUSTER_MEMBERSHIP.inc(change="join")
+                self.ring.add(node)
+                self._rebalance()
+
+            # Выданное узлу событие, которого у него нет ни в очереди, ни в работе, потеряно
+            lost = self._conn.execute(
+                "SELECT * FROM events WHERE node = ? AND state IN ('delivered', 'running') AND delivered_at < ?",
+                (node, now - 2 * self.interval)
+            ).fetchall()
+            for row in lost:
+                if row["id"] not in held:
+                    self._reassign(row, self.ring.node_for(row["repo_name"]) or node, "lost", retry=True)
+
+            # Событие, которое узел держит, но оно уже у другого узла или завершено — отменить
+            revoked = []
+            if held:
+                rows = self._conn.execute(
+                    f"SELECT id, node, state FROM events WHERE id IN ({','.join('?' * len(held))})", list(held)
+                ).fetchall()
+                revoked = [r["id"] for r in rows if r["node"] != node or r["state"] not in UNFINISHED_STATES]
+            self._conn.commit()
+            self._cond.notify_all()
+        return revoked
+
+    def pull(self, node, limit, wait=0):
+        """Выдает узлу до limit его событий, при пустой очереди ждет до wait секунд."""
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while True:
+                rows = []
+                if node in self.nodes and limit > 0:
+                    rows = self._conn.execute(
+                        "SELECT * FROM events WHERE node = ? AND state = 'assigned' ORDER BY created_at LIMIT ?",
+                        (node, limit)
+                    ).fetchall()
+                remaining = deadline - time.monotonic()
+                if rows or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE events SET state = 'delivered', delivered_at = ? WHERE id = ?", [(now, r["id"]) for r in rows]
+            )
+            self._conn.commit()
+        return [_row_to_event(r) for r in rows]
+
+    def complete(self, node, done):
+        with self._cond:
+            self._complete(node, done)
+            self._conn.commit()
+            self._cond.notify_all()
+
+    def leave(self, node):
+        """Узел останавливается: все его незавершенные события уходят другим."""
+        with self._cond:
+            if self.nodes.pop(node, None) is None:
+                return
+            print(f"👋 Узел {node} покинул кластер")
+            CLUSTER_MEMBERSHIP.inc(change="leave")
+            self.ring.remove(node)
+            self._rebalance()
+            self._conn.commit()
+            self._cond.notify_all()
+
+    def stats(self):
+        now = time.time()
+        with self._cond:
+            counts = dict(self._conn.execute(
+                f"SELECT state, COUNT(*) FROM events WHERE state IN {UNFINISHED_STATES} GROUP BY state"
+            ).fetchall())
+            by_node = dict(self._conn.execute(
+                f"SELECT node, COUNT(*) FROM events WHERE state IN {UNFINISHED_STATES} GROUP BY node"
+            ).fetchall())
+            nodes = {
+                node: dict(info, last_seen=round(now - info["last_seen"], 1), unfinished=by_node.get(node, 0))
+                for node, info in self.nodes.items()
+            }
+        return {"nodes": nodes, "events": counts, "queued": sum(counts.values()), "running": counts.get("running", 0)}
+
+    def events(self, limit=50, state=None):
+        query, params = "SELECT * FROM events", []
+        if state:
+            query += " WHERE state = ?"
+            params.append(state)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._cond:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(_row_to_event(r), node=r["node"], state=r["state"], attempts=r["attempts"]) for r in rows]
+
+    # --- внутреннее (под self._cond) ---
+
+    def _complete(self, node, done):
+        now = time.time()
+        for item in done:
+            row = self._conn.execute("SELECT * FROM events WHERE id = ?", (item["id"],)).fetchone()
+            if row is None or row["state"] not in UNFINISHED_STATES:
+                continue
+            # Успешный итог от прежнего владельца принимаем, пока новый не забрал событие
+            if row["node"] != node and (row["state"] != "assigned" or item["state"] != "done"):
+                continue
+            if item["state"] == "retry":
+                # У узла переполнилась очередь — событие выдается заново
+                self._conn.execute("UPDATE events SET state = 'assigned', delivered_at = NULL WHERE id = ?",
+                                   (row["id"],))
+                continue
+            self._conn.execute("UPDATE events SET state = ?, finished_at = ? WHERE id = ?",
+                               (item["state"], now, row["id"]))
+            CLUSTER_EVENTS.inc(outcome=item["state"])
+
+    def _reassign(self, row, owner, reason, retry):
+        attempts = row["attempts"] + (1 if retry else 0)
+        if attempts >= self.max_attempts:
+            print(f"❌ Событие {row['id']} ({row['repo_name']}#{row['number']}) прервано {attempts} раз")
+            self._conn.execute("UPDATE events SET state = 'failed', attempts = ?, finished_at = ? WHERE id = ?",
+                               (attempts, time.time(), row["id"]))
+            CLUSTER_EVENTS.inc(outcome="failed")
+            return
+        self._conn.execute(
+            "UPDATE events SET node = ?, state = 'assigned', attempts = ?, delivered_at = NULL WHERE id = ?",
+            (owner, attempts, row["id"])
+        )
+        CLUSTER_REASSIGNMENTS.inc(reason=reason)
+
+    def _rebalance(self):
+        """Переносит события к владельцам по текущему кольцу."""
+        moved = 0
+        # После рестарта координатора узлы еще не прислали heartbeat — их события не трогаем
+        grace = time.time() - self.started_at < self.node_timeout
+        for row in self._conn.execute(f"SELECT * FROM events WHERE state IN {UNFINISHED_STATES}").fetchall():
+            owner = self.ring.node_for(row["repo_name"])
+            if owner is None or owner == row["node"]:
+                continue
+            alive = row["node"] in self.nodes
+            if alive and row["state"] == "running":
+                # Начатую задачу доделывает прежний узел
+                continue
+            if not alive and grace and row["state"] != "assigned":
+                continue
+            # Выданное живому узлу событие он отменит у себя по ответу на heartbeat
+            self._reassign(row, owner, "rebalance" if alive else "node_down",
+                           retry=not alive and row["state"] != "assigned")
+            moved += 1
+        if moved:
+            print(f"🔀 Перераспределено событий: {moved}")
+
+    def _monitor_loop(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            with self._cond:
+                dead = [node for node, info in self.nodes.items() if now - info["last_seen"] > self.node_timeout]
+                for node in dead:
+                    print(f"🔴 Узел {node} не отвечает {now - self.nodes[node]['last_seen']:.0f}s, задачи уходят другим")
+                    CLUSTER_MEMBERSHIP.inc(change="failure")
+                    del self.nodes[node]
+                    self.ring.remove(node)
+                # Заодно подбираем события узлов, которые так и не вернулись после рестарта координатора
+                self._rebalance()
+                self._conn.commit()
+                self._cond.notify_all()
+
+
+def _row_to_event(row):
+    return {
+        "id": row["id"], "mode": row["mode"], "installation_id": row["installation_id"],
+        "repo_name": row["repo_name"], "number": row["number"], "options": json.loads(row["options"]),
+    }
+
+
+class ClusterWorker:
+    """Узел-воркер: забирает свои события у координатора в локальный планировщик и шлет heartbeat.
+
+    ID событий лежат в options["cluster_events"] задачи: так они переживают слияние событий
+    в одну задачу и перезапуск узла (options хранятся в журнале).
+    """
+
+    def __init__(self, coordinator_url, node_id, scheduler, heartbeat=5, secret=""):
+        self.url = coordinator_url.rstrip("/")
+        self.node_id = node_id
+        self.scheduler = scheduler
+        self.interval = heartbeat
+        self.session = requests.Session()
+        if secret:
+            self.session.headers["X-Agent-Cluster-Secret"] = secret
+        self._done = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        self._send_heartbeat()
+        threading.Thread(target=self._heartbeat_loop, name="cluster-heartbeat", daemon=True).start()
+        threading.Thread(target=self._pull_loop, name="cluster-pull", daemon=True).start()
+
+    def stop(self):
+        """Плавный выход: координатор сразу отдает события узла другим."""
+        self._stop.set()
+        try:
+            self._post("/cluster/leave", {"node": self.node_id}, timeout=5)
+        except requests.RequestException as e:
+            print(f"⚠️ Cluster leave failed: {e}")
+
+    def job_finished(self, job):
+        """Хук планировщика: итог задачи отправляется координатору по всем ее событиям."""
+        events = job.options.get("cluster_events") or []
+        if not events:
+            return
+        with self._lock:
+            self._done.extend({"id": event_id, "state": job.state} for event_id in events)
+        # Сразу, не дожидаясь heartbeat; при ошибке итог уйдет со следующим heartbeat
+        threading.Thread(target=self._flush_done, name="cluster-complete", daemon=True).start()
+
+    def _post(self, path, payload, timeout=10):
+        resp = self.session.post(f"{self.url}{path}", json=payload, timeout=timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def _take_done(self):
+        with self._lock:
+            done, self._done = self._done, []
+        return done
+
+    def _return_done(self, done):
+        with self._lock:
+            self._done = done + self._done
+
+    def _flush_done(self):
+        done = self._take_done()
+        if not done:
+            return
+        try:
+            self._post("/cluster/complete", {"node": self.node_id, "done": done})
+        except requests.RequestException:
+            self._return_done(done)
+
+    def _free_slots(self):
+        stats = self.scheduler.stats()
+        return max(0, stats["max_queue"] - stats["queued"])
+
+    def _send_heartbeat(self):
+        held, running = [], []
+        for job in self.scheduler.jobs():
+            events = job.options.get("cluster_events") or []
+            held.extend(events)
+            if job.state == "running":
+                running.extend(events)
+        done = self._take_done()
+        try:
+            resp = self._post("/cluster/heartbeat", {
+                "node": self.node_id, "held": held, "running": running, "done": done, "free": self._free_slots(),
+            })
+        except requests.RequestException as e:
+            self._return_done(done)
+            print(f"⚠️ Heartbeat failed: {e}")
+            return
+        revoked = set(resp.get("revoked") or [])
+        if revoked:
+            for job in self.scheduler.jobs():
+                if revoked & set(job.options.get("cluster_events") or []):
+                    print(f"↪️  Задача {job.id} ({job.repo_name}#{job.number}) передана другому узлу")
+                    self.scheduler.revoke(job)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.interval):
+            self._send_heartbeat()
+
+    def _pull_loop(self):
+        while not self._stop.is_set():
+            limit = self._free_slots()
+            if not limit:
+                self._stop.wait(1)
+                continue
+            try:
+                events = self._post("/cluster/pull", {"node": self.node_id, "limit": limit, "wait": 20}, timeout=30)
+            except requests.RequestException as e:
+                print(f"⚠️ Cluster pull failed: {e}")
+                self._stop.wait(self.interval)
+                continue
+            for event in events.get("events", []):
+                self._accept(event)
+
+    def _accept(self, event):
+        options = dict(event["options"], cluster_events=[event["id"]])
+        try:
+            job, position = self.scheduler.submit(event["mode"], event["installation_id"], event["repo_name"],
+                                                  event["number"], options)
+        except QueueFull:
+            with self._lock:
+                self._done.append({"id": event["id"], "state": "retry"})
+            return
+        print(f"📥 Событие {event['id']} -> задача {job.id} ({event['mode']}) "
+              f"{event['repo_name']} #{event['number']}: позиция {position}")
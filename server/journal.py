@@ -0,0 +1,168 @@
+# journal.py
+"""Журнал задач в SQLite (WAL): доставки вебхуков, состояния задач и их переходы.
+
+Переживает перезапуск контейнера: при старте незавершенные задачи возвращаются в очередь.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    delivery_id TEXT PRIMARY KEY,
+    event TEXT,
+    job_id TEXT,
+    received_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    installation_id INTEGER NOT NULL,
+    repo_name TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    events INTEGER NOT NULL DEFAULT 1,
+    exit_code INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at);
+CREATE TABLE IF NOT EXISTS transitions (
+    job_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transitions_job ON transitions (job_id, at);
+"""
+
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+
+class JobJournal:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # В WAL-режиме NORMAL не теряет целостность при падении процесса и заметно быстрее FULL
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    # --- доставки вебхуков ---
+
+    def record_delivery(self, delivery_id, event):
+        """Запоминает X-GitHub-Delivery. Возвращает False, если такая доставка уже была."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO deliveries (delivery_id, event, received_at) VALUES (?, ?, ?)",
+                (delivery_id, event, time.time())
+            )
+            self._conn.commit()
+            return cur.rowcount == 1
+
+    def forget_delivery(self, delivery_id):
+        """Доставку не обработали (например, очередь полна) — повторная доставка должна пройти."""
+        with self._lock:
+            self._conn.execute("DELETE FROM deliveries WHERE delivery_id = ?", (delivery_id,))
+            self._conn.commit()
+
+    def link_delivery(self, delivery_id, job_id):
+        with self._lock:
+            self._conn.execute("UPDATE deliveries SET job_id = ? WHERE delivery_id = ?", (job_id, delivery_id))
+            self._conn.commit()
+
+    # --- задачи ---
+
+    def add(self, job):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, mode, installation_id, repo_name, number, options, state, "
+                "attempts, events, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.mode, job.installation_id, job.repo_name, int(job.number), json.dumps(job.options),
+                 job.state, job.attempts, job.events, job.created_at)
+            )
+            self._transition(job.id, job.state)
+            self._conn.commit()
+
+    def coalesced(self, job):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET options = ?, events = ? WHERE id = ?",
+                (json.dumps(job.options), job.events, job.id)
+            )
+            self._conn.commit()
+
+    def update(self, job, error=None):
+        """Сохраняет текущее состояние задачи и добавляет переход."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, attempts = ?, exit_code = ?, error = ?, started_at = ?, finished_at = ? "
+                "WHERE id = ?",
+                (job.state, job.attempts, job.exit_code, error, job.started_at, job.finished_at, job.id)
+            )
+            self._transition(job.id, job.state)
+            self._conn.commit()
+
+    def _transition(self, job_id, state):
+        self._conn.execute("INSERT INTO transitions (job_id, state, at) VALUES (?, ?, ?)", (job_id, state, time.time()))
+
+    def interrupted(self):
+        """Задачи, которые были в очереди или выполнялись в момент остановки сервера (старые — первыми)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE state IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [_row_to_dict(r) for r in rows]
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            transitions = self._conn.execute(
+                "SELECT state, at FROM transitions WHERE job_id = ? ORDER BY at", (job_id,)
+            ).fetchall()
+        job = _row_to_dict(row)
+        job["transitions"] = [dict(t) for t in transitions]
+        return job
+
+    def recent(self, limit=50, state=None, repo_name=None):
+        query, params = "SELECT * FROM jobs WHERE 1 = 1", []
+        if state:
+            query += " AND state = ?"
+            params.append(state)
+        if repo_name:
+            query += " AND repo_name = ?"
+            params.append(repo_name)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [_row_to_dict(r) for r in rows]
+
+    def prune(self, max_age):
+        """Удаляет завершенные задачи и доставки старше max_age секунд."""
+        cutoff = time.time() - max_age
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM transitions WHERE job_id IN "
+                f"(SELECT id FROM jobs WHERE state IN {FINISHED_STATES} AND created_at < ?)", (cutoff,)
+            )
+            self._conn.execute(f"DELETE FROM jobs WHERE state IN {FINISHED_STATES} AND created_at < ?", (cutoff,))
+            self._conn.execute("DELETE FROM deliveries WHERE received_at < ?", (cutoff,))
+            self._conn.commit()
+
+
+def _row_to_dict(row):
+    job = dict(row)
+    job["options"] = json.loads(job["options"])
+    return job
@@ -0,0 +1,302 @@
+# scheduler.py
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+
+class QueueFull(Exception):
+    """Очередь заполнена — вебхук нужно отклонить (429)."""
+
+
+class Job:
+    def __init__(self, mode, installation_id, repo_name, number, options=None, job_id=None):
+        # job_id передается при восстановлении задачи из журнала
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.installation_id = installation_id
+        self.repo_name = repo_name
+        self.number = number
+        # Доп. параметры задачи (например, {"full": True} для полного ревью)
+        self.options = options or {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.state = "queued"
+        self.attempts = 0
+        self.exit_code = None
+        # Дебаунс: задача не стартует раньше not_before; события в окне сливаются в нее
+        self.not_before = self.created_at
+        self.events = 1
+        # Отмена устаревшей задачи: runner проверяет флаг и кладет сюда запущенный процесс
+        self.cancelled = threading.Event()
+        self.process = None
+
+    @property
+    def key(self):
+        return (self.repo_name, self.number, self.mode)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.mode} {self.repo_name}#{self.number} {self.state}>"
+
+
+class JobScheduler:
+    """Ограниченная очередь задач с пулом воркеров.
+
+    - общий лимит очереди (backpressure);
+    - лимиты параллельности по режиму (coder/reviewer/fixer) и по репозиторию;
+    - round-robin между установками, чтобы одна установка не забивала всех;
+    - дебаунс по (репозиторий, номер, режим): серия событий сливается в одну задачу,
+      а выполняющаяся задача с тем же ключом отменяется через canceller.
+    """
+
+    def __init__(self, runner, workers=2, max_queue=100, mode_limits=None, repo_limit=1,
+                 debounce=0, debounce_max=0, canceller=None, journal=None, on_finish=None):
+        self.runner = runner
+        self.workers = workers
+        self.max_queue = max_queue
+        self.mode_limits = mode_limits or {}
+        self.repo_limit = repo_limit
+        self.debounce = debounce
+        self.debounce_max = max(debounce_max, debounce)
+        self.canceller = canceller
+        # Журнал (server/journal.py) — необязателен; без него задачи живут только в памяти
+        self.journal = journal
+        # Вызывается с задачей после ее завершения (узел кластера сообщает итог координатору)
+        self.on_finish = on_finish
+
+        self._cond = threading.Condition()
+        # installation_id -> deque[Job]; порядок ключей = порядок обхода round-robin
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._running = {}
+        self._running_by_mode = {}
+        self._running_by_repo = {}
+        self._pending = {}   # key -> ожидающая задача
+        self._active = {}    # key -> выполняющаяся задача
+        self._threads = []
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"agent-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, mode, installation_id, repo_name, number, options=None):
+        """Ставит задачу в очередь и возвращает (job, позиция в очереди).
+
+        Если такая же задача уже ждет, событие сливается с ней и окно дебаунса продлевается
+        (но не дальше debounce_max от первого события).
+        """
+        now = time.time()
+        with self._cond:
+            key = (repo_name, number, mode)
+            pending = self._pending.get(key)
+            if pending is not None:
+                for name, value in (options or {}).items():
+                    if isinstance(value, list):
+                        pending.options[name] = pending.options.get(name, []) + value
+                    elif value:
+                        pending.options[name] = value
+                pending.events += 1
+                pending.not_before = min(now + self.debounce, pending.created_at + self.debounce_max)
+                self.coalesced += 1
+                if self.journal is not None:
+                    self.journal.coalesced(pending)
+                return pending, self._position(pending)
+
+            if self._queued >= self.max_queue:
+                raise QueueFull(f"Queue is full ({self._queued}/{self.max_queue})")
+
+            # Новое событие делает выполняющуюся задачу с тем же ключом устаревшей
+            active = self._active.get(key)
+            if active is not None and not active.cancelled.is_set():
+                self._cancel(active)
+
+            job = Job(mode, installation_id, repo_name, number, options)
+            job.not_before = now + self.debounce
+            if self.journal is not None:
+                self.journal.add(job)
+            return job, self._enqueue(job)
+
+    def restore(self, record, max_attempts=3):
+        """Возвращает в очередь задачу из журнала, прерванную остановкой сервера.
+
+        Задача, которую прерывали уже max_attempts раз, помечается failed, чтобы не крутиться вечно.
+        """
+        job = Job(record["mode"], record["installation_id"], record["repo_name"], record["number"],
+                  record["options"], job_id=record["id"])
+        job.created_at = record["created_at"]
+        job.attempts = record["attempts"]
+        job.events = record["events"]
+        if job.attempts >= max_attempts:
+            job.state = "failed"
+            job.finished_at = time.time()
+            if self.journal is not None:
+                self.journal.update(job, error=f"Interrupted {job.attempts} times")
+            return None
+
+        with self._cond:
+            if job.key in self._pending:
+                # Более новая задача того же PR и режима уже в очереди
+                job.state = "cancelled"
+                job.finished_at = time.time()
+                if self.journal is not None:
+                    self.journal.update(job, error="Superseded on restore")
+                return None
+            if self.journal is not None:
+                self.journal.update(job)
+            self._enqueue(job)
+        return job
+
+    def _enqueue(self, job):
+        # Вызывается под self._cond
+        self._queues.setdefault(job.installation_id, deque()).append(job)
+        self._pending[job.key] = job
+        self._queued += 1
+        self._cond.notify()
+        return self._position(job)
+
+    def jobs(self):
+        """Снимок ожидающих и выполняющихся задач."""
+        with self._cond:
+            return list(self._pending.values()) + list(self._running.values())
+
+    def revoke(self, job):
+        """Снимает задачу, которую забрал другой узел: из очереди — сразу, выполняющуюся — отменой."""
+        with self._cond:
+            if self._pending.get(job.key) is job:
+                q = self._queues[job.installation_id]
+                q.remove(job)
+                if not q:
+                    del self._queues[job.installation_id]
+                self._queued -= 1
+                del self._pending[job.key]
+                job.state = "cancelled"
+                job.finished_at = time.time()
+                self.cancelled += 1
+                if self.journal is not None:
+                    self.journal.update(job, error="Revoked")
+            elif self._running.get(job.id) is job and not job.cancelled.is_set():
+                self._cancel(job)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": self._queued,
+                "running": len(self._running),
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "running_by_mode": dict(self._running_by_mode),
+                "coalesced": self.coalesced,
+                "cancelled": self.cancelled,
+            }
+
+    # --- внутреннее ---
+
+    def _position(self, job):
+        # При round-robin впереди окажутся задачи своей установки плюс
+        # не больше такого же количества задач от каждой из остальных
+        own = self._queues[job.installation_id]
+        ahead_own = len(own) - 1
+        ahead = ahead_own
+        for installation_id, q in self._queues.items():
+            if installation_id != job.installation_id:
+                ahead += min(len(q), ahead_own + 1)
+        return ahead + 1
+
+    def _cancel(self, job):
+        print(f"🛑 Задача {job.id} устарела ({job.repo_name}#{job.number} {job.mode}), отменяем")
+        job.cancelled.set()
+        self.cancelled += 1
+        if self.canceller is not None:
+            # Остановка процесса может занять секунды — вебхук не ждет
+            threading.Thread(target=self.canceller, args=(job,), name=f"cancel-{job.id}", daemon=True).start()
+
+    def _can_run(self, job):
+        limit = self.mode_limits.get(job.mode)
+        if limit is not None and self._running_by_mode.get(job.mode, 0) >= limit:
+            return False
+        if self.repo_limit and self._running_by_repo.get(job.repo_name, 0) >= self.repo_limit:
+            return False
+        return True
+
+    def _take_next(self):
+        """Берет первую допустимую задачу, обходя установки по кругу."""
+        now = time.time()
+        for installation_id in list(self._queues.keys()):
+            q = self._queues[installation_id]
+            for job in q:
+                if job.not_before <= now and self._can_run(job):
+                    q.remove(job)
+                    # Установку, которую только что обслужили, отправляем в конец круга
+                    self._queues.move_to_end(installation_id)
+                    if not q:
+                        del self._queues[installation_id]
+                    self._queued -= 1
+                    del self._pending[job.key]
+                    return job
+        return None
+
+    def _next_wakeup(self):
+        """Через сколько секунд истечет ближайшее окно дебаунса (None — ждать уведомления)."""
+        now = time.time()
+        # Задачи, упершиеся в лимиты, разбудит notify_all по завершении другой задачи
+        waits = [job.not_before for q in self._queues.values() for job in q if job.not_before > now]
+        if not waits:
+            return None
+        return min(waits) - now
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = self._take_next()
+                while job is None:
+                    self._cond.wait(self._next_wakeup())
+                    job = self._take_next()
+                job.state = "running"
+                job.started_at = time.time()
+                self._running[job.id] = job
+                self._active[job.key] = job
+                job.attempts += 1
+                if self.journal is not None:
+                    self.journal.update(job)
+                self._running_by_mode[job.mode] = self._running_by_mode.get(job.mode, 0) + 1
+                self._running_by_repo[job.repo_name] = self._running_by_repo.get(job.repo_name, 0) + 1
+
+            error = None
+            try:
+                job.exit_code = self.runner(job)
+                if job.cancelled.is_set():
+                    job.state = "cancelled"
+                elif job.exit_code:
+                    # Агент завершился с ошибкой — в журнале и на /jobs это неудача, а не "done"
+                    job.state = "failed"
+                    error = f"exit code {job.exit_code}"
+                else:
+                    job.state = "done"
+            except Exception as e:
+                job.state = "failed"
+                error = str(e)
+                print(f"❌ Job {job.id} failed: {e}")
+            finally:
+                job.finished_at = time.time()
+                if self.journal is not None:
+                    self.journal.update(job, error)
+                if self.on_finish is not None:
+                    try:
+                        self.on_finish(job)
+                    except Exception as e:
+                        print(f"⚠️ on_finish failed for job {job.id}: {e}")
+                with self._cond:
+                    self._running.pop(job.id, None)
+                    if self._active.get(job.key) is job:
+                        del self._active[job.key]
+                    self._running_by_mode[job.mode] -= 1
+                    self._running_by_repo[job.repo_name] -= 1
+                    if not self._running_by_repo[job.repo_name]:
+                        del self._running_by_repo[job.repo_name]
+                    # Освободился слот — задачи, упершиеся в лимиты, могут стартовать
+                    self._cond.notify_all()
@@ -1,75 +1,477 @@
 # server.py
-from flask import Flask, request, jsonify
-import threading
+from flask import Flask, request, jsonify, send_from_directory
+import hmac
+import signal
+import socket
 import subprocess
 import os
-from auth import get_installation_token
+import sys
+import time
+from configs import metrics, profiling
+from configs.config import Config
+from configs.throttle import AUTH_FAILED_EXIT_CODE
+from auth import get_app_login, get_installation_token, invalidate_installation_token, load_private_key, get_app_jwt
+from scheduler import JobScheduler, QueueFull
+from journal import JobJournal
+from cluster import ClusterBroker, ClusterWorker, NoNodes
 
 app = Flask(__name__)
 
-def run_agent_process(mode, token, repo_name, issue_number):
-    """Запускает coder.py или reviewer.py в отдельном потоке"""
+# Настройки очереди задач
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "2"))
+AGENT_QUEUE_SIZE = int(os.getenv("AGENT_QUEUE_SIZE", "50"))
+MODE_LIMITS = {
+    "coder": int(os.getenv("AGENT_MAX_CODER", "1")),
+    "reviewer": int(os.getenv("AGENT_MAX_REVIEWER", "2")),
+    "fixer": int(os.getenv("AGENT_MAX_FIXER", "1")),
+}
+# Сколько задач одного репозитория может идти одновременно
+AGENT_MAX_PER_REPO = int(os.getenv("AGENT_MAX_PER_REPO", "1"))
+# warm — форк от прогретого процесса, subprocess — холодный запуск python3 coder.py
+AGENT_WORKER_MODE = os.getenv("AGENT_WORKER_MODE", "warm")
+# Окно дебаунса: события одного PR/режима за это время сливаются в одну задачу (но не дольше MAX)
+AGENT_DEBOUNCE = float(os.getenv("AGENT_DEBOUNCE", "15"))
+AGENT_DEBOUNCE_MAX = float(os.getenv("AGENT_DEBOUNCE_MAX", "60"))
+# Сколько ждать завершения отмененной задачи после SIGTERM, прежде чем убить ее
+AGENT_CANCEL_GRACE = float(os.getenv("AGENT_CANCEL_GRACE", "10"))
+# Журнал задач (SQLite): переживает перезапуск контейнера, отсекает повторные доставки вебхуков
+AGENT_JOURNAL_PATH = os.getenv("AGENT_JOURNAL_PATH", os.path.join(os.path.expanduser("~"), ".cache", "ai-agent", "jobs.sqlite3"))
+AGENT_JOURNAL_RETENTION = int(os.getenv("AGENT_JOURNAL_RETENTION", str(7 * 24 * 3600)))
+# Сколько раз задачу можно прервать перезапуском сервера, прежде чем признать ее неудачной
+AGENT_MAX_ATTEMPTS = int(os.getenv("AGENT_MAX_ATTEMPTS", "3"))
+AGENT_PORT = int(os.getenv("AGENT_PORT", "80"))
+# Несколько узлов: single — все в одном процессе, coordinator — принимает вебхуки и раздает события
+# воркерам по consistent hashing имени репозитория, worker — забирает свои события у координатора
+AGENT_ROLE = os.getenv("AGENT_ROLE", "single")
+AGENT_COORDINATOR_URL = os.getenv("AGENT_COORDINATOR_URL", "")
+AGENT_NODE_ID = os.getenv("AGENT_NODE_ID") or f"{socket.gethostname()}:{AGENT_PORT}"
+AGENT_HEARTBEAT = float(os.getenv("AGENT_HEARTBEAT", "5"))
+AGENT_NODE_TIMEOUT = float(os.getenv("AGENT_NODE_TIMEOUT", "20"))
+# Общий секрет узлов; без него API кластера принимает запросы только с этой же машины
+AGENT_CLUSTER_SECRET = os.getenv("AGENT_CLUSTER_SECRET", "")
+AGENT_CLUSTER_PATH = os.getenv("AGENT_CLUSTER_PATH", os.path.join(os.path.dirname(AGENT_JOURNAL_PATH), "cluster.sqlite3"))
+# Процессы задач отправляют сюда свои метрики (наследуют переменную от сервера и forkserver)
+os.environ.setdefault("AGENT_METRICS_URL", f"http://127.0.0.1:{AGENT_PORT}/metrics/push")
+
+QUEUE_WAIT_SECONDS = metrics.histogram("agent_queue_wait_seconds", "Time from debounce expiry to job start")
+TOKEN_FETCH_SECONDS = metrics.histogram("agent_token_fetch_seconds", "Installation token fetch time")
+JOB_SECONDS = metrics.histogram("agent_job_seconds", "Agent process run time")
+JOBS = metrics.counter("agent_jobs_total", "Finished jobs by outcome")
+WEBHOOKS = metrics.counter("agent_webhooks_total", "Received webhooks")
+
+# Комментарий бота, который должен запускать фиксер (остальные события ботов игнорируются)
+CHANGES_REQUESTED_MARKER = "⚠️ **Review Status:** Changes requested"
+# Профилирование задачи по запросу: заголовок вебхука (ручная отправка, прокси) или метка PROFILE_LABEL
+PROFILE_HEADER = "X-Agent-Profile"
+
+warm_pool = None
+if AGENT_WORKER_MODE == "warm" and AGENT_ROLE != "coordinator":
+    from agent_worker import WarmPool
+    warm_pool = WarmPool()
+
+def _attach_process(job, process):
+    """Запоминает процесс задачи; если задачу успели отменить до старта — сразу останавливает."""
+    if job is None:
+        return
+    job.process = process
+    if job.cancelled.is_set():
+        cancel_job(job)
+
+def run_agent_process(mode, token, repo_name, issue_number, options=None, job=None):
+    """Запускает coder.py или reviewer.py в отдельном процессе"""
+    options = options or {}
+    if warm_pool is not None:
+        print(f"🚀 Запуск агента ({mode}, warm) для {repo_name} #{issue_number}")
+        process = warm_pool.start(mode, token, repo_name, issue_number, options)
+        _attach_process(job, process)
+        process.join()
+        return process.exitcode
+
     env = os.environ.copy()
-    env["GH_PAT"] = token 
+    env["GH_PAT"] = token
     env["GITHUB_REPOSITORY"] = repo_name
-    
+    if options.get("installation_id"):
+        env["GITHUB_INSTALLATION_ID"] = str(options["installation_id"])
+    if options.get("agent_login"):
+        env["AGENT_LOGIN"] = options["agent_login"]
+
     # Coder и Fixer обрабатываются скриптом coder.py
     script_name = "reviewer.py"
     if mode in ["coder", "fixer"]:
         script_name = "coder.py"
-        
+
     cmd = ["python3", script_name]
     # -----------------------------------------------
-    
+
     if mode == "coder":
         cmd.extend(["--issue", str(issue_number)])
     elif mode == "reviewer":
-        cmd.extend(["--pr", str(issue_number)]) 
+        # Замечания в ревью — не ошибка задачи: код 1 нужен только шагу CI
+        cmd.extend(["--pr", str(issue_number), "--exit-zero"])
+        if options.get("full"):
+            cmd.append("--full")
     elif mode == "fixer":
         cmd.extend(["--pr", str(issue_number), "--fix"])
+    if options.get("profile"):
+        cmd.extend(["--profile", str(options["profile"])])
 
     print(f"🚀 Запуск агента ({mode}) для {repo_name} #{issue_number}")
-    subprocess.run(cmd, env=env)
+    process = subprocess.Popen(cmd, env=env)
+    _attach_process(job, process)
+    return process.wait()
+
+def _wait_process(process, timeout):
+    """Ждет процесс (Popen или multiprocessing.Process). Возвращает True, если он завершился."""
+    if isinstance(process, subprocess.Popen):
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            return False
+        return True
+    process.join(timeout)
+    return not process.is_alive()
+
+def cancel_job(job):
+    """Останавливает процесс устаревшей задачи: SIGTERM, затем SIGKILL и уборка worktree."""
+    process = job.process
+    if process is None:
+        # Процесс еще не запущен — run_job/_attach_process увидят флаг отмены
+        return
+    process.terminate()
+    if _wait_process(process, AGENT_CANCEL_GRACE):
+        return
+    print(f"🔪 Задача {job.id} не завершилась за {AGENT_CANCEL_GRACE:.0f}s, убиваем")
+    process.kill()
+    _wait_process(process, None)
+    # Убитый процесс не успел удалить свой worktree
+    from configs.workspace import remove_stale_worktrees
+    remove_stale_worktrees(job.repo_name, process.pid)
+
+def agent_login():
+    """AGENT_LOGIN или логин бота приложения; None, если GitHub его не отдал."""
+    if os.getenv("AGENT_LOGIN"):
+        return os.getenv("AGENT_LOGIN")
+    try:
+        return get_app_login()
+    except Exception as e:
+        print(f"⚠️ Не удалось получить логин приложения: {e}")
+        return None
+
+def run_job(job):
+    """Выполняет задачу из очереди (вызывается воркером планировщика)"""
+    QUEUE_WAIT_SECONDS.observe(max(0.0, job.started_at - job.not_before), mode=job.mode)
+    if job.cancelled.is_set():
+        JOBS.inc(mode=job.mode, outcome="cancelled")
+        return
+    try:
+        # Токен берем перед самым запуском: задача могла долго стоять в очереди
+        with TOKEN_FETCH_SECONDS.time():
+            token = get_installation_token(job.installation_id)
+        # ID установки нужен задаче для общего лимита запросов к GitHub (configs/throttle.py)
+        options = dict(job.options or {}, installation_id=job.installation_id)
+        # Логин агента: ревьюер доверяет метке "уже проверено" только из его комментариев
+        options["agent_login"] = agent_login()
+        # Артефакты профиля лежат в каталоге с ID задачи и отдаются на /jobs/<id>/profile
+        if options.get("profile"):
+            options["profile"] = job.id
+        start = time.monotonic()
+        code = run_agent_process(job.mode, token, job.repo_name, job.number, options, job)
+        if code == AUTH_FAILED_EXIT_CODE and not job.cancelled.is_set():
+            # GitHub отверг закэшированный токен (отозван, сменились права установки) — берем новый, один повтор
+            print(f"🔑 Токен установки {job.installation_id} отклонен GitHub, обновляем и повторяем задачу {job.id}")
+            invalidate_installation_token(job.installation_id)
+            with TOKEN_FETCH_SECONDS.time():
+                token = get_installation_token(job.installation_id)
+            code = run_agent_process(job.mode, token, job.repo_name, job.number, options, job)
+    except Exception:
+        JOBS.inc(mode=job.mode, outcome="error")
+        raise
+    JOB_SECONDS.observe(time.monotonic() - start, mode=job.mode)
+    if job.cancelled.is_set():
+        outcome = "cancelled"
+    else:
+        outcome = "success" if code == 0 else "failure"
+    JOBS.inc(mode=job.mode, outcome=outcome)
+    return code
+
+journal = JobJournal(AGENT_JOURNAL_PATH)
+
+scheduler = JobScheduler(
+    run_job,
+    workers=AGENT_WORKERS,
+    max_queue=AGENT_QUEUE_SIZE,
+    mode_limits=MODE_LIMITS,
+    repo_limit=AGENT_MAX_PER_REPO,
+    debounce=AGENT_DEBOUNCE,
+    debounce_max=AGENT_DEBOUNCE_MAX,
+    canceller=cancel_job,
+    journal=journal,
+)
+
+broker = None
+cluster_worker = None
+if AGENT_ROLE == "coordinator":
+    broker = ClusterBroker(AGENT_CLUSTER_PATH, heartbeat=AGENT_HEARTBEAT, node_timeout=AGENT_NODE_TIMEOUT,
+                           max_attempts=AGENT_MAX_ATTEMPTS)
+elif AGENT_ROLE == "worker":
+    if not AGENT_COORDINATOR_URL:
+        raise SystemExit("AGENT_COORDINATOR_URL is required for AGENT_ROLE=worker")
+    cluster_worker = ClusterWorker(AGENT_COORDINATOR_URL, AGENT_NODE_ID, scheduler, heartbeat=AGENT_HEARTBEAT,
+                                   secret=AGENT_CLUSTER_SECRET)
+    scheduler.on_finish = cluster_worker.job_finished
+
+def forward_to_node(mode, installation_id, repo_name, number, options=None):
+    """Координатор: событие уходит узлу-владельцу репозитория (503, если живых узлов нет)"""
+    delivery_id = request.headers.get('X-GitHub-Delivery')
+    try:
+        event_id, node = broker.submit(mode, installation_id, repo_name, number, options)
+    except NoNodes as e:
+        print(f"⏳ {e}")
+        if delivery_id:
+            journal.forget_delivery(delivery_id)
+        resp = jsonify({"error": "No worker nodes available"})
+        resp.headers["Retry-After"] = "30"
+        return resp, 503
+
+    print(f"📨 Событие {event_id} ({mode}) {repo_name} #{number} -> {node}")
+    if delivery_id:
+        journal.link_delivery(delivery_id, event_id)
+    return jsonify({"msg": f"{mode.capitalize()} queued", "event_id": event_id, "node": node}), 202
+
+def enqueue(mode, installation_id, repo_name, number, options=None):
+    """Ставит задачу в очередь: 202 с позицией или 429, если очередь заполнена"""
+    if broker is not None:
+        return forward_to_node(mode, installation_id, repo_name, number, options)
+    delivery_id = request.headers.get('X-GitHub-Delivery')
+    try:
+        job, position = scheduler.submit(mode, installation_id, repo_name, number, options)
+    except QueueFull as e:
+        print(f"⏳ {e}")
+        if delivery_id:
+            # Повторная доставка этого вебхука должна пройти
+            journal.forget_delivery(delivery_id)
+        resp = jsonify({"error": "Queue is full"})
+        resp.headers["Retry-After"] = "60"
+        return resp, 429
+
+    if job.events > 1:
+        print(f"🔁 Событие слито с задачей {job.id} ({mode}) {repo_name} #{number}: событий {job.events}")
+    else:
+        print(f"📥 В очереди ({mode}) {repo_name} #{number}: позиция {position}")
+    if delivery_id:
+        journal.link_delivery(delivery_id, job.id)
+    return jsonify({"msg": f"{mode.capitalize()} queued", "job_id": job.id, "position": position}), 202
+
+def is_ignored_bot_event(event, data):
+    """События от ботов игнорируются, кроме тех, что двигают цикл ревью -> фикс:
+    PR, открытый или обновленный ботом (пуш кодера/фиксера), и комментарий ревьюера с замечаниями."""
+    if data.get('sender', {}).get('type') != 'Bot':
+        return False
+    if event == 'pull_request' and data.get('action') in ['opened', 'synchronize']:
+        return False
+    if event == 'issue_comment' and CHANGES_REQUESTED_MARKER in data.get('comment', {}).get('body', ''):
+        return False
+    return True
+
+def wants_profile(data):
+    """Профилировать задачу: заголовок X-Agent-Profile или метка PROFILE_LABEL на issue/PR."""
+    if request.headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes"):
+        return True
+    item = data.get('pull_request') or data.get('issue') or {}
+    return any(label.get('name') == Config.PROFILE_LABEL for label in item.get('labels') or [])
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
+    if AGENT_ROLE == "worker":
+        return jsonify({"error": "This node is a worker, send webhooks to the coordinator"}), 409
     data = request.json
     event = request.headers.get('X-GitHub-Event')
-    
+
+    # Повторная доставка того же вебхука (redeliver или ретрай GitHub) не должна запускать задачу второй раз
+    WEBHOOKS.inc(event=event or "unknown")
+    delivery_id = request.headers.get('X-GitHub-Delivery')
+    if delivery_id and not journal.record_delivery(delivery_id, event):
+        return jsonify({"msg": "Duplicate delivery ignored"}), 200
+
     # Проверка, что это событие от нашей установки
     if 'installation' not in data:
         return jsonify({"msg": "No installation data"}), 200
 
     installation_id = data['installation']['id']
     repo_name = data['repository']['full_name']
-    
-    # Получаем токен для этого репозитория
-    try:
-        token = get_installation_token(installation_id)
-    except Exception as e:
-        print(f"Auth Error: {e}")
-        return jsonify({"error": "Auth failed"}), 500
+
+    # События ботов (в том числе наши собственные) отсекаем до выдачи токена и клона
+    if is_ignored_bot_event(event, data):
+        return jsonify({"msg": "Bot event ignored"}), 200
+
+    options = {"profile": True} if wants_profile(data) else {}
 
     # ЛОГИКА ТРИГГЕРОВ
-    
+
     # 1. New Issue -> Coder
     if event == 'issues' and data['action'] == 'opened':
-        threading.Thread(target=run_agent_process, args=("coder", token, repo_name, data['issue']['number'])).start()
-        return jsonify({"msg": "Coder started"}), 200
+        return enqueue("coder", installation_id, repo_name, data['issue']['number'], options)
 
     # 2. PR Opened/Sync -> Reviewer
     if event == 'pull_request' and data['action'] in ['opened', 'synchronize']:
-        threading.Thread(target=run_agent_process, args=("reviewer", token, repo_name, data['number'])).start()
-        return jsonify({"msg": "Reviewer started"}), 200
+        return enqueue("reviewer", installation_id, repo_name, data['number'], options)
 
     # 3. Comment -> Fixer
     if event == 'issue_comment' and data['action'] == 'created':
+        # "/review" в комментарии к PR — явный запрос полного повторного ревью
+        if 'pull_request' in data['issue'] and data['comment']['body'].strip().startswith("/review"):
+            return enqueue("reviewer", installation_id, repo_name, data['issue']['number'], dict(options, full=True))
+
         # Если это PR и коммент не содержит LGTM
         if 'pull_request' in data['issue'] and "LGTM" not in data['comment']['body']:
-             threading.Thread(target=run_agent_process, args=("fixer", token, repo_name, data['issue']['number'])).start()
-             return jsonify({"msg": "Fixer started"}), 200
+            return enqueue("fixer", installation_id, repo_name, data['issue']['number'], options)
 
     return jsonify({"msg": "Event ignored"}), 200
 
+@app.route('/queue', methods=['GET'])
+def queue_status():
+    if broker is not None:
+        return jsonify(broker.stats()), 200
+    return jsonify(scheduler.stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    stats = broker.stats() if broker is not None else scheduler.stats()
+    gauges = [
+        "# TYPE agent_queue_depth gauge", f"agent_queue_depth {stats['queued']}",
+        "# TYPE agent_jobs_running gauge", f"agent_jobs_running {stats['running']}",
+    ]
+    if broker is not None:
+        gauges += ["# TYPE agent_cluster_nodes gauge", f"agent_cluster_nodes {len(stats['nodes'])}"]
+    body = metrics.render() + "\n".join(gauges) + "\n"
+    return body, 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route('/metrics/push', methods=['POST'])
+def metrics_push():
+    # Принимаем только от процессов задач на этой же машине
+    if request.remote_addr not in ("127.0.0.1", "::1"):
+        return jsonify({"error": "Forbidden"}), 403
+    metrics.merge(request.json or {})
+    return jsonify({"msg": "ok"}), 200
+
+@app.route('/jobs', methods=['GET'])
+def jobs_list():
+    limit = min(int(request.args.get('limit', 50)), 500)
+    jobs = journal.recent(limit, state=request.args.get('state'), repo_name=request.args.get('repo'))
+    return jsonify({"jobs": jobs}), 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = journal.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if profiling.list_artifacts(job_id) is not None:
+        job["profile"] = f"/jobs/{job_id}/profile"
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/profile', methods=['GET'])
+def job_profile(job_id):
+    # Профиль лежит на узле, который выполнял задачу (в кластере — на воркере)
+    artifacts = profiling.list_artifacts(job_id)
+    if artifacts is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify({"job_id": job_id, "artifacts": artifacts}), 200
+
+@app.route('/jobs/<job_id>/profile/<name>', methods=['GET'])
+def job_profile_artifact(job_id, name):
+    if not profiling.valid_job_id(job_id):
+        return jsonify({"error": "Profile not found"}), 404
+    # cpu.prof и *.snapshot — бинарные (pstats / tracemalloc.Snapshot.load), отдаем файлом
+    return send_from_directory(profiling.profile_dir(job_id), name, as_attachment=not name.endswith((".txt", ".json")))
+
+# --- API кластера (координатор) ---
+
+def _cluster_authorized():
+    if AGENT_CLUSTER_SECRET:
+        return hmac.compare_digest(request.headers.get("X-Agent-Cluster-Secret", ""), AGENT_CLUSTER_SECRET)
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+def _cluster_request():
+    """Тело запроса узла или ответ с ошибкой, если это не координатор или узел не авторизован."""
+    if broker is None:
+        return None, (jsonify({"error": "Not a coordinator"}), 404)
+    if not _cluster_authorized():
+        return None, (jsonify({"error": "Forbidden"}), 403)
+    data = request.json or {}
+    if not data.get("node"):
+        return None, (jsonify({"error": "node is required"}), 400)
+    return data, None
+
+@app.route('/cluster/heartbeat', methods=['POST'])
+def cluster_heartbeat():
+    data, error = _cluster_request()
+    if error:
+        return error
+    revoked = broker.heartbeat(data["node"], data.get("held", []), data.get("running", []),
+                               data.get("done", []), data.get("free", 0))
+    return jsonify({"revoked": revoked}), 200
+
+@app.route('/cluster/pull', methods=['POST'])
+def cluster_pull():
+    data, error = _cluster_request()
+    if error:
+        return error
+    wait = min(float(data.get("wait", 0)), 30)
+    return jsonify({"events": broker.pull(data["node"], int(data.get("limit", 1)), wait)}), 200
+
+@app.route('/cluster/complete', methods=['POST'])
+def cluster_complete():
+    data, error = _cluster_request()
+    if error:
+        return error
+    broker.complete(data["node"], data.get("done", []))
+    return jsonify({"msg": "ok"}), 200
+
+@app.route('/cluster/leave', methods=['POST'])
+def cluster_leave():
+    data, error = _cluster_request()
+    if error:
+        return error
+    broker.leave(data["node"])
+    return jsonify({"msg": "ok"}), 200
+
+@app.route('/cluster', methods=['GET'])
+def cluster_status():
+    if broker is None:
+        return jsonify({"role": AGENT_ROLE, "node": AGENT_NODE_ID}), 200
+    limit = min(int(request.args.get('limit', 50)), 500)
+    return jsonify(dict(broker.stats(), role=AGENT_ROLE,
+                        recent=broker.events(limit, state=request.args.get('state')))), 200
+
+def restore_jobs():
+    """Возвращает в очередь задачи, прерванные перезапуском сервера."""
+    journal.prune(AGENT_JOURNAL_RETENTION)
+    restored = 0
+    for record in journal.interrupted():
+        if scheduler.restore(record, AGENT_MAX_ATTEMPTS) is not None:
+            restored += 1
+    if restored:
+        print(f"♻️  Восстановлено задач из журнала: {restored}")
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=80) # Слушаем порт 80 для облака
\ No newline at end of file
+    # Ключ читаем и JWT подписываем один раз при старте, а не на каждый вебхук
+    load_private_key()
+    get_app_jwt()
+    if broker is not None:
+        # Координатор задачи не выполняет: только журнал доставок и очередь событий по узлам
+        journal.prune(AGENT_JOURNAL_RETENTION)
+        broker.start()
+    else:
+        if warm_pool is not None:
+            warm_pool.warm_up()
+        restore_jobs()
+        scheduler.start()
+    if cluster_worker is not None:
+        # SIGTERM -> SystemExit: узел успевает сообщить координатору, что уходит
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+        cluster_worker.start()
+    try:
+        app.run(host='0.0.0.0', port=AGENT_PORT) # По умолчанию порт 80 для облака
+    finally:
+        if cluster_worker is not None:
+            cluster_worker.stop()
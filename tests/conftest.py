@@ -0,0 +1,13 @@
+# conftest.py
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули сервера импортируются так же, как в server.py: "from scheduler import ..."
+sys.path[:0] = [ROOT, os.path.join(ROOT, "server")]
+
+# До импорта конфига: кэши и workspace тестов — во временном каталоге, а не в ~/.cache
+_tmp = tempfile.mkdtemp(prefix="agent-tests-")
+os.environ.setdefault("AGENT_CACHE_DIR", os.path.join(_tmp, "cache"))
+os.environ.setdefault("WORKSPACE_DIR", os.path.join(_tmp, "workspaces"))
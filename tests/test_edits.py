@@ -0,0 +1,145 @@
+# test_edits.py
+import os
+import stat
+
+import pytest
+
+from configs.edits import (
+    EditError, FileStreamParser, StreamFormatError, apply_edits, apply_hunk, parse_files, parse_hunks, resolve_path,
+    write_file_atomic
+)
+
+SOURCE = """def greet(name):
+    if name:
+        return f"Hello, {name}"
+    return "Hello"
+
+
+def farewell(name):
+    return f"Bye, {name}"
+"""
+
+
+def edit_block(*hunks):
+    return "".join(f"<<<<<<< SEARCH\n{search}=======\n{replace}>>>>>>> REPLACE\n" for search, replace in hunks)
+
+
+def test_parse_hunks():
+    body = edit_block(("a = 1\n", "a = 2\n"), ("", "b = 3\n"))
+    assert parse_hunks(body) == [("a = 1\n", "a = 2\n"), ("", "b = 3\n")]
+
+
+def test_exact_match():
+    text, how = apply_hunk(SOURCE, '    return "Hello"\n', '    return "Hi"\n')
+    assert how == "exact"
+    assert '    return "Hi"\n' in text and '    return "Hello"\n' not in text
+
+
+def test_trailing_whitespace_is_ignored():
+    text, how = apply_hunk(SOURCE, "def farewell(name):   \n", "def farewell(name, polite=False):\n")
+    assert how == "whitespace"
+    assert "def farewell(name, polite=False):\n    return" in text
+
+
+def test_indent_shift_is_applied_to_replacement():
+    # Модель потеряла отступ блока: замена получает отступ найденного места
+    search = "if name:\n    return f\"Hello, {name}\"\n"
+    replace = "if name:\n    name = name.strip()\n    return f\"Hello, {name}\"\n"
+    text, how = apply_hunk(SOURCE, search, replace)
+    assert how == "indent"
+    assert "    if name:\n        name = name.strip()\n        return f\"Hello, {name}\"\n" in text
+
+
+def test_fuzzy_match():
+    search = 'def farewell(name):\n    return f"Bye {name}"\n'
+    text, how = apply_hunk(SOURCE, search, 'def farewell(name):\n    return f"Goodbye, {name}"\n')
+    assert how.startswith("fuzzy")
+    assert 'return f"Goodbye, {name}"' in text and "Bye, " not in text
+
+
+def test_ambiguous_match_is_rejected():
+    text = "x = 1\ny = 2\nx = 1\n"
+    with pytest.raises(EditError, match="ambiguous"):
+        apply_hunk(text, "x = 1\n", "x = 3\n")
+
+
+def test_missing_search_is_rejected():
+    with pytest.raises(EditError, match="not found"):
+        apply_hunk(SOURCE, "class Unrelated:\n    pass\n", "")
+
+
+def test_empty_search_appends():
+    text, how = apply_hunk("a = 1", "", "b = 2\n")
+    assert (text, how) == ("a = 1\nb = 2\n", "append")
+
+
+def test_apply_edits_reports_each_hunk():
+    text, report = apply_edits(SOURCE, [('    return "Hello"\n', '    return "Hi"\n'),
+                                        ("class Missing:\n", "")])
+    assert '    return "Hi"\n' in text
+    assert [r["ok"] for r in report] == [True, False]
+    assert report[1]["hunk"] == 2 and "not found" in report[1]["error"]
+
+
+def test_stream_parser_yields_files_across_chunks():
+    response = ('Sure!\n<FILE path="a.py">\nprint(1)\n</FILE>\n'
+                '<EDIT path="b.py">\n' + edit_block(("x\n", "y\n")) + '</EDIT>\n')
+    parser = FileStreamParser()
+    files = []
+    # Куски по 3 символа: теги приходят по частям
+    for i in range(0, len(response), 3):
+        files += parser.feed(response[i:i + 3])
+    parser.close()
+
+    assert files == parse_files(response)
+    assert [(f["path"], f["kind"]) for f in files] == [("a.py", "file"), ("b.py", "edit")]
+    assert files[0]["content"] == "print(1)"
+
+
+def test_stream_parser_detects_truncation():
+    parser = FileStreamParser()
+    parser.feed('<FILE path="a.py">\nprint(1)\n')
+    with pytest.raises(StreamFormatError, match="truncated"):
+        parser.close()
+
+
+def test_stream_parser_rejects_prose():
+    with pytest.raises(StreamFormatError, match="outside"):
+        FileStreamParser().feed("I think " * 1000)
+
+
+@pytest.mark.parametrize("path", [
+    "coder.py", "./coder.py", "configs//llm.py", "configs/../coder.py", "configs/./llm.py",
+    "../outside.py", "/etc/passwd",
+])
+def test_resolve_path_rejects_protected_and_outside(tmp_path, path):
+    (tmp_path / "configs").mkdir()
+    assert resolve_path(str(tmp_path), path) is None
+
+
+def test_resolve_path_rejects_symlink_escape(tmp_path):
+    (tmp_path / "link").symlink_to(tmp_path.parent)
+    assert resolve_path(str(tmp_path), "link/file.py") is None
+
+
+@pytest.mark.parametrize("path", ["app.py", "configs/llm_utils.py", "pkg/./mod.py"])
+def test_resolve_path_allows_project_files(tmp_path, path):
+    full_path = resolve_path(str(tmp_path), path)
+    assert full_path == os.path.join(os.path.realpath(tmp_path), os.path.normpath(path))
+
+
+def test_write_file_atomic_keeps_mode(tmp_path):
+    script = tmp_path / "run.sh"
+    script.write_text("echo old\n")
+    script.chmod(0o755)
+    write_file_atomic(str(tmp_path), "run.sh", "echo new\n")
+    assert script.read_text() == "echo new\n"
+    assert stat.S_IMODE(script.stat().st_mode) == 0o755
+    # Временные файлы не остаются
+    assert os.listdir(tmp_path) == ["run.sh"]
+
+
+def test_write_file_atomic_refuses_protected(tmp_path):
+    with pytest.raises(PermissionError):
+        write_file_atomic(str(tmp_path), "./reviewer.py", "")
+    assert not (tmp_path / "reviewer.py").exists()
@@ -0,0 +1,109 @@
+# test_fix_plan.py
+from configs.context import RepoIndex
+from configs.fix_plan import direct_dependencies, mentioned_files, plan_fixes, split_findings, _group
+
+PATHS = ["src/app.py", "src/data.py", "src/a.py", "lib/util.py", "web/util.py", "README.md"]
+
+
+def test_split_findings_items_and_footer():
+    feedback = (
+        "Есть проблемы:\n"
+        "1. В `src/app.py` нет проверки.\n"
+        "   Подробности на второй строке.\n"
+        "2) Исправить src/data.py\n"
+        "**3.** Общее замечание\n"
+        "⚠️ **Review Status:** Changes requested\n"
+        "<!-- ai-reviewer: abc123 -->\n"
+    )
+    items = split_findings(feedback)
+    assert len(items) == 3
+    assert items[0].startswith("1.") and "второй строке" in items[0]
+    assert items[2] == "**3.** Общее замечание"
+    assert not any("Review Status" in item or "ai-reviewer" in item for item in items)
+
+
+def test_split_findings_without_list():
+    assert split_findings("Все хорошо, но стоит подумать о тестах.") == []
+
+
+def test_mentioned_files_full_path_and_unique_basename():
+    assert mentioned_files("см. src/app.py и README.md", PATHS) == {"src/app.py", "README.md"}
+    # Имя файла однозначно — находим по нему
+    assert mentioned_files("в app.py ошибка", PATHS) == {"src/app.py"}
+    # util.py есть в двух каталогах — по имени не угадываем
+    assert mentioned_files("в util.py ошибка", PATHS) == set()
+    assert mentioned_files("в web/util.py ошибка", PATHS) == {"web/util.py"}
+
+
+def test_mentioned_files_whole_names_only():
+    # "a.py" не должен находиться внутри "data.py"
+    assert mentioned_files("поправить data.py", PATHS) == {"src/data.py"}
+
+
+def test_group_joins_findings_with_shared_file():
+    findings = [
+        "1. src/app.py и src/data.py расходятся",
+        "2. src/data.py: нет обработки ошибок",
+        "3. lib/util.py: лишний импорт",
+        "4. Добавить тесты",
+    ]
+    groups, general = _group(findings, PATHS)
+    assert sorted(groups) == [
+        (["lib/util.py"], [findings[2]]),
+        (["src/app.py", "src/data.py"], [findings[0], findings[1]]),
+    ]
+    assert general == [findings[3]]
+
+
+def test_python_dependencies():
+    known = {"pkg/__init__.py", "pkg/models.py", "pkg/sub/helpers.py", "pkg/sub/main.py", "top.py"}
+    text = (
+        "import os\n"
+        "import top\n"
+        "from pkg import models\n"
+        "from . import helpers\n"
+        "from ..models import User\n"
+    )
+    deps = direct_dependencies("pkg/sub/main.py", text, known)
+    assert deps == ["top.py", "pkg/__init__.py", "pkg/models.py", "pkg/sub/helpers.py"]
+
+
+def test_js_dependencies():
+    known = {"src/app.ts", "src/api/index.ts", "src/util.js", "lib/x.js"}
+    text = (
+        "import React from 'react';\n"
+        "import { get } from './api';\n"
+        "const util = require('./util');\n"
+        "import '../lib/x.js';\n"
+    )
+    assert direct_dependencies("src/app.ts", text, known) == ["src/api/index.ts", "src/util.js", "lib/x.js"]
+
+
+def _repo(tmp_path):
+    files = {
+        "app.py": "from helpers import clean\n\ndef handler(x):\n    return clean(x)\n",
+        "helpers.py": "def clean(x):\n    return x.strip()\n",
+        "db.py": "def connect():\n    return None\n",
+    }
+    for name, text in files.items():
+        (tmp_path / name).write_text(text)
+    return str(tmp_path)
+
+
+def test_plan_fixes_single_group_is_not_split(tmp_path):
+    root = _repo(tmp_path)
+    assert plan_fixes(root, "1. app.py: нет проверки\n2. app.py: опечатка") is None
+    assert plan_fixes(root, "Нужно больше тестов") is None
+
+
+def test_plan_fixes_groups_with_dependencies(tmp_path):
+    root = _repo(tmp_path)
+    index = RepoIndex.build(root)
+    tasks = plan_fixes(root, "1. app.py: нет проверки\n2. db.py: не закрывается соединение\n3. Обновить документацию", index)
+
+    assert [t.name for t in tasks] == ["app.py", "db.py", "general"]
+    app, db, general = tasks
+    # Группа видит свой файл и то, что он импортирует, но не чужие файлы
+    assert 'path="helpers.py"' in app.context and 'path="db.py"' not in app.context
+    assert 'path="app.py"' not in db.context
+    assert general.targets == [] and "документацию" in general.findings
@@ -0,0 +1,149 @@
+# test_scheduler.py
+import threading
+import time
+
+import pytest
+
+from scheduler import JobScheduler, QueueFull
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class FakeJournal:
+    def __init__(self):
+        self.updates = []
+
+    def add(self, job):
+        pass
+
+    def coalesced(self, job):
+        pass
+
+    def update(self, job, error=None):
+        self.updates.append((job.id, job.state, job.exit_code, error))
+
+
+def test_queue_full():
+    scheduler = JobScheduler(lambda job: 0, max_queue=2)
+    scheduler.submit("coder", 1, "o/r", 1)
+    scheduler.submit("coder", 1, "o/r", 2)
+    with pytest.raises(QueueFull):
+        scheduler.submit("coder", 1, "o/r", 3)
+
+
+def test_exit_code_sets_final_state():
+    journal = FakeJournal()
+
+    def runner(job):
+        if job.number == 3:
+            raise RuntimeError("boom")
+        return job.number
+
+    scheduler = JobScheduler(runner, workers=2, repo_limit=0, journal=journal)
+    scheduler.start()
+    jobs = [scheduler.submit("reviewer", 1, "o/r", n)[0] for n in (0, 2, 3)]
+    wait_for(lambda: all(job.finished_at for job in jobs))
+
+    assert [job.state for job in jobs] == ["done", "failed", "failed"]
+    errors = {job_id: error for job_id, state, _, error in journal.updates if state == "failed"}
+    assert errors[jobs[1].id] == "exit code 2"
+    assert errors[jobs[2].id] == "boom"
+    assert scheduler.stats()["running"] == 0
+
+
+def test_repo_and_mode_limits():
+    release = threading.Event()
+    scheduler = JobScheduler(lambda job: release.wait(5) and 0, workers=3, mode_limits={"coder": 1}, repo_limit=1)
+    scheduler.start()
+    a, _ = scheduler.submit("reviewer", 1, "o/a", 1)
+    b, _ = scheduler.submit("reviewer", 1, "o/a", 2)
+    c, _ = scheduler.submit("coder", 1, "o/c", 1)
+    d, _ = scheduler.submit("coder", 1, "o/d", 1)
+    wait_for(lambda: a.state == "running" and c.state == "running")
+    time.sleep(0.1)
+    # Второй задаче репозитория и второму кодеру приходится ждать
+    assert b.state == "queued" and d.state == "queued"
+
+    release.set()
+    wait_for(lambda: all(job.state == "done" for job in (a, b, c, d)))
+
+
+def test_round_robin_between_installations():
+    order = []
+    scheduler = JobScheduler(lambda job: order.append(job.installation_id), workers=1, repo_limit=0)
+    for n in range(3):
+        scheduler.submit("reviewer", "busy", "o/busy", n)
+    _, position = scheduler.submit("reviewer", "quiet", "o/quiet", 1)
+    # Задача тихой установки не ждет всю очередь шумной
+    assert position == 2
+
+    scheduler.start()
+    wait_for(lambda: len(order) == 4)
+    assert order[:2] == ["busy", "quiet"]
+
+
+def test_events_within_debounce_are_coalesced():
+    started = []
+    scheduler = JobScheduler(lambda job: started.append(job) or 0, workers=1, debounce=0.3, debounce_max=1)
+    scheduler.start()
+    job, _ = scheduler.submit("reviewer", 1, "o/r", 7, {"comments": ["a"]})
+    same, _ = scheduler.submit("reviewer", 1, "o/r", 7, {"comments": ["b"], "full": True})
+
+    assert same is job
+    assert job.events == 2
+    assert job.options == {"comments": ["a", "b"], "full": True}
+    time.sleep(0.15)
+    assert not started, "job started inside the debounce window"
+    wait_for(lambda: job.state == "done")
+    assert started == [job]
+    assert scheduler.stats()["coalesced"] == 1
+
+
+def test_debounce_window_is_capped():
+    scheduler = JobScheduler(lambda job: 0, debounce=10, debounce_max=10)
+    job, _ = scheduler.submit("reviewer", 1, "o/r", 1)
+    job.created_at -= 9.5
+    scheduler.submit("reviewer", 1, "o/r", 1)
+    # Новое событие продлевает окно, но не дальше debounce_max от первого
+    assert job.not_before <= job.created_at + 10
+
+
+def test_new_event_cancels_running_job():
+    cancelled = []
+    release = threading.Event()
+
+    def runner(job):
+        release.wait(5)
+        return 0
+
+    scheduler = JobScheduler(runner, workers=2, repo_limit=0,
+                             canceller=lambda job: (cancelled.append(job), release.set()))
+    scheduler.start()
+    first, _ = scheduler.submit("fixer", 1, "o/r", 3)
+    wait_for(lambda: first.state == "running")
+    second, _ = scheduler.submit("fixer", 1, "o/r", 3)
+
+    assert second is not first
+    wait_for(lambda: first.state == "cancelled")
+    assert cancelled == [first]
+    wait_for(lambda: second.state == "done")
+    assert scheduler.stats()["cancelled"] == 1
+
+
+def test_revoke_pending_job():
+    journal = FakeJournal()
+    scheduler = JobScheduler(lambda job: 0, journal=journal)
+    job, _ = scheduler.submit("coder", 1, "o/r", 1)
+    scheduler.revoke(job)
+
+    assert job.state == "cancelled"
+    assert scheduler.stats()["queued"] == 0
+    assert journal.updates[-1][3] == "Revoked"
+    # Ключ освободился: следующее событие — новая задача
+    assert scheduler.submit("coder", 1, "o/r", 1)[0] is not job
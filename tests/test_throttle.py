@@ -0,0 +1,67 @@
+# test_throttle.py
+import pytest
+import requests
+
+from configs import throttle
+
+
+@pytest.fixture(autouse=True)
+def clean_side_effects(monkeypatch):
+    monkeypatch.setattr(throttle, "side_effects", False)
+
+
+def http_error(status, text=""):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} {text}", response=response)
+
+
+class LLMAuthError(Exception):
+    # Как у SDK провайдера LLM: 401, но не от GitHub
+    status_code = 401
+
+
+def test_github_401_is_auth_failure():
+    assert throttle.is_github_auth_error(http_error(401))
+    assert throttle.failure_exit_code(http_error(401)) == throttle.AUTH_FAILED_EXIT_CODE
+
+
+def test_pygithub_bad_credentials():
+    github = pytest.importorskip("github")
+    e = github.BadCredentialsException(401, {"message": "Bad credentials"}, None)
+    assert throttle.failure_exit_code(e) == throttle.AUTH_FAILED_EXIT_CODE
+
+
+def test_other_errors_are_plain_failures():
+    assert throttle.failure_exit_code(http_error(404)) == 1
+    assert throttle.failure_exit_code(LLMAuthError("invalid api key")) == 1
+    assert throttle.failure_exit_code(RuntimeError("Bad credentials")) == 1
+
+
+def test_no_retry_after_side_effect():
+    # Комментарий или пуш уже на GitHub: повтор задачи их продублирует
+    throttle.mark_side_effect()
+    assert throttle.failure_exit_code(http_error(401)) == 1
+
+
+def test_retry_after_seconds():
+    assert throttle.retry_after_seconds({"Retry-After": "7"}) == 7.0
+    assert throttle.retry_after_seconds({}) is None
+    assert throttle.retry_after_seconds({"X-RateLimit-Remaining": "5", "X-RateLimit-Reset": "1"}) is None
+
+
+def test_call_retries_then_gives_up(monkeypatch):
+    monkeypatch.setattr(throttle.time, "sleep", lambda s: None)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise http_error(503)
+        return "ok"
+
+    assert throttle.call(flaky, [], max_attempts=5) == "ok"
+    assert len(calls) == 3
+
+    with pytest.raises(requests.HTTPError):
+        throttle.call(lambda: (_ for _ in ()).throw(http_error(401)), [], max_attempts=5)
@@ -0,0 +1,80 @@
+# test_triage.py
+import pytest
+
+from configs import triage as triage_module
+from configs.triage import change_blocks, classify, triage
+
+SKIP = triage_module._patterns("*.lock,*.min.js,vendor/*")
+
+
+def entry(filename, patch=None, status="modified", binary=False):
+    text = f"File: {filename}\nStatus: BINARY CHANGED" if binary else f"File: {filename}\nDiff:\n{patch}"
+    return {"filename": filename, "status": status, "patch": patch, "text": text}
+
+
+def hunk(*lines):
+    return "@@ -1,3 +1,3 @@\n" + "\n".join(lines)
+
+
+def test_change_blocks_split_on_context():
+    patch = hunk(" a", "-b", "+B", " c", "+d", "\\ No newline at end of file")
+    assert change_blocks(patch) == [(["b"], ["B"]), ([], ["d"])]
+
+
+@pytest.mark.parametrize("filename,patch", [
+    ("app.py", hunk(" x = 1", "+", " y = 2")),
+    ("app.py", hunk("-x = 1  # old", "+x = 1  # new comment")),
+    ("app.py", hunk(" def f():", "+    # explain", "     return 1")),
+    ("app.js", hunk("-  const a = 1;", "+    const a = 1;   ")),
+    ("app.go", hunk("-// old comment", "+// new comment", " x := 1")),
+])
+def test_cosmetic_changes(filename, patch):
+    assert classify(entry(filename, patch), SKIP) == "cosmetic"
+
+
+@pytest.mark.parametrize("filename,patch", [
+    # Перестановка строк меняет порядок выполнения
+    ("app.py", hunk("-a()", "-b()", "+b()", "+a()")),
+    # Перенос кода в другое место файла
+    ("app.py", "@@ -1,2 +1,1 @@\n-a()\n b()\n@@ -9,1 +8,2 @@\n c()\n+a()"),
+    # В Python отступ — часть кода
+    ("app.py", hunk("-    return x", "+return x")),
+    # "#" внутри строки — не комментарий
+    ("app.py", hunk('-url = "a#b"', '+url = "a#c"')),
+    ("app.js", hunk("-  if (a) {", "+  if (a) {}")),
+    # Хвостовой "//" вне Python не отрезается: он бывает и внутри строк ("http://...")
+    ("app.go", hunk("-x := 1 // old", "+x := 1")),
+    ("app.py", hunk("-x = 1", "+x = 2")),
+])
+def test_code_changes_are_reviewed(filename, patch):
+    assert classify(entry(filename, patch), SKIP) is None
+
+
+def test_trivial_reasons():
+    assert classify(entry("old.py", status="removed"), SKIP) == "removed"
+    assert classify(entry("logo.png", binary=True), SKIP) == "binary"
+    assert classify(entry("poetry.lock", hunk("-a", "+b")), SKIP) == "generated"
+    assert classify(entry("vendor/lib.js", hunk("-a", "+b")), SKIP) == "generated"
+
+
+def test_all_trivial_is_skipped(monkeypatch):
+    monkeypatch.setattr(triage_module.Config, "REVIEW_SKIP_PATTERNS", "*.lock")
+    result = triage([entry("poetry.lock", hunk("-a", "+b")), entry("app.py", hunk("-x = 1", "+x = 1  # why"))])
+    assert result.tier == "skip"
+    assert result.entries == []
+    assert dict(result.trivial) == {"poetry.lock": "generated", "app.py": "cosmetic"}
+
+
+def test_small_large_and_risky_tiers(monkeypatch):
+    monkeypatch.setattr(triage_module.Config, "REVIEW_SMALL_MAX_LINES", 4)
+    monkeypatch.setattr(triage_module.Config, "REVIEW_RISKY_PATTERNS", "*auth*")
+    small = entry("app.py", hunk("-x = 1", "+x = 2"))
+    big = entry("big.py", hunk(*[f"+line{i} = {i}" for i in range(5)]))
+
+    result = triage([small, entry("poetry.lock", status="removed")])
+    assert result.tier == "small"
+    assert result.entries == [small] and result.changed_lines == 2
+
+    assert triage([big]).tier == "large"
+    risky = triage([entry("server/auth.py", hunk("-x = 1", "+x = 2"))])
+    assert risky.tier == "large" and "risky" in risky.reason